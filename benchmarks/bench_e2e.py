@@ -0,0 +1,215 @@
+"""
+Offline end to end benchmark of JavlibrarySearcher.search against the local stand-in server.
+
+For each scale a fresh database is created, the tag vocabulary imported, and the workload's codes
+searched concurrently, storing the matched videos with a VideoManager. The codes mix the
+single hit, multiple result, ambiguous and not found flows of benchmarks/standin.py.
+Reports throughput, p50/p99 search latency, parse time and database time as JSON, so runs of
+different releases can be compared.
+
+usage: python benchmarks/bench_e2e.py [--scales 100 1000 10000] [--concurrency 8] [--latency 0.0]
+                                      [--error-rate 0.0] [--output results.json]
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import requests
+from henpy.metrics import Metrics
+from henpy.persist.managers import VideoManager
+from henpy.searchers.searchers import JavlibrarySearcher
+from henpy.searchers.refresh import classify
+from henpy.utilities.tagtools import SQLTagManager
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+TAG_FILE = os.path.join(BENCH_DIR, "..", "supplementary", "tagdata.tsv")
+DEFAULT_MIX = {"SGL": 0.8, "MUL": 0.1, "AMB": 0.05, "MIS": 0.05}
+
+
+class LocalSearcher(JavlibrarySearcher):
+    """JavlibrarySearcher with plain sessions, the stand-in has no cloudflare challenge"""
+
+    def _create_session(self):
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=32)
+        session.mount("http://", adapter)
+        return session
+
+
+def serve(port, latency, jitter, error_rate, error_status, seed):
+    # Runs in its own process, so the server doesn't compete with the searcher for the GIL
+    sys.path.insert(0, BENCH_DIR)
+    from standin import StandinServer
+    StandinServer(port, latency, jitter, error_rate, error_status, seed=seed).httpd.serve_forever()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(url, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            requests.get(url + "/en/", timeout=1)
+            return
+        except requests.ConnectionError:
+            time.sleep(0.05)
+    raise RuntimeError(f"Stand-in server didn't come up at {url}")
+
+
+def workload(scale, mix):
+    """Codes of a workload, spread over the flows according to mix"""
+    codes = []
+    for prefix, share in mix.items():
+        codes.extend(f"{prefix}-{i:03d}" for i in range(1, int(round(scale * share)) + 1))
+    return codes
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+def run_scale(url, scale, mix, concurrency, batch_size):
+    directory = tempfile.mkdtemp(prefix="henpy_bench_")
+    try:
+        metrics = Metrics()
+        tm = SQLTagManager("sqlite:///" + os.path.join(directory, "bench.db"), metrics=metrics)
+        tm.import_tags(TAG_FILE)
+        vm = VideoManager(tm.engine)
+        searcher = LocalSearcher(tm, per_host_limit=concurrency * 2, metrics=metrics, base_url=url)
+        codes = workload(scale, mix)
+
+        def task(code):
+            start = time.perf_counter()
+            try:
+                results = list(searcher.search(code))
+            except Exception as e:
+                return code, None, time.perf_counter() - start, e
+            return code, results, time.perf_counter() - start, None
+
+        latencies, videos = [], []
+        outcomes = {"found": 0, "ambiguous": 0, "missing": 0, "error": 0}
+        errors = {}
+        db_seconds = 0.0
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for future in as_completed([pool.submit(task, code) for code in codes]):
+                code, results, latency, error = future.result()
+                latencies.append(latency)
+                if error is not None:
+                    outcomes["error"] += 1
+                    errors[type(error).__name__] = errors.get(type(error).__name__, 0) + 1
+                    continue
+                outcome, match = classify(code, results)
+                outcomes[outcome] += 1
+                if match is not None:
+                    videos.append(match)
+                if len(videos) >= batch_size:
+                    t = time.perf_counter()
+                    vm.upsert(videos)
+                    db_seconds += time.perf_counter() - t
+                    videos = []
+        if videos:
+            t = time.perf_counter()
+            vm.upsert(videos)
+            db_seconds += time.perf_counter() - t
+        elapsed = time.perf_counter() - start
+        searcher.close()
+        tm.engine.dispose()
+
+        summary = metrics.summary()
+        stages = summary["stages"]
+        stage_total = lambda name: stages.get(name, {}).get("total", 0.0)
+        return {"scale": scale,
+                "codes": len(codes),
+                "seconds": elapsed,
+                "codes_per_sec": len(codes) / elapsed if elapsed else 0.0,
+                "latency_p50": percentile(latencies, 50),
+                "latency_p99": percentile(latencies, 99),
+                "parse_seconds": stage_total("parse"),
+                "tag_db_seconds": stage_total("tag_query") + stage_total("tag_commit"),
+                "video_db_seconds": db_seconds,
+                "requests": summary["counters"].get("requests", 0),
+                "bytes": summary["counters"].get("bytes", 0),
+                "outcomes": outcomes,
+                "errors": errors}
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=BENCH_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--mix", default=",".join(f"{k}={v}" for k, v in DEFAULT_MIX.items()),
+                        help="Share of each flow, eg SGL=0.8,MUL=0.1,AMB=0.05,MIS=0.05")
+    parser.add_argument("--output", help="File to write the JSON results to, stdout by default")
+    args = parser.parse_args()
+    mix = {prefix: float(share) for prefix, share in (item.split("=") for item in args.mix.split(","))}
+
+    port = free_port()
+    server = multiprocessing.Process(target=serve, daemon=True,
+                                     args=(port, args.latency, args.jitter, args.error_rate,
+                                           args.error_status, args.seed))
+    server.start()
+    url = f"http://127.0.0.1:{port}"
+    try:
+        wait_for(url)
+        results = []
+        for scale in args.scales:
+            result = run_scale(url, scale, mix, args.concurrency, args.batch_size)
+            print(f"scale={scale}: {result['codes_per_sec']:.0f} codes/sec, "
+                  f"p50={result['latency_p50'] * 1000:.1f}ms p99={result['latency_p99'] * 1000:.1f}ms",
+                  file=sys.stderr)
+            results.append(result)
+    finally:
+        server.terminate()
+
+    report = {"benchmark": "e2e",
+              "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+              "commit": git_commit(),
+              "python": platform.python_version(),
+              "platform": platform.platform(),
+              "config": {"concurrency": args.concurrency, "batch_size": args.batch_size, "latency": args.latency,
+                         "jitter": args.jitter, "error_rate": args.error_rate, "error_status": args.error_status,
+                         "mix": mix},
+              "results": results}
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
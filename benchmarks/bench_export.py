@@ -0,0 +1,124 @@
+"""
+Benchmark of the streaming catalog export of henpy.persist.export.
+
+For each scale a database of that many videos (two titles and five tags each) is generated, and
+exported in full and then incrementally after 1% of the videos are rewritten. Reports rows per
+second, output size and the peak Python memory of the full export (traced in a second run, as
+tracing slows the export down), which should stay flat as the scale grows.
+
+usage: python benchmarks/bench_export.py [--scales 10000 100000] [--format jsonl] [--output results.json]
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import platform
+import argparse
+import tempfile
+import tracemalloc
+from datetime import date, timedelta
+from henpy.models import VideoMetadata
+from henpy.persist import tables as T
+from henpy.persist.export import CatalogExporter, default_format, FORMATS
+from henpy.persist.managers import VideoManager
+from henpy.utilities.tagtools import SQLTagManager
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+TAG_FILE = os.path.join(BENCH_DIR, "..", "supplementary", "tagdata.tsv")
+
+
+def populate(engine, scale, tag_ids, batch_size=5000):
+    """Writes scale videos straight into the tables, faster than going through VideoManager"""
+    rand = random.Random(0)
+    video, video_data = T.Video.__table__, T.VideoData.__table__
+    with engine.begin() as conn:
+        for offset in range(0, scale, batch_size):
+            ids = range(offset + 1, min(offset + batch_size, scale) + 1)
+            conn.execute(video.insert(), [{"id": i, "code": f"GEN-{i:06d}", "release_date": date(2010, 1, 1) +
+                                           timedelta(days=i % 3650), "image_path": None, "director": "Director",
+                                           "maker": "Maker", "label": "Label"} for i in ids])
+            conn.execute(video_data.insert(), [{"video_id": i, "language": language, "title": f"Title {i}"}
+                                               for i in ids for language in ("en", "ja")])
+            conn.execute(T.video_tag.insert(), [{"video_id": i, "tag_id": tag_id}
+                                                for i in ids for tag_id in rand.sample(tag_ids, 5)])
+
+
+def size_of(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def run_scale(scale, fmt, batch_size):
+    directory = tempfile.mkdtemp(prefix="henpy_bench_")
+    try:
+        tm = SQLTagManager("sqlite:///" + os.path.join(directory, "bench.db"))
+        tm.import_tags(TAG_FILE)
+        tag_ids = [tag.id for tag in tm.session.query(T.Tag)]
+        populate(tm.engine, scale, tag_ids)
+        result = {"scale": scale}
+
+        exporter = CatalogExporter(tm.engine, os.path.join(directory, "timed"), fmt=fmt, batch_size=batch_size)
+        manifest = exporter.export()
+        rows = sum(table["rows"] for table in manifest["tables"].values())
+        result["full"] = {"rows": rows, "seconds": manifest["seconds"],
+                          "rows_per_sec": rows / manifest["seconds"],
+                          "bytes": size_of(os.path.join(exporter.root, manifest["snapshot"]))}
+
+        tracemalloc.start()
+        CatalogExporter(tm.engine, os.path.join(directory, "traced"), fmt=fmt, batch_size=batch_size).export()
+        result["full"]["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        # Rewrites 1% of the videos through the VideoManager, as a crawl would
+        exporter.overlap = 0.0
+        time.sleep(0.01)
+        tag = tm.session.get(T.Tag, tag_ids[0])
+        changed = []
+        for i in range(1, scale + 1, 100):
+            metadata = VideoMetadata(f"GEN-{i:06d}", "2020-01-01", [tag], "Director", "Maker", "Label", None)
+            metadata.title = {"en": f"New title {i}"}
+            changed.append(metadata)
+        VideoManager(tm.engine).upsert(changed)
+        manifest = exporter.export()
+        result["incremental"] = {"changed": len(changed), "seconds": manifest["seconds"],
+                                 "rows": {name: table["rows"] for name, table in manifest["tables"].items()}}
+        tm.engine.dispose()
+        return result
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--format", choices=FORMATS, default=default_format())
+    parser.add_argument("--batch-size", type=int, default=10000)
+    parser.add_argument("--output", help="File to write the JSON results to, stdout by default")
+    args = parser.parse_args()
+
+    results = []
+    for scale in args.scales:
+        result = run_scale(scale, args.format, args.batch_size)
+        print(f"scale={scale}: {result['full']['rows_per_sec']:.0f} rows/sec, "
+              f"peak {result['full']['peak_bytes'] / 2 ** 20:.1f}MB, "
+              f"incremental {result['incremental']['seconds'] * 1000:.0f}ms", file=sys.stderr)
+        results.append(result)
+
+    report = {"benchmark": "export",
+              "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+              "python": platform.python_version(),
+              "platform": platform.platform(),
+              "config": {"format": args.format, "batch_size": args.batch_size},
+              "results": results}
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
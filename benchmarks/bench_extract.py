@@ -0,0 +1,89 @@
+"""
+Benchmark of the javlibrary page metadata extraction.
+
+Compares the single pass JavlibrarySearcher._extract_metadata against the previous
+set of per-field regexes over the saved fixture pages, reporting pages/sec and the
+worst case time for a single page. A padded copy of each page is included to show
+how both scale with page size.
+
+usage: python benchmarks/bench_extract.py [fixture_dir] [--iterations N]
+"""
+
+import os
+import time
+import argparse
+from henpy.searchers.searchers import JavlibrarySearcher
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+class Page:
+    """Stand in for a response object"""
+
+    def __init__(self, text):
+        self.text = text
+
+
+def extract_legacy(searcher, resp):
+    """The per field regex scans, as _extract_metadata performed them previously"""
+    s = searcher
+    text = resp.text
+    return {"title": s._unpack_search(s.title_re.search(text)),
+            "code": s._unpack_search(s.code_re.search(text)),
+            "tags": s.genre_re.findall(text),
+            "stars": s.star_re.findall(text),
+            "maker": s._unpack_search(s.maker_re.search(text)),
+            "label": s._unpack_search(s.label_re.search(text)),
+            "director": s._unpack_search(s.director_re.search(text)),
+            "release_date": s._unpack_search(s.release_date_re.search(text)),
+            "image_url": s._unpack_search(s.image_re.search(text))}
+
+
+def pad(text, lines=2500):
+    """Pads a page with review markup before and after the video info, the way long pages grow"""
+    noise = ('<tr><td class="userid"><a href="userposts.php?u=reviewer">reviewer</a></td>'
+             '<td class="t"><textarea class="hidden">nice video</textarea></td></tr>\n')
+    head, sep, tail = text.partition('<div id="video_info">')
+    body, end, rest = tail.partition("</body>")
+    return head + noise * lines + sep + body + noise * lines + end + rest
+
+
+def run(extract, resp, iterations):
+    worst = 0
+    start = time.perf_counter()
+    for i in range(iterations):
+        t = time.perf_counter()
+        extract(resp)
+        worst = max(worst, time.perf_counter() - t)
+    total = time.perf_counter() - start
+    return iterations / total, worst
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("fixture_dir", nargs="?", default=FIXTURE_DIR)
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    searcher = JavlibrarySearcher(None)
+    print(f"{'page':<28}{'method':<14}{'pages/sec':>12}{'worst (ms)':>12}")
+    for name in sorted(os.listdir(args.fixture_dir)):
+        if not name.startswith("video_"):
+            continue
+        with open(os.path.join(args.fixture_dir, name), encoding="utf-8") as f:
+            text = f.read()
+        for label, page in ((name, text), (name + " (padded)", pad(text))):
+            resp = Page(page)
+            legacy = extract_legacy(searcher, resp)
+            single = searcher._extract_metadata(resp)
+            if legacy != single:
+                print(f"{label}: results differ\n  legacy={legacy}\n  single={single}")
+            iterations = args.iterations if page is text else max(args.iterations // 50, 10)
+            for method, extract in (("regex set", lambda r: extract_legacy(searcher, r)),
+                                    ("single pass", searcher._extract_metadata)):
+                rate, worst = run(extract, resp, iterations)
+                print(f"{label:<28}{method:<14}{rate:>12.0f}{worst * 1000:>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
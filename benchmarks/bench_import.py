@@ -0,0 +1,134 @@
+"""
+Import time regression check of the henpy package and CLI.
+
+Each case runs in a fresh interpreter several times, the median wall time is reported along with
+its overhead over a bare interpreter, so slow machines and site hooks don't skew the check.
+Cheap cases fail when their overhead exceeds the budget, or when they import a heavy dependency
+(SQLAlchemy, requests, cfscrape) that the lazy imports are meant to keep out. The default budget
+keeps the cheap commands under ~100ms on a typical ~25ms interpreter startup.
+
+usage: python benchmarks/bench_import.py [--repeat 15] [--budget 0.075] [--output results.json]
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import sqlite3
+import platform
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+HEAVY = ("sqlalchemy", "requests", "cfscrape", "bs4")
+
+# Reports the heavy modules loaded by the statement, after running it
+_probe = ("import sys\n{statement}\n"
+          "print(','.join(m for m in {heavy!r} if m in sys.modules), file=sys.stderr)")
+
+
+def make_db(directory):
+    """Minimal SQLite database with the tables read by henpy query"""
+    path = os.path.join(directory, "henpy.db")
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE video (id INTEGER PRIMARY KEY, code TEXT, release_date DATE, director TEXT, maker TEXT,
+                            label TEXT, image_path TEXT);
+        CREATE TABLE video_data (id INTEGER PRIMARY KEY, video_id INTEGER, language TEXT, title TEXT);
+        CREATE TABLE tag_data (id INTEGER PRIMARY KEY, tag_id INTEGER, type TEXT, language TEXT,
+                               name TEXT, display_name TEXT);
+        CREATE TABLE video_tag (video_id INTEGER, tag_id INTEGER);
+        INSERT INTO video VALUES (1, 'LOVE-049', '2013-06-20', 'Director', 'Maker', 'Label', NULL);
+        INSERT INTO video_data VALUES (1, 1, 'en', 'Sample Title');
+        INSERT INTO tag_data VALUES (1, 1, 'genre', 'en', 'sample', 'Sample');
+        INSERT INTO video_tag VALUES (1, 1);
+    """)
+    conn.commit()
+    conn.close()
+    return path
+
+
+def cases(db):
+    """
+    @returns
+        list of (name, argv, cheap) tuples. Cheap cases are held to the budget
+    """
+    python = sys.executable
+    probe = lambda statement: [python, "-c", _probe.format(statement=statement, heavy=HEAVY)]
+    return [("python", [python, "-c", "pass"], False),
+            ("import henpy", probe("import henpy"), True),
+            ("import henpy.cli", probe("import henpy.cli"), True),
+            ("henpy --help", probe("from henpy.cli import main\ntry:\n    main(['--help'])\n"
+                                   "except SystemExit:\n    pass"), True),
+            ("henpy query", probe(f"from henpy.cli import main\nmain(['--db', {db!r}, 'query', "
+                                  "'/media/LOVE-049.mp4'])"), True),
+            ("import henpy.searchers.searchers", probe("import henpy.searchers.searchers"), False)]
+
+
+def measure(argv, repeat):
+    """
+    @returns
+        (median seconds, heavy modules imported) tuple
+    """
+    env = dict(os.environ, PYTHONPATH=ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    times, heavy = [], ""
+    for _ in range(repeat):
+        start = time.perf_counter()
+        proc = subprocess.run(argv, env=env, capture_output=True, text=True)
+        times.append(time.perf_counter() - start)
+        if proc.returncode not in (0, 2):
+            raise RuntimeError(f"{argv} failed:\n{proc.stderr}")
+        heavy = proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else ""
+    return statistics.median(times), [m for m in heavy.split(",") if m]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=15)
+    parser.add_argument("--budget", type=float, default=0.075,
+                        help="Seconds cheap cases may take over a bare interpreter")
+    parser.add_argument("--output", help="File to write the JSON results to, stdout by default")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="henpy_bench_")
+    try:
+        results, failures = [], []
+        baseline = None
+        for name, argv, cheap in cases(make_db(directory)):
+            seconds, heavy = measure(argv, args.repeat)
+            baseline = seconds if baseline is None else baseline
+            overhead = seconds - baseline
+            results.append({"case": name, "seconds": seconds, "overhead": overhead, "heavy_imports": heavy,
+                            "cheap": cheap})
+            print(f"{name}: {seconds * 1000:.1f}ms (+{overhead * 1000:.1f}ms) {' '.join(heavy)}", file=sys.stderr)
+            if cheap and overhead > args.budget:
+                failures.append(f"{name} took {overhead * 1000:.0f}ms over the interpreter startup, "
+                                f"above the {args.budget * 1000:.0f}ms budget")
+            if cheap and heavy:
+                failures.append(f"{name} imported {', '.join(heavy)}")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    report = {"benchmark": "import",
+              "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+              "python": platform.python_version(),
+              "platform": platform.platform(),
+              "config": {"repeat": args.repeat, "budget": args.budget},
+              "results": results,
+              "failures": failures}
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
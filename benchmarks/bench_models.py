@@ -0,0 +1,112 @@
+"""
+Memory and throughput benchmark of the in-memory video models.
+
+Compares a crawl result held as plain (dict based) objects with tag objects, as the models
+were previously laid out, against slotted VideoMetadata objects with tag ids and against
+a ColumnarQuerySet.
+
+usage: python benchmarks/bench_models.py [--videos N]
+"""
+
+import time
+import random
+import argparse
+import tracemalloc
+from henpy.models import VideoMetadata, ColumnarQuerySet, Tag, TagData
+
+
+class PlainVideoMetadata:
+    """The previous, __dict__ based layout of VideoMetadata"""
+
+    def __init__(self, code, release_date, tags, director, maker, label, image_path):
+        self.code = code
+        self.release_date = release_date
+        self.tags = tags
+        self.image_path = image_path
+        self.director = director
+        self.maker = maker
+        self.label = label
+        self.title = {}
+
+
+def make_tags(n):
+    tags = []
+    for i in range(n):
+        tag = Tag(id=i)
+        tag.data["en"] = TagData("genre", f"tag {i}", "en")
+        tags.append(tag)
+    return tags
+
+
+def raw_rows(n, tags):
+    """Yields the scraped fields of n videos, with freshly built strings as a scraper produces them"""
+    rng = random.Random(0)
+    for i in range(n):
+        yield (f"ABC-{i:06d}", "2012-03-14", rng.sample(tags, 10),
+               "director %d" % (i % 50), "maker %d" % (i % 100), "label %d" % (i % 200),
+               f"//pics.example.com/{i}.jpg", f"Title of video {i}", f"タイトル {i}")
+
+
+def build_plain(rows):
+    res = []
+    for code, date, tags, director, maker, label, image, en, ja in rows:
+        video = PlainVideoMetadata(code, date, tags, director, maker, label, image)
+        video.title["en"] = en
+        video.title["ja"] = ja
+        res.append(video)
+    return res
+
+
+def build_slotted(rows):
+    res = []
+    for code, date, tags, director, maker, label, image, en, ja in rows:
+        video = VideoMetadata(code, date, tags, director, maker, label, image)
+        video.title["en"] = en
+        video.title["ja"] = ja
+        res.append(video)
+    return res
+
+
+def build_columnar(rows):
+    return ColumnarQuerySet(build_slotted([row])[0] for row in rows)
+
+
+def measure(build, rows):
+    """Builds the models from a stream of rows, returning them with the memory they retain"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    res = build(rows)
+    elapsed = time.perf_counter() - start
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return res, size, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--videos", type=int, default=100000)
+    args = parser.parse_args()
+
+    tags = make_tags(300)
+    print(f"{'layout':<12}{'MiB':>10}{'build (s)':>12}{'iterate (s)':>13}{'filter (s)':>12}")
+    for name, build in (("plain", build_plain), ("slotted", build_slotted), ("columnar", build_columnar)):
+        res, size, build_time = measure(build, raw_rows(args.videos, tags))
+
+        start = time.perf_counter()
+        for video in res:
+            video.code
+        iterate_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        if name == "columnar":
+            selected = len(res.filter(lambda video: video.maker == "maker 1"))
+        else:
+            selected = len([video for video in res if video.maker == "maker 1"])
+        filter_time = time.perf_counter() - start
+        assert selected == args.videos // 100
+        print(f"{name:<12}{size / 2 ** 20:>10.1f}{build_time:>12.3f}{iterate_time:>13.3f}{filter_time:>12.3f}")
+        del res
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Multi-threaded benchmark of SQLTagManager against a file backed SQLite database.
+
+Each worker resolves tags through the database (with the tag cache disabled) for the read
+workload, and creates new tags for the write workload. Reports operations/sec and the
+number of failed operations per worker count.
+
+usage: python benchmarks/bench_storage.py [--ops N] [--workers 1 2 4 8]
+"""
+
+import os
+import time
+import shutil
+import argparse
+import tempfile
+import itertools
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from henpy.utilities.tagtools import SQLTagManager
+from henpy.persist import tables as T
+
+TAG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "supplementary", "tagdata.tsv")
+
+
+_new_names = (f"new tag {i}" for i in itertools.count())
+
+
+def read_op(tm, i, names):
+    tm.get_tag(names[i % len(names)])
+
+
+def write_op(tm, i, names):
+    tm.get_or_create_tags([(next(_new_names), "genre")])
+
+
+def run(tm, op, workers, ops, names):
+    failures = 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for future in [pool.submit(op, tm, i, names) for i in range(ops)]:
+            try:
+                future.result()
+            except Exception:
+                failures += 1
+    return ops / (time.perf_counter() - start), failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ops", type=int, default=2000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        db_path = f"sqlite:///{directory}/bench.db"
+        tm = SQLTagManager.from_file(db_path, TAG_FILE)
+        # Names shared by several tags are ambiguous for get_tag
+        counts = Counter(name for (name,) in tm.session.query(T.TagData.name).filter(T.TagData.language == "en"))
+        names = [name for name, count in counts.items() if count == 1]
+        # Without a cache every read goes to the database
+        reader = SQLTagManager(db_path, cache_size=0)
+        print(f"{'workload':<10}{'workers':>8}{'ops/sec':>12}{'failures':>10}")
+        for name, op, tm in (("read", read_op, reader), ("write", write_op, tm)):
+            for workers in args.workers:
+                rate, failures = run(tm, op, workers, args.ops, names)
+                print(f"{name:<10}{workers:>8}{rate:>12.0f}{failures:>10}")
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""
+Local stand-in for javlibrary, replaying the fixture pages.
+
+The flow of a search depends on the prefix of the code:
+    MIS-...  not found: redirects to an empty vl_search listing
+    MUL-...  multiple results: redirects to a vl_search listing of the code and a near miss,
+             so the searcher has to follow the exact match
+    AMB-...  ambiguous: vl_search listing two other codes, the searcher fetches both candidates
+    others   single hit: redirects straight to the video page
+
+Video pages are the fixtures with the code and video id substituted, so every code gets its own
+video. Latency and errors can be injected.
+
+usage: python benchmarks/standin.py [--port 8000] [--latency 0.05] [--error-rate 0.01]
+"""
+
+import os
+import time
+import random
+import argparse
+import threading
+from urllib.parse import urlsplit, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+_listing_entry = ('<div class="video" id="vid_{vid}"><a href="./?v={vid}" title="{code} Sample Title">'
+                  '<div class="id">{code}</div><img src="//pics.dmm.co.jp/mono/movie/adult/{slug}/{slug}ps.jpg" '
+                  'width="147" height="200" /><div class="title">{code} Sample Title</div></a></div>\n')
+_listing = '<html><body>\n<div class="videothumblist"><div class="videos">\n{entries}</div></div>\n</body></html>\n'
+
+
+def video_id(code):
+    return "jav" + code.lower()
+
+
+def code_of(vid):
+    return vid[3:].upper()
+
+
+class StandinServer:
+    """Threaded HTTP server replaying the fixture pages
+    @attrs
+        url (str): Root url of the server, to use as JavlibrarySearcher base_url
+        requests (int): Number of requests served
+    """
+
+    def __init__(self, port=0, latency=0.0, jitter=0.0, error_rate=0.0, error_status=503, retry_after=None,
+                 fixture_dir=FIXTURE_DIR, seed=None):
+        """
+        @args
+            port (int): Port to listen on, 0 for any free port
+            latency (float): Seconds added to every response
+            jitter (float): Maximum random seconds added on top of latency
+            error_rate (float): Fraction of requests answered with error_status
+            error_status (int): Status of the injected errors, eg 429, 503 or 500
+            retry_after (float): Retry-After header sent with injected errors
+            seed (int): Seed of the latency and error injection
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.requests = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.pages = {}
+        for lang in ("en", "ja"):
+            with open(os.path.join(fixture_dir, f"video_{lang}.html"), encoding="utf-8") as f:
+                self.pages[lang] = f.read()
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self.httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self._thread = None
+
+    def video_page(self, lang, vid):
+        code = code_of(vid)
+        slug = code.lower().replace("-", "")
+        return (self.pages[lang].replace("LOVE-049", code)
+                .replace("javlio354u", vid)
+                .replace("h_491love049", slug))
+
+    def listing(self, codes):
+        return _listing.format(entries="".join(
+            _listing_entry.format(vid=video_id(code), code=code, slug=code.lower().replace("-", ""))
+            for code in codes))
+
+    def _inject(self):
+        """
+        @returns
+            (delay, error) tuple for the next request
+        """
+        with self._lock:
+            self.requests += 1
+            delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0.0)
+            error = self.error_rate and self._random.random() < self.error_rate
+        return delay, error
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body go out in a single segment, avoiding delayed ack stalls on keep-alive
+            wbufsize = -1
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body=b"", headers=()):
+                self.send_response(status)
+                for key, value in headers:
+                    self.send_header(key, value)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                delay, error = server._inject()
+                if delay:
+                    time.sleep(delay)
+                if error:
+                    headers = [("Retry-After", str(server.retry_after))] if server.retry_after else []
+                    return self._send(server.error_status, b"injected error", headers)
+                url = urlsplit(self.path)
+                lang = url.path.strip("/").split("/")[0]
+                query = parse_qs(url.query)
+                if lang not in server.pages:
+                    return self._send(404, b"not found")
+                if url.path.endswith("vl_searchbyid.php"):
+                    code = query.get("keyword", [""])[0].upper()
+                    if code[:3] in ("MIS", "MUL", "AMB"):
+                        location = f"/{lang}/vl_search.php?keyword={code}"
+                    else:
+                        location = f"/{lang}/?v={video_id(code)}"
+                    return self._send(302, headers=[("Location", location)])
+                if url.path.endswith("vl_search.php"):
+                    code = query.get("keyword", [""])[0].upper()
+                    codes = {"MIS": [], "MUL": [code, code + "B"], "AMB": [code + "A", code + "B"]}.get(code[:3], [])
+                    return self._send(200, server.listing(codes).encode("utf-8"))
+                if "v" in query:
+                    return self._send(200, server.video_page(lang, query["v"][0]).encode("utf-8"))
+                return self._send(404, b"not found")
+
+        return Handler
+
+    def start(self):
+        """Serves from a background thread
+        """
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--retry-after", type=float, default=None)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+    server = StandinServer(args.port, args.latency, args.jitter, args.error_rate, args.error_status,
+                           args.retry_after, seed=args.seed)
+    print(f"Serving javlibrary stand-in on {server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
-from . import models
-from . import constants
-from . import searchers
-from . import utilities
\ No newline at end of file
+from ._lazy import lazy_submodules
+
+# Submodules are imported on first access, see henpy._lazy
+__getattr__, __dir__ = lazy_submodules(__name__, ["models", "constants", "metrics", "searchers", "utilities",
+                                                  "persist", "preprocessing", "cli"])
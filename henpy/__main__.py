@@ -0,0 +1,4 @@
+import sys
+from henpy.cli import main
+
+sys.exit(main())
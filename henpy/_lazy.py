@@ -0,0 +1,31 @@
+"""
+Lazy loading of package submodules (PEP 562), so importing a package doesn't pull in the
+dependencies of every submodule.
+"""
+
+import importlib
+
+
+def lazy_submodules(package, names):
+    """Builds the module level __getattr__ and __dir__ of a package whose submodules are
+    only imported on first access
+    @args
+        package (str): __name__ of the package
+        names (iterable of str): Submodules to load lazily
+    @returns
+        (__getattr__, __dir__) tuple
+    """
+    names = frozenset(names)
+
+    def __getattr__(name):
+        if name in names:
+            module = importlib.import_module(f"{package}.{name}")
+            # importlib sets it on the package already, subsequent lookups don't come through here
+            return module
+        raise AttributeError(f"module {package!r} has no attribute {name!r}")
+
+    def __dir__():
+        module = importlib.import_module(package)
+        return sorted(set(vars(module)) | names)
+
+    return __getattr__, __dir__
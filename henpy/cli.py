@@ -0,0 +1,248 @@
+"""
+henpy command line interface
+
+    henpy query FILE_OR_CODE...        Metadata of stored videos, by code or by filename
+    henpy search CODE...               Looks codes up on javlibrary, optionally storing the results
+    henpy scan ROOT                    Scans a media library and looks up the codes of new files
+    henpy import-tags TSV              Imports a tag vocabulary into the database
+    henpy export ROOT                  Exports the catalog changed since the last export
+
+The database is given with --db or the HENPY_DB environment variable, as an SQLAlchemy url
+or a path to an SQLite file. query is meant to be called from file manager hooks, so it reads
+SQLite databases through the sqlite3 module and avoids importing SQLAlchemy or requests.
+Each command imports what it needs inside its function to keep startup fast.
+"""
+
+import os
+import sys
+import json
+import argparse
+
+DEFAULT_DB = "sqlite:///henpy.db"
+
+
+def _db_url(db):
+    """SQLAlchemy url of a --db value
+    """
+    return db if "://" in db else "sqlite:///" + os.path.abspath(db)
+
+
+def _sqlite_path(db):
+    """Filesystem path of an SQLite --db value, None for other databases or in memory ones
+    """
+    if "://" not in db:
+        return db
+    prefix = "sqlite:///"
+    if db.startswith(prefix) and len(db) > len(prefix):
+        return db[len(prefix):]
+    return None
+
+
+def _query_sqlite(path, codes, language):
+    import sqlite3
+    # Read only, so hooks never create or lock the database for writing
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        marks = ",".join("?" * len(codes))
+        videos = {row[0]: {"code": row[1], "release_date": row[2], "director": row[3], "maker": row[4],
+                           "label": row[5], "image_path": row[6], "title": {}, "tags": []}
+                  for row in conn.execute("SELECT id, code, release_date, director, maker, label, image_path "
+                                          f"FROM video WHERE code IN ({marks})", codes)}
+        if videos:
+            ids = list(videos)
+            marks = ",".join("?" * len(ids))
+            for video_id, lang, title in conn.execute("SELECT video_id, language, title FROM video_data "
+                                                      f"WHERE video_id IN ({marks})", ids):
+                videos[video_id]["title"][lang] = title
+            for video_id, tag_type, name in conn.execute(
+                    "SELECT vt.video_id, td.type, td.display_name FROM video_tag vt "
+                    "JOIN tag_data td ON td.tag_id = vt.tag_id "
+                    f"WHERE td.language = ? AND vt.video_id IN ({marks}) ORDER BY td.type, td.display_name",
+                    [language] + ids):
+                videos[video_id]["tags"].append({"type": tag_type, "name": name})
+        return {video["code"]: video for video in videos.values()}
+    finally:
+        conn.close()
+
+
+def _query_sqlalchemy(db, codes, language):
+    from sqlalchemy import create_engine, select
+    from henpy.persist import tables as T
+    video, video_data, tag_data, video_tag = (T.Video.__table__, T.VideoData.__table__,
+                                              T.TagData.__table__, T.video_tag)
+    engine = create_engine(_db_url(db))
+    with engine.connect() as conn:
+        videos = {row[0]: {"code": row[1], "release_date": row[2] and row[2].isoformat(), "director": row[3],
+                           "maker": row[4], "label": row[5], "image_path": row[6], "title": {}, "tags": []}
+                  for row in conn.execute(select(video.c.id, video.c.code, video.c.release_date, video.c.director,
+                                                 video.c.maker, video.c.label, video.c.image_path)
+                                          .where(video.c.code.in_(codes)))}
+        ids = list(videos)
+        for video_id, lang, title in conn.execute(select(video_data.c.video_id, video_data.c.language,
+                                                         video_data.c.title)
+                                                  .where(video_data.c.video_id.in_(ids))):
+            videos[video_id]["title"][lang] = title
+        for video_id, tag_type, name in conn.execute(
+                select(video_tag.c.video_id, tag_data.c.type, tag_data.c.display_name)
+                .join(tag_data, tag_data.c.tag_id == video_tag.c.tag_id)
+                .where(tag_data.c.language == language, video_tag.c.video_id.in_(ids))
+                .order_by(tag_data.c.type, tag_data.c.display_name)):
+            videos[video_id]["tags"].append({"type": tag_type, "name": name})
+    return {video["code"]: video for video in videos.values()}
+
+
+def _print_video(video):
+    title = video["title"].get("en") or next(iter(video["title"].values()), "")
+    print(f"{video['code']}\t{video['release_date'] or ''}\t{video['maker']}\t{title}")
+    if video["tags"]:
+        print("\t" + ", ".join(tag["name"] for tag in video["tags"]))
+
+
+def cmd_query(args):
+    from henpy.preprocessing.codes import extract_codes
+    # Arguments are codes or filenames, each may hold several codes
+    codes = {}
+    for arg in args.items:
+        for key in extract_codes(os.path.basename(arg)):
+            codes.setdefault(str(key), arg)
+    if not codes:
+        print("No codes found", file=sys.stderr)
+        return 1
+    path = _sqlite_path(args.db)
+    if path is not None:
+        if not os.path.exists(path):
+            print(f"Database {path} doesn't exist", file=sys.stderr)
+            return 1
+        videos = _query_sqlite(path, list(codes), args.language)
+    else:
+        videos = _query_sqlalchemy(args.db, list(codes), args.language)
+    if args.json:
+        print(json.dumps({code: videos.get(code) for code in codes}, ensure_ascii=False))
+    else:
+        for code in codes:
+            if code in videos:
+                _print_video(videos[code])
+            else:
+                print(f"{code}\tnot found")
+    return 0 if videos else 2
+
+
+def cmd_search(args):
+    from henpy.utilities.tagtools import SQLTagManager
+    from henpy.searchers.searchers import JavlibrarySearcher
+    from henpy.searchers.refresh import classify
+    tm = SQLTagManager(_db_url(args.db))
+    searcher = JavlibrarySearcher(tm)
+    found = []
+    out = {}
+    for code, results in searcher.search_many(args.codes, max_concurrency=args.concurrency, topn=args.topn):
+        entries = [] if results is None else results.metadata
+        outcome, match = classify(code, entries)
+        if match is not None and args.store:
+            found.append(match)
+        out[code] = [{"code": metadata.code, "release_date": metadata.release_date, "maker": metadata.maker,
+                      "title": metadata.title, "image_path": metadata.image_path, "url": metadata.url}
+                     for metadata in entries]
+        if not args.json:
+            if results is None:
+                print(f"{code}\tfailed")
+            for entry in out[code]:
+                print(f"{entry['code']}\t{entry['release_date']}\t{entry['maker']}\t{entry['title'].get('en', '')}")
+    if args.json:
+        print(json.dumps(out, ensure_ascii=False))
+    if found:
+        from henpy.persist.managers import VideoManager
+        VideoManager(tm.engine).upsert(found)
+    searcher.close()
+    return 0
+
+
+def cmd_scan(args):
+    from henpy.utilities.tagtools import SQLTagManager
+    from henpy.persist.managers import VideoManager, LookupLedger
+    from henpy.preprocessing.scanner import LibraryScanner
+    tm = SQLTagManager(_db_url(args.db))
+    scanner = LibraryScanner(tm.engine)
+    stats = scanner.scan(args.root)
+    if not args.scan_only:
+        from henpy.searchers.searchers import JavlibrarySearcher
+        stats.update(scanner.feed(JavlibrarySearcher(tm), VideoManager(tm.engine),
+                                  max_concurrency=args.concurrency, ledger=LookupLedger(tm.engine)))
+    print(json.dumps(stats))
+    return 0
+
+
+def cmd_import_tags(args):
+    from henpy.utilities.tagtools import SQLTagManager
+    tm = SQLTagManager(_db_url(args.db))
+    stats = tm.import_tags(args.tsv, batch_size=args.batch_size)
+    if args.vocabulary:
+        from henpy.utilities.normalize_tags import Vocabulary
+        Vocabulary.from_tsv(args.tsv).save(args.vocabulary)
+    print(json.dumps(stats))
+    return 0
+
+
+def cmd_export(args):
+    from henpy.persist.storage import create_storage_engine
+    from henpy.persist.export import CatalogExporter
+    exporter = CatalogExporter(create_storage_engine(_db_url(args.db)), args.root, fmt=args.format,
+                               batch_size=args.batch_size)
+    print(json.dumps(exporter.export(full=args.full)))
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="henpy", description="Video metadata lookup and tagging")
+    parser.add_argument("--db", default=os.environ.get("HENPY_DB", DEFAULT_DB),
+                        help="SQLAlchemy url or SQLite file path. Defaults to $HENPY_DB or henpy.db")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    query = commands.add_parser("query", help="Metadata of stored videos, by code or filename")
+    query.add_argument("items", nargs="+", help="Codes or filenames")
+    query.add_argument("--language", default="en", help="Language of the tag names")
+    query.add_argument("--json", action="store_true")
+    query.set_defaults(func=cmd_query)
+
+    search = commands.add_parser("search", help="Looks codes up on javlibrary")
+    search.add_argument("codes", nargs="+")
+    search.add_argument("--topn", type=int, default=5)
+    search.add_argument("--concurrency", type=int, default=4)
+    search.add_argument("--store", action="store_true", help="Store the best match of each code")
+    search.add_argument("--json", action="store_true")
+    search.set_defaults(func=cmd_search)
+
+    scan = commands.add_parser("scan", help="Scans a media library and looks up the codes of new files")
+    scan.add_argument("root")
+    scan.add_argument("--scan-only", action="store_true", help="Only update the manifest")
+    scan.add_argument("--concurrency", type=int, default=8)
+    scan.set_defaults(func=cmd_scan)
+
+    import_tags = commands.add_parser("import-tags", help="Imports a tag vocabulary tsv")
+    import_tags.add_argument("tsv")
+    import_tags.add_argument("--batch-size", type=int, default=1000)
+    import_tags.add_argument("--vocabulary", help="Also compile the vocabulary to this path, "
+                                                  "see henpy.utilities.normalize_tags")
+    import_tags.set_defaults(func=cmd_import_tags)
+
+    export = commands.add_parser("export", help="Exports the catalog changed since the last export")
+    export.add_argument("root", help="Directory of the snapshots")
+    export.add_argument("--full", action="store_true", help="Export everything")
+    export.add_argument("--format", choices=["parquet", "jsonl", "csv"],
+                        help="Defaults to parquet if pyarrow is installed, jsonl otherwise")
+    export.add_argument("--batch-size", type=int, default=10000)
+    export.set_defaults(func=cmd_export)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.verbose:
+        import logging
+        logging.basicConfig(level=logging.INFO)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,190 @@
+"""
+Lightweight timing and counter instrumentation.
+
+Components take an optional Metrics object and record per stage latencies and counters into it.
+Without one they use NULL_METRICS, whose methods do nothing, so instrumentation costs next to
+nothing when disabled.
+
+    metrics = Metrics(sinks=[log_sink])
+    searcher = JavlibrarySearcher(tm, metrics=metrics)
+    ...
+    print(metrics.report())
+    metrics.emit()
+"""
+
+import json
+import math
+import time
+import logging
+import threading
+from contextlib import nullcontext
+
+
+class Histogram:
+    """Latency histogram with logarithmic buckets (factor 2, starting at 1µs)
+    """
+    __slots__ = ("buckets", "count", "total", "min", "max")
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def observe(self, seconds):
+        bucket = max(int(math.log2(seconds * 1e6)) + 1, 0) if seconds > 0 else 0
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += seconds
+        if seconds < self.min:
+            self.min = seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, p):
+        """Approximate p-th percentile, the upper bound of the bucket holding it
+        """
+        if not self.count:
+            return 0.0
+        rank = p / 100 * self.count
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min(2 ** bucket / 1e6, self.max)
+        return self.max
+
+    def summary(self):
+        return {"count": self.count,
+                "total": self.total,
+                "mean": self.total / self.count if self.count else 0.0,
+                "min": self.min if self.count else 0.0,
+                "max": self.max,
+                "p50": self.percentile(50),
+                "p90": self.percentile(90),
+                "p99": self.percentile(99)}
+
+
+class _Timer:
+    __slots__ = ("metrics", "stage", "start")
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.observe(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+class Metrics:
+    """Collects stage latencies and counters
+    @attrs
+        enabled (bool): Always True, False for NullMetrics
+        sinks (list): Callables receiving the summary dict on emit
+    """
+    enabled = True
+
+    def __init__(self, sinks=()):
+        self.sinks = list(sinks)
+        self.histograms = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def timer(self, stage):
+        """Context manager recording the time spent in its block under stage
+        """
+        return _Timer(self, stage)
+
+    def observe(self, stage, seconds):
+        """Records a latency for stage
+        """
+        with self._lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram()
+            histogram.observe(seconds)
+
+    def incr(self, name, value=1):
+        """Increments a counter
+        """
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def summary(self):
+        """
+        @returns
+            dict with a "stages" dict of latency summaries and a "counters" dict
+        """
+        with self._lock:
+            return {"stages": {stage: histogram.summary() for stage, histogram in self.histograms.items()},
+                    "counters": dict(self.counters)}
+
+    def report(self):
+        """Human readable table of the summary
+        """
+        summary = self.summary()
+        lines = [f"{'stage':<20}{'count':>8}{'total s':>10}{'mean ms':>10}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}"]
+        for stage, s in sorted(summary["stages"].items()):
+            lines.append(f"{stage:<20}{s['count']:>8}{s['total']:>10.3f}{s['mean'] * 1000:>10.2f}"
+                         f"{s['p50'] * 1000:>10.2f}{s['p99'] * 1000:>10.2f}{s['max'] * 1000:>10.2f}")
+        for name, value in sorted(summary["counters"].items()):
+            lines.append(f"{name:<20}{value:>8}")
+        return "\n".join(lines)
+
+    def emit(self):
+        """Sends the summary to every sink
+        """
+        summary = self.summary()
+        for sink in self.sinks:
+            sink(summary)
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+
+class NullMetrics(Metrics):
+    """Metrics that record nothing, used when instrumentation is disabled
+    """
+    enabled = False
+    _null_timer = nullcontext()
+
+    def __init__(self):
+        super().__init__()
+
+    def timer(self, stage):
+        return self._null_timer
+
+    def observe(self, stage, seconds):
+        pass
+
+    def incr(self, name, value=1):
+        pass
+
+
+NULL_METRICS = NullMetrics()
+
+
+def log_sink(summary):
+    """Sink logging the summary as json
+    """
+    logging.info(f"metrics: {json.dumps(summary)}")
+
+
+class JSONLinesSink:
+    """Sink appending each summary as a line of json to a file, timestamped
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def __call__(self, summary):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(dict(summary, time=time.time())) + "\n")
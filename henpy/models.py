@@ -3,47 +3,312 @@ General use models for data acquisition.
 
 Note: these are not database models. These are simply to hold the raw tag information
       extracted from the database of choice
+
+Models are slotted and intern their repetitive strings (tag types, languages, makers, ...),
+since full crawl results are kept in memory for post-processing.
 """
 
+import sys
+from array import array
+from itertools import islice
 from datetime import datetime
 
+
+def _intern(value):
+    """Interns strings, passing anything else through
+    """
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def _tag_id(tag):
+    """Gets the id of a tag given either a tag object or the id itself
+    """
+    return tag if isinstance(tag, int) else tag.id
+
+
 class QuerySet:
     """
     Data object representing a query of a given video database with a code
-    Iterating over iterates over the metadata
+    Iterating over iterates over the metadata.
+
+    QuerySets are lazy: entries are pulled from the underlying iterable only as they are
+    consumed, and kept so the QuerySet can be iterated again. filter, map and take
+    chain further lazy QuerySets. Uncached QuerySets don't keep their entries and can
+    only be iterated once, for consumers streaming through large results.
     @args
-        
+
          (iterable of VideoMetadata): Metadata objects for each code provided
+         cache (bool): Keep the entries so the QuerySet can be iterated again
     """
+    __slots__ = ("_source", "_cache")
 
-    def __init__(self, metadata):
-        self.metadata = metadata
+    def __init__(self, metadata, cache=True):
+        self._source = iter(metadata)
+        self._cache = [] if cache else None
 
     def __iter__(self):
-        return iter(self.metadata)
+        if self._cache is None:
+            return self._iter_once()
+        return self._iter_cached()
+
+    def _iter_once(self):
+        source = self._source
+        if source is None:
+            return
+        yield from source
+        self._source = None
+
+    def _iter_cached(self):
+        cache = self._cache
+        i = 0
+        while True:
+            if i < len(cache):
+                yield cache[i]
+            elif self._source is None:
+                return
+            else:
+                try:
+                    entry = next(self._source)
+                except StopIteration:
+                    self._source = None
+                    return
+                cache.append(entry)
+                yield entry
+            i += 1
+
+    @property
+    def metadata(self):
+        """Every entry of the QuerySet, evaluating it fully.
+        For uncached QuerySets, the entries not consumed yet
+        """
+        if self._cache is None:
+            return list(self)
+        for entry in self:
+            pass
+        return self._cache
+
+    def filter(self, predicate):
+        """Lazily selects the entries for which predicate(entry) is true
+        """
+        return QuerySet((entry for entry in self if predicate(entry)), self._cache is not None)
+
+    def map(self, func):
+        """Lazily applies func to every entry
+        """
+        return QuerySet((func(entry) for entry in self), self._cache is not None)
+
+    def take(self, n):
+        """Lazily limits the QuerySet to its first n entries
+        """
+        return QuerySet(islice(self, n), self._cache is not None)
+
+    def first(self):
+        """The first entry, or None if the QuerySet is empty
+        """
+        return next(iter(self), None)
+
+    def close(self):
+        """Stops the evaluation of the QuerySet, releasing the work behind its source
+        """
+        close = getattr(self._source, "close", None)
+        if close is not None:
+            close()
+        self._source = None
+
+    def __repr__(self):
+        state = "evaluated" if self._source is None else "pending"
+        if self._cache is None:
+            return f"<QuerySet:uncached|{state}>"
+        return f"<QuerySet:entries={len(self._cache)}|{state}>"
 
 
 class VideoMetadata:
     """Data object collecting metadata for a video across multiple languages
+    @attrs
+        tags (array): Ids of the tags of the video
+        url (str): Url of the page the metadata was scraped from, if known
     """
+    __slots__ = ("code", "release_date", "tags", "image_path", "director", "maker", "label", "title", "url")
 
     def __init__(self, code, release_date, tags,
                  director, maker, label,
-                 image_path):
+                 image_path, url=None):
         """
+        @args
+            tags (iterable): Tag objects or tag ids. Only the ids are kept
         """
+        self.url = url
         self.code = code
         self.release_date = release_date
-        self.tags = tags
+        self.tags = array("l", [_tag_id(tag) for tag in tags])
         self.image_path = image_path
-        self.director = director
-        self.maker = maker
-        self.label = label
+        self.director = _intern(director)
+        self.maker = _intern(maker)
+        self.label = _intern(label)
         # Only the titles change language
         self.title = {}
 
     def __repr__(self):
-        return f"<VideoMetadata:code={self.code}|tags={self.tags}>"
+        return f"<VideoMetadata:code={self.code}|tags={list(self.tags)}>"
+
+
+class VideoRow:
+    """Lightweight view of a single row of a ColumnarQuerySet
+    """
+    __slots__ = ("_columns", "_row")
+
+    def __init__(self, columns, row):
+        self._columns = columns
+        self._row = row
+
+    code = property(lambda self: self._columns.codes[self._row])
+    release_date = property(lambda self: self._columns.release_dates[self._row])
+    director = property(lambda self: self._columns.directors[self._row])
+    maker = property(lambda self: self._columns.makers[self._row])
+    label = property(lambda self: self._columns.labels[self._row])
+    image_path = property(lambda self: self._columns.image_paths[self._row])
+
+    @property
+    def tags(self):
+        return self._columns.tags_of(self._row)
+
+    @property
+    def title(self):
+        return {lang: titles[self._row] for lang, titles in self._columns.titles.items()
+                if titles[self._row] is not None}
+
+    def to_metadata(self):
+        """Materializes the row into a VideoMetadata object
+        """
+        res = VideoMetadata(self.code, self.release_date, self.tags,
+                            self.director, self.maker, self.label, self.image_path)
+        res.title.update(self.title)
+        return res
+
+    def __repr__(self):
+        return f"<VideoRow:code={self.code}|tags={list(self.tags)}>"
+
+
+class _Columns:
+    """Column storage shared by ColumnarQuerySet views
+    """
+    __slots__ = ("codes", "release_dates", "directors", "makers", "labels", "image_paths",
+                 "titles", "tag_offsets", "tag_ids")
+
+    def __init__(self):
+        self.codes = []
+        self.release_dates = []
+        self.directors = []
+        self.makers = []
+        self.labels = []
+        self.image_paths = []
+        # Titles keyed by language, one entry per row
+        self.titles = {}
+        # Tags of row i are tag_ids[tag_offsets[i]:tag_offsets[i + 1]]
+        self.tag_offsets = array("l", [0])
+        self.tag_ids = array("l")
+
+    def tags_of(self, row):
+        return self.tag_ids[self.tag_offsets[row]:self.tag_offsets[row + 1]]
+
+
+class ColumnarQuerySet:
+    """Array backed QuerySet holding each VideoMetadata field as a column.
+    Iterating yields VideoRow views instead of full objects, and filtering or slicing
+    produces views over the same columns.
+    """
+    __slots__ = ("_columns", "_rows")
+
+    def __init__(self, metadata=(), _columns=None, _rows=None):
+        """
+        @args
+            metadata (iterable of VideoMetadata): Initial contents
+        """
+        self._columns = _Columns() if _columns is None else _columns
+        # Selected row numbers of a view, None for every row
+        self._rows = _rows
+        for entry in metadata:
+            self.append(entry)
+
+    def append(self, metadata):
+        """Adds a VideoMetadata object to the columns
+        """
+        if self._rows is not None:
+            raise TypeError("Can't append to a view of a ColumnarQuerySet")
+        columns = self._columns
+        row = len(columns.codes)
+        columns.codes.append(metadata.code)
+        columns.release_dates.append(metadata.release_date)
+        columns.directors.append(_intern(metadata.director))
+        columns.makers.append(_intern(metadata.maker))
+        columns.labels.append(_intern(metadata.label))
+        columns.image_paths.append(metadata.image_path)
+        for lang, title in metadata.title.items():
+            if lang not in columns.titles:
+                columns.titles[sys.intern(lang)] = [None] * row
+        for lang, titles in columns.titles.items():
+            titles.append(metadata.title.get(lang))
+        columns.tag_ids.extend(_tag_id(tag) for tag in metadata.tags)
+        columns.tag_offsets.append(len(columns.tag_ids))
+
+    def _row_numbers(self):
+        if self._rows is None:
+            return range(len(self._columns.codes))
+        return self._rows
+
+    def tags_of(self, row):
+        """Tag ids of the row number row of the underlying columns
+        """
+        return self._columns.tags_of(row)
+
+    def filter(self, predicate):
+        """Selects the rows for which predicate(VideoRow) is true
+        @returns
+            ColumnarQuerySet view
+        """
+        columns = self._columns
+        rows = array("l", (row for row in self._row_numbers() if predicate(VideoRow(columns, row))))
+        return ColumnarQuerySet(_columns=columns, _rows=rows)
+
+    def with_tag(self, tag):
+        """Selects the rows carrying tag, working on the tag arrays directly
+        @args
+            tag: Tag object or tag id
+        @returns
+            ColumnarQuerySet view
+        """
+        tag_id = _tag_id(tag)
+        columns = self._columns
+        offsets, tag_ids = columns.tag_offsets, columns.tag_ids
+        rows = array("l", (row for row in self._row_numbers()
+                           if tag_id in tag_ids[offsets[row]:offsets[row + 1]]))
+        return ColumnarQuerySet(_columns=columns, _rows=rows)
+
+    def column(self, name):
+        """Values of a single column for the selected rows, eg column("maker")
+        """
+        values = getattr(self._columns, name + "s")
+        if self._rows is None:
+            return list(values)
+        return [values[row] for row in self._rows]
+
+    def __getitem__(self, key):
+        rows = self._row_numbers()
+        if isinstance(key, slice):
+            return ColumnarQuerySet(_columns=self._columns, _rows=array("l", rows[key]))
+        return VideoRow(self._columns, rows[key])
+
+    def __iter__(self):
+        columns = self._columns
+        for row in self._row_numbers():
+            yield VideoRow(columns, row)
+
+    def __len__(self):
+        return len(self._row_numbers())
+
+    def __repr__(self):
+        return f"<ColumnarQuerySet:rows={len(self)}>"
+
 
 # Tag related data
 class Tag:
@@ -52,23 +317,26 @@ class Tag:
         id (int):
         self.data (dict): Contains TagData objects keyed by language
     """
+    __slots__ = ("id", "data", "base_lang")
 
-    def __init__(self, base_lang="en"):
+    def __init__(self, base_lang="en", id=None):
         """
         @args
-        # id (int): Unique key to identify a tag
         base_lang (str): Base language to store tag data in. Default English ("en").
                          Japanese ("jp") available
+        id (int): Unique key to identify a tag
         """
-        # self.id = id
+        self.id = id
         self.data = {}
-        self.base_lang = base_lang
+        self.base_lang = sys.intern(base_lang)
 
     def __repr__(self):
         return f"<Tag:data={self.data[self.base_lang]}>"
 
 
 class TagData:
+    __slots__ = ("type", "name", "lang", "display_name", "committed")
+
     def __init__(self, tag_type, name, lang, display_name=None, committed=True):
         """Information for a specific tag object
         @args:
@@ -78,9 +346,9 @@ class TagData:
             display_name
             comitted (): Has the tag been persisted?
         """
-        self.type = tag_type
+        self.type = _intern(tag_type)
         self.name = name
-        self.lang = lang
+        self.lang = _intern(lang)
         self.display_name = display_name
         if display_name is None:
             self.display_name = name
@@ -0,0 +1,241 @@
+"""
+Streaming export of the catalog (video, video_data, tag, tag_data and video_tag) for offline analysis.
+
+Tables are read with server side cursors in batches of batch_size rows and written out batch by
+batch, so memory use is bounded by about two batches whatever the size of the catalog. Each export is a snapshot directory under
+the export root, holding one file per table and a manifest.json:
+
+    parquet  one Parquet file per table, a row group per batch. Needs pyarrow
+    jsonl    gzipped JSON lines, dates as ISO strings
+    csv      gzipped CSV with a header row
+
+The default format is parquet when pyarrow is installed, jsonl otherwise.
+
+Exports after the first are incremental: only the videos, tags and tag data written since the
+previous snapshot are exported, according to their updated_at column. The titles (video_data)
+and tag links (video_tag) of a changed video are exported in full, as the VideoManager
+replaces them on every write, so consumers should replace those rows by video_id. Rows of
+other tables are replaced by id. The window of each export overlaps the previous one by a
+margin, so rows committed while the previous export ran aren't missed. The state of the
+export root only moves on once a snapshot is complete.
+
+    exporter = CatalogExporter(tm.engine, "exports")
+    manifest = exporter.export()
+"""
+
+import os
+import csv
+import gzip
+import json
+import time
+import shutil
+import logging
+from datetime import date
+from sqlalchemy import select, Integer, Float, Boolean, Date
+from henpy.persist import tables as T
+
+FORMATS = ("parquet", "jsonl", "csv")
+STATE_FILE = "state.json"
+MANIFEST_FILE = "manifest.json"
+
+
+def _pyarrow():
+    """
+    @returns
+        (pyarrow, pyarrow.parquet) tuple, None if pyarrow isn't installed
+    """
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        return None
+    return pyarrow, pyarrow.parquet
+
+
+def default_format():
+    return "parquet" if _pyarrow() is not None else "jsonl"
+
+
+def _write_json(path, data):
+    """Writes a JSON file atomically, so readers never see a partial file
+    """
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp, path)
+
+
+class _JSONLinesWriter:
+    extension = ".jsonl.gz"
+
+    def __init__(self, path, table):
+        self.columns = [column.name for column in table.columns]
+        self.f = gzip.open(path, "wt", encoding="utf-8")
+
+    def write(self, rows):
+        for row in rows:
+            self.f.write(json.dumps(dict(zip(self.columns, row)), ensure_ascii=False,
+                                    default=date.isoformat))
+            self.f.write("\n")
+
+    def close(self):
+        self.f.close()
+
+
+class _CSVWriter:
+    extension = ".csv.gz"
+
+    def __init__(self, path, table):
+        self.f = gzip.open(path, "wt", encoding="utf-8", newline="")
+        self.writer = csv.writer(self.f)
+        self.writer.writerow([column.name for column in table.columns])
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.f.close()
+
+
+class _ParquetWriter:
+    extension = ".parquet"
+
+    def __init__(self, path, table):
+        pa, pq = _pyarrow()
+        self.pa = pa
+        types = {Integer: pa.int64(), Float: pa.float64(), Boolean: pa.bool_(), Date: pa.date32()}
+        self.schema = pa.schema([(column.name, next((arrow for sql, arrow in types.items()
+                                                     if isinstance(column.type, sql)), pa.string()))
+                                 for column in table.columns])
+        self.writer = pq.ParquetWriter(path, self.schema, compression="zstd")
+
+    def write(self, rows):
+        columns = list(zip(*rows))
+        self.writer.write_table(self.pa.Table.from_arrays(
+            [self.pa.array(values, type=field.type) for values, field in zip(columns, self.schema)],
+            schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+_WRITERS = {"parquet": _ParquetWriter, "jsonl": _JSONLinesWriter, "csv": _CSVWriter}
+
+
+class CatalogExporter:
+    """Exports the catalog tables into snapshot directories under an export root
+    """
+
+    def __init__(self, engine, root, fmt=None, batch_size=10000, overlap=60.0):
+        """
+        @args
+            engine: SQLAlchemy engine, for instance SQLTagManager.engine
+            root (str): Directory the snapshots are written to
+            fmt (str): One of FORMATS, defaults to parquet if pyarrow is installed, jsonl otherwise
+            batch_size (int): Rows fetched and written at once
+            overlap (float): Seconds by which the window of an incremental export reaches back before
+                the end of the previous one. Should exceed the longest write transaction
+        """
+        fmt = fmt or default_format()
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown export format {fmt}, expected one of {FORMATS}")
+        if fmt == "parquet" and _pyarrow() is None:
+            raise ImportError("The parquet export format requires pyarrow")
+        self.engine = engine
+        self.root = root
+        self.fmt = fmt
+        self.batch_size = batch_size
+        self.overlap = overlap
+        T.create_all(self.engine)
+
+    def last_export(self):
+        """
+        @returns
+            dict with the snapshot name and the until timestamp of the last complete export, None if there is none
+        """
+        try:
+            with open(os.path.join(self.root, STATE_FILE), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def _queries(since):
+        """
+        @returns
+            list of (table, select) tuples of the rows to export, all rows if since is None
+        """
+        video, video_data, tag, tag_data = (T.Video.__table__, T.VideoData.__table__,
+                                            T.Tag.__table__, T.TagData.__table__)
+        queries = [(table, select(table).order_by(*table.primary_key.columns))
+                   for table in (video, video_data, tag, tag_data, T.video_tag)]
+        if since is None:
+            return queries
+        changed = select(video.c.id).where(video.c.updated_at > since)
+        where = {video: video.c.updated_at > since,
+                 video_data: video_data.c.video_id.in_(changed),
+                 tag: tag.c.updated_at > since,
+                 tag_data: tag_data.c.updated_at > since,
+                 T.video_tag: T.video_tag.c.video_id.in_(changed)}
+        return [(table, query.where(where[table])) for table, query in queries]
+
+    def _snapshot_dir(self, kind):
+        name = f"{time.strftime('%Y%m%dT%H%M%S')}-{kind}"
+        path, n = os.path.join(self.root, name), 1
+        while os.path.exists(path):
+            n += 1
+            path = os.path.join(self.root, f"{name}.{n}")
+        os.makedirs(path)
+        return path
+
+    def _export_table(self, conn, table, query, path):
+        """Streams the rows of a query into the file of a table
+        @returns
+            dict with the filename and the number of rows written
+        """
+        writer_cls = _WRITERS[self.fmt]
+        filename = table.name + writer_cls.extension
+        writer = writer_cls(os.path.join(path, filename), table)
+        rows = 0
+        try:
+            result = conn.execution_options(stream_results=True).execute(query)
+            for batch in result.partitions(self.batch_size):
+                writer.write(batch)
+                rows += len(batch)
+        finally:
+            writer.close()
+        return {"file": filename, "rows": rows}
+
+    def export(self, full=False):
+        """Exports the rows written since the last export, or everything on the first export
+        @args
+            full (bool): Export everything even if there is a previous export
+        @returns
+            manifest dict of the snapshot, with the rows exported per table
+        """
+        start = time.perf_counter()
+        last = None if full else self.last_export()
+        since = None if last is None else last["until"] - self.overlap
+        kind = "full" if since is None else "incremental"
+        until = time.time()
+        path = self._snapshot_dir(kind)
+        manifest = {"snapshot": os.path.basename(path), "kind": kind, "format": self.fmt,
+                    "since": since, "until": until, "tables": {}}
+
+        try:
+            # A single transaction, so the tables are exported as of the same point in time
+            with self.engine.connect() as conn, conn.begin():
+                for table, query in self._queries(since):
+                    manifest["tables"][table.name] = self._export_table(conn, table, query, path)
+        except BaseException:
+            # Incomplete snapshots are dropped, the next export covers their window again
+            shutil.rmtree(path, ignore_errors=True)
+            raise
+
+        manifest["seconds"] = time.perf_counter() - start
+        _write_json(os.path.join(path, MANIFEST_FILE), manifest)
+        _write_json(os.path.join(self.root, STATE_FILE), {"snapshot": manifest["snapshot"], "until": until})
+        total = sum(table["rows"] for table in manifest["tables"].values())
+        logging.info(f"Exported {kind} snapshot {manifest['snapshot']} of {total} rows "
+                     f"in {manifest['seconds']:.2f}s")
+        return manifest
@@ -0,0 +1,411 @@
+"""
+Managers persisting scraped data into the tables of henpy.persist.tables
+"""
+
+import time
+import logging
+from datetime import date, datetime
+from itertools import islice
+from sqlalchemy import select, bindparam, func, case
+from henpy.persist import tables as T
+from henpy.preprocessing.codes import canonical_code
+
+
+def _batched(iterable, size):
+    """Splits an iterable into lists of at most size items
+    """
+    it = iter(iterable)
+    while True:
+        batch = list(islice(it, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _parse_date(value):
+    """Converts a scraped release date into a date, None if empty or unparseable
+    """
+    if isinstance(value, date) or value is None:
+        return value
+    try:
+        return datetime.strptime(value.strip(), "%Y-%m-%d").date()
+    except ValueError:
+        return None
+
+
+def _tag_id(tag):
+    """Gets the id of a tag given either a Tag object or the id itself
+    """
+    return tag if isinstance(tag, int) else tag.id
+
+
+class VideoManager:
+    """Writes VideoMetadata into the Video, VideoData and video_tag tables.
+    Videos are upserted on their code, and each batch is written in a single transaction
+    with multi-row statements.
+    """
+
+    def __init__(self, engine, batch_size=500, index=None):
+        """
+        @args
+            engine: SQLAlchemy engine to write to, for instance SQLTagManager.engine
+            batch_size (int): Number of videos written per transaction
+            index (TagIndex): Optional tag index kept up to date with the written tags
+        """
+        self.engine = engine
+        self.batch_size = batch_size
+        self.index = index
+        if index is not None and index.engine is None:
+            # Lets the index look up the types of tags it hasn't seen yet
+            index.engine = engine
+        T.create_all(self.engine)
+
+    def upsert(self, videos):
+        """Persists a stream of videos, replacing the titles and tags of videos already stored
+        @args
+            videos (iterable of VideoMetadata): Videos to store. Tags must be persisted Tag objects or tag ids
+        @returns
+            dict with the counts of videos inserted, updated and tag links written, and the write rate
+        """
+        start = time.perf_counter()
+        stats = {"inserted": 0, "updated": 0, "links": 0}
+        for batch in _batched(videos, self.batch_size):
+            self._upsert_batch(batch, stats)
+        elapsed = time.perf_counter() - start
+        total = stats["inserted"] + stats["updated"]
+        stats["seconds"] = elapsed
+        stats["videos_per_sec"] = total / elapsed if elapsed else 0.0
+        logging.info(f"Stored {total} videos ({stats['inserted']} new) with {stats['links']} tag links "
+                     f"in {elapsed:.2f}s ({stats['videos_per_sec']:.0f} videos/sec)")
+        return stats
+
+    def _upsert_batch(self, batch, stats):
+        video = T.Video.__table__
+        video_data = T.VideoData.__table__
+        video_tag = T.video_tag
+        # Later entries of the same code win
+        batch = list({metadata.code: metadata for metadata in batch}.values())
+        codes = [metadata.code for metadata in batch]
+
+        with self.engine.begin() as conn:
+            ids = dict(conn.execute(select(video.c.code, video.c.id).where(video.c.code.in_(codes))).fetchall())
+            rows = [{"code": metadata.code,
+                     "release_date": _parse_date(metadata.release_date),
+                     "image_path": metadata.image_path or None,
+                     "director": metadata.director or "",
+                     "maker": metadata.maker or "",
+                     "label": metadata.label or ""} for metadata in batch]
+            new = [row for row in rows if row["code"] not in ids]
+            updates = [dict(row, _code=row["code"]) for row in rows if row["code"] in ids]
+            if new:
+                conn.execute(video.insert(), new)
+                ids.update(conn.execute(select(video.c.code, video.c.id)
+                                        .where(video.c.code.in_([row["code"] for row in new]))).fetchall())
+            if updates:
+                conn.execute(video.update()
+                             .where(video.c.code == bindparam("_code"))
+                             .values(release_date=bindparam("release_date"),
+                                     image_path=bindparam("image_path"),
+                                     director=bindparam("director"),
+                                     maker=bindparam("maker"),
+                                     label=bindparam("label")),
+                             [{key: value for key, value in row.items() if key != "code"} for row in updates])
+                updated_ids = [ids[row["code"]] for row in updates]
+                conn.execute(video_data.delete().where(video_data.c.video_id.in_(updated_ids)))
+                conn.execute(video_tag.delete().where(video_tag.c.video_id.in_(updated_ids)))
+
+            titles = [{"video_id": ids[metadata.code], "language": language, "title": title}
+                      for metadata in batch for language, title in metadata.title.items()]
+            if titles:
+                conn.execute(video_data.insert(), titles)
+            links = [{"video_id": ids[metadata.code], "tag_id": tag_id}
+                     for metadata in batch
+                     for tag_id in dict.fromkeys(_tag_id(tag) for tag in metadata.tags)]
+            if links:
+                conn.execute(video_tag.insert(), links)
+
+        if self.index is not None:
+            for metadata in batch:
+                self.index.set_tags(ids[metadata.code], [_tag_id(tag) for tag in metadata.tags])
+        stats["inserted"] += len(new)
+        stats["updated"] += len(updates)
+        stats["links"] += len(links)
+
+    def remote_images(self):
+        """Videos whose image_path still holds the scraped url rather than a local file
+        @returns
+            list of (code, url) tuples
+        """
+        video = T.Video.__table__
+        with self.engine.connect() as conn:
+            return conn.execute(select(video.c.code, video.c.image_path)
+                                .where(video.c.image_path.startswith("//") |
+                                       video.c.image_path.startswith("http"))).fetchall()
+
+    def set_image_paths(self, paths):
+        """Updates the image_path of stored videos
+        @args
+            paths (dict): Local image path keyed by video code
+        """
+        if not paths:
+            return
+        video = T.Video.__table__
+        with self.engine.begin() as conn:
+            conn.execute(video.update()
+                         .where(video.c.code == bindparam("_code"))
+                         .values(image_path=bindparam("image_path")),
+                         [{"_code": code, "image_path": path} for code, path in paths.items()])
+
+
+# Seconds before the lookup of a code with a given outcome goes stale
+LOOKUP_TTLS = {"found": 30 * 24 * 3600,
+               "ambiguous": 7 * 24 * 3600,
+               "missing": 3 * 24 * 3600,
+               "error": 3600}
+
+
+class LookupLedger:
+    """Persistent record of the last lookup outcome of each code, in the lookup table.
+    Codes are only searched again once their entry is stale, so codes known to be missing
+    or recently found don't cost any requests. Codes are keyed by their canonical form.
+
+    Outcomes:
+        found: The code matched a video exactly. Its access url is kept
+        ambiguous: The search listed candidates, none of them the code
+        missing: The search came back empty
+        error: The lookup failed
+    """
+
+    def __init__(self, engine, ttls=None, batch_size=500):
+        """
+        @args
+            engine: SQLAlchemy engine, for instance SQLTagManager.engine
+            ttls (dict): Overrides of LOOKUP_TTLS, seconds keyed by outcome
+            batch_size (int): Number of codes per statement
+        """
+        self.engine = engine
+        self.ttls = dict(LOOKUP_TTLS, **(ttls or {}))
+        self.batch_size = batch_size
+        T.create_all(self.engine)
+
+    @staticmethod
+    def _key(code):
+        return canonical_code(code) or code
+
+    def get(self, codes):
+        """Ledger entries of codes
+        @returns
+            dict of (outcome, looked_up_at, access_url) tuples keyed by canonical code, for the codes in the ledger
+        """
+        table = T.Lookup.__table__
+        res = {}
+        with self.engine.connect() as conn:
+            for batch in _batched(dict.fromkeys(self._key(code) for code in codes), self.batch_size):
+                for code, outcome, looked_up_at, access_url in conn.execute(
+                        select(table.c.code, table.c.outcome, table.c.looked_up_at, table.c.access_url)
+                        .where(table.c.code.in_(batch))):
+                    res[code] = (outcome, looked_up_at, access_url)
+        return res
+
+    def is_stale(self, outcome, looked_up_at, now=None):
+        now = time.time() if now is None else now
+        return now - looked_up_at >= self.ttls[outcome]
+
+    def due(self, codes, now=None):
+        """Filters codes down to the ones to look up: never looked up, or with a stale entry
+        @returns
+            list of canonical codes in the order of codes
+        """
+        now = time.time() if now is None else now
+        codes = list(dict.fromkeys(self._key(code) for code in codes))
+        known = self.get(codes)
+        return [code for code in codes
+                if code not in known or self.is_stale(*known[code][:2], now=now)]
+
+    def stale(self, limit, now=None):
+        """Stale ledger entries, most overdue (relative to their ttl) first
+        @args
+            limit (int): Maximum number of entries
+        @returns
+            list of (code, outcome, access_url) tuples
+        """
+        now = time.time() if now is None else now
+        table = T.Lookup.__table__
+        candidates = []
+        with self.engine.connect() as conn:
+            # One indexed query per outcome, each already ordered oldest first
+            for outcome, ttl in self.ttls.items():
+                rows = conn.execute(select(table.c.code, table.c.looked_up_at, table.c.access_url)
+                                    .where(table.c.outcome == outcome, table.c.looked_up_at <= now - ttl)
+                                    .order_by(table.c.looked_up_at)
+                                    .limit(limit)).fetchall()
+                candidates.extend(((now - looked_up_at) / ttl, code, outcome, access_url)
+                                  for code, looked_up_at, access_url in rows)
+        candidates.sort(key=lambda candidate: -candidate[0])
+        return [(code, outcome, access_url) for overdue, code, outcome, access_url in candidates[:limit]]
+
+    def record(self, outcomes, now=None):
+        """Records lookup outcomes
+        @args
+            outcomes (iterable): (code, outcome, access_url) tuples. access_url may be None
+        """
+        now = time.time() if now is None else now
+        table = T.Lookup.__table__
+        for batch in _batched(outcomes, self.batch_size):
+            rows = {}
+            for code, outcome, access_url in batch:
+                if outcome not in self.ttls:
+                    raise ValueError(f"Unknown lookup outcome {outcome}")
+                rows[self._key(code)] = {"outcome": outcome, "looked_up_at": now, "access_url": access_url}
+            with self.engine.begin() as conn:
+                known = {code for code, in conn.execute(select(table.c.code).where(table.c.code.in_(list(rows))))}
+                new = [dict(row, code=code) for code, row in rows.items() if code not in known]
+                updates = [dict(row, _code=code) for code, row in rows.items() if code in known]
+                if new:
+                    conn.execute(table.insert(), new)
+                if updates:
+                    conn.execute(table.update()
+                                 .where(table.c.code == bindparam("_code"))
+                                 .values(outcome=bindparam("outcome"), looked_up_at=bindparam("looked_up_at"),
+                                         # A failed lookup says nothing about the page, keep its url
+                                         access_url=case((bindparam("outcome") == "error", table.c.access_url),
+                                                         else_=bindparam("access_url"))),
+                                 updates)
+
+    def counts(self):
+        """Number of ledger entries per outcome
+        """
+        table = T.Lookup.__table__
+        with self.engine.connect() as conn:
+            return dict(conn.execute(select(table.c.outcome, func.count()).group_by(table.c.outcome)).fetchall())
+
+
+class JobQueue:
+    """Durable queue of crawl jobs in the crawl_job table, one job per code.
+    Jobs move from pending to running when claimed, and to done or failed once finished.
+    Jobs left running by an interrupted crawl are put back with recover, so a crawl resumes
+    where it stopped.
+    """
+
+    def __init__(self, engine, name="default", batch_size=500):
+        """
+        @args
+            engine: SQLAlchemy engine, for instance SQLTagManager.engine
+            name (str): Name of the queue, several crawls can share the table
+            batch_size (int): Number of codes per statement
+        """
+        self.engine = engine
+        self.name = name
+        self.batch_size = batch_size
+        T.create_all(self.engine)
+
+    def enqueue(self, codes, now=None):
+        """Adds jobs for codes, skipping codes the queue already holds
+        @returns
+            Number of jobs added
+        """
+        now = time.time() if now is None else now
+        table = T.CrawlJob.__table__
+        added = 0
+        for batch in _batched(dict.fromkeys(codes), self.batch_size):
+            with self.engine.begin() as conn:
+                known = {code for code, in conn.execute(select(table.c.code)
+                                                        .where(table.c.queue == self.name, table.c.code.in_(batch)))}
+                new = [{"queue": self.name, "code": code, "status": "pending", "attempts": 0,
+                        "available_at": now, "updated_at": now} for code in batch if code not in known]
+                if new:
+                    conn.execute(table.insert(), new)
+            added += len(new)
+        return added
+
+    def claim(self, limit, now=None):
+        """Claims available pending jobs, oldest first
+        @returns
+            list of (id, code, attempts) tuples
+        """
+        now = time.time() if now is None else now
+        table = T.CrawlJob.__table__
+        with self.engine.begin() as conn:
+            rows = conn.execute(select(table.c.id, table.c.code, table.c.attempts)
+                                .where(table.c.queue == self.name, table.c.status == "pending",
+                                       table.c.available_at <= now)
+                                .order_by(table.c.available_at, table.c.id)
+                                .limit(limit)).fetchall()
+            if rows:
+                conn.execute(table.update()
+                             .where(table.c.id.in_([row[0] for row in rows]))
+                             .values(status="running", updated_at=now))
+        return [tuple(row) for row in rows]
+
+    def complete(self, results, now=None):
+        """Marks jobs as done
+        @args
+            results (iterable): (id, outcome) tuples
+        """
+        self._update([{"_id": job_id, "status": "done", "outcome": outcome, "error": None}
+                      for job_id, outcome in results], now)
+
+    def retry(self, failures, now=None):
+        """Puts failed jobs back in the queue
+        @args
+            failures (iterable): (id, attempts, delay, error) tuples. The job is available again after delay seconds
+        """
+        now = time.time() if now is None else now
+        self._update([{"_id": job_id, "status": "pending", "attempts": attempts,
+                       "available_at": now + delay, "error": str(error)[:255]}
+                      for job_id, attempts, delay, error in failures], now)
+
+    def fail(self, failures, now=None):
+        """Gives up on jobs
+        @args
+            failures (iterable): (id, attempts, error) tuples
+        """
+        self._update([{"_id": job_id, "status": "failed", "attempts": attempts, "error": str(error)[:255]}
+                      for job_id, attempts, error in failures], now)
+
+    def _update(self, rows, now):
+        if not rows:
+            return
+        now = time.time() if now is None else now
+        table = T.CrawlJob.__table__
+        # Rows with the same columns go through a single executemany. Bound parameters
+        # can't share the names of the columns they set, hence the prefix
+        groups = {}
+        for row in rows:
+            row = {"_" + key if key != "_id" else key: value for key, value in row.items()}
+            row["_updated_at"] = now
+            groups.setdefault(tuple(sorted(row)), []).append(row)
+        with self.engine.begin() as conn:
+            for keys, group in groups.items():
+                conn.execute(table.update()
+                             .where(table.c.id == bindparam("_id"))
+                             .values({key[1:]: bindparam(key) for key in keys if key != "_id"}),
+                             group)
+
+    def recover(self):
+        """Puts the jobs left running by an interrupted crawl back in the queue
+        @returns
+            Number of jobs recovered
+        """
+        table = T.CrawlJob.__table__
+        with self.engine.begin() as conn:
+            return conn.execute(table.update()
+                                .where(table.c.queue == self.name, table.c.status == "running")
+                                .values(status="pending")).rowcount
+
+    def next_available(self):
+        """Timestamp at which the next pending job becomes available, None if there are none
+        """
+        table = T.CrawlJob.__table__
+        with self.engine.connect() as conn:
+            return conn.execute(select(func.min(table.c.available_at))
+                                .where(table.c.queue == self.name, table.c.status == "pending")).scalar()
+
+    def counts(self):
+        """Number of jobs per status
+        """
+        table = T.CrawlJob.__table__
+        with self.engine.connect() as conn:
+            return dict(conn.execute(select(table.c.status, func.count())
+                                     .where(table.c.queue == self.name)
+                                     .group_by(table.c.status)).fetchall())
@@ -0,0 +1,92 @@
+"""
+Engine and session setup shared by the managers.
+
+SQLite databases are opened in WAL mode with tuned pragmas, so readers don't block the writer,
+and sessions are scoped to the calling thread so several scraper threads can share a manager.
+"""
+
+from contextlib import contextmanager
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy.pool import QueuePool, StaticPool
+
+# Applied to every new SQLite connection
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    # Safe with WAL, only the last transactions can be lost on power failure
+    "synchronous": "NORMAL",
+    # Negative values are in KiB, 64MB
+    "cache_size": -64000,
+    "mmap_size": 256 * 1024 * 1024,
+    "temp_store": "MEMORY",
+    # Wait on locks instead of failing with "database is locked"
+    "busy_timeout": 10000,
+}
+
+
+def _is_memory(db_path):
+    return db_path in ("sqlite://", "sqlite:///:memory:") or "mode=memory" in db_path
+
+
+def create_storage_engine(db_path, pool_size=8, pragmas=None, **kwargs):
+    """Creates an engine for db_path. SQLite connections are pooled, shared across threads
+    and configured with SQLITE_PRAGMAS
+    @args
+        db_path (str): SQLAlchemy database url
+        pool_size (int): Number of pooled connections for file databases
+        pragmas (dict): Overrides of SQLITE_PRAGMAS
+        **kwargs: Passed on to create_engine
+    @returns
+        Engine object
+    """
+    if not db_path.startswith("sqlite"):
+        return create_engine(db_path, **kwargs)
+
+    connect_args = kwargs.pop("connect_args", {})
+    connect_args.setdefault("check_same_thread", False)
+    if _is_memory(db_path):
+        # Every connection to an in-memory database is a new database, so share the one
+        kwargs.setdefault("poolclass", StaticPool)
+    else:
+        kwargs.setdefault("poolclass", QueuePool)
+        kwargs.setdefault("pool_size", pool_size)
+        kwargs.setdefault("max_overflow", pool_size)
+    engine = create_engine(db_path, connect_args=connect_args, **kwargs)
+
+    settings = dict(SQLITE_PRAGMAS, **(pragmas or {}))
+    if _is_memory(db_path):
+        settings.pop("journal_mode", None)
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in settings.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+    return engine
+
+
+def session_factory(engine):
+    """Creates a thread scoped session factory. Objects stay loaded after commits,
+    so they can be held (eg cached) beyond the transaction that loaded them
+    @returns
+        scoped_session object. Calling it returns the session of the calling thread
+    """
+    return scoped_session(sessionmaker(bind=engine, expire_on_commit=False))
+
+
+@contextmanager
+def session_scope(Session):
+    """Runs a short lived transaction on the session of the calling thread,
+    committing on success and rolling back on errors
+    @args
+        Session: scoped_session object, see session_factory
+    """
+    session = Session()
+    try:
+        yield session
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
@@ -1,7 +1,10 @@
-from sqlalchemy import Column, ForeignKey, Integer, String, Date, Table
+import time
+import logging
+from sqlalchemy import Column, ForeignKey, Integer, String, Date, Table, Float, Boolean, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.exc import IntegrityError
 
 
 Base = declarative_base()
@@ -9,8 +12,8 @@ Base = declarative_base()
 
 # Association table for many2many video tag relatiojn
 video_tag = Table("video_tag", Base.metadata,
-                  Column("video_id", Integer, ForeignKey("video.id")),
-                  Column("tag_id", Integer, ForeignKey("tag.id")),)
+                  Column("video_id", Integer, ForeignKey("video.id"), primary_key=True),
+                  Column("tag_id", Integer, ForeignKey("tag.id"), primary_key=True, index=True),)
 
 
 class Tag(Base):
@@ -19,10 +22,12 @@ class Tag(Base):
         id
         name
         data
+        updated_at (float): Timestamp of the last write, used by incremental exports
     """
     __tablename__ = "tag"
     id = Column(Integer, primary_key=True)
     name = Column(String(255), nullable=False)
+    updated_at = Column(Float, default=time.time, onupdate=time.time, index=True)
     data = relationship("TagData")
 
     videos = relationship(
@@ -39,31 +44,38 @@ class TagData(Base):
         language
         name
         display_name
+        updated_at (float): Timestamp of the last write, used by incremental exports
     """
     __tablename__ = "tag_data"
+    # Tags are looked up by their name in a language, so it must identify a single tag
+    __table_args__ = (Index("ix_tag_data_language_name", "language", "name", unique=True),)
     id = Column(Integer, primary_key=True)
     tag_id = Column(Integer, ForeignKey("tag.id"))
     type = Column(String(255))
     language = Column(String(20), nullable=False)
     name = Column(String(255), nullable=False, index=True)
     display_name = Column(String(255), nullable=False)
+    updated_at = Column(Float, default=time.time, onupdate=time.time, index=True)
 
 
 class Video(Base):
     __tablename__ = "video"
 
     id = Column(Integer, primary_key=True)
-    code = Column(String(50), nullable=False, index=True)
+    code = Column(String(50), nullable=False, index=True, unique=True)
     release_date = Column(Date, index=True)
     image_path = Column(String(255), nullable=True)  # Images are optional
     director = Column(String(100), nullable=False)
     maker = Column(String(100), nullable=False)
     label = Column(String(100), nullable=False)
+    # Timestamp of the last write, used by incremental exports
+    updated_at = Column(Float, default=time.time, onupdate=time.time, index=True)
 
     tags = relationship(
         "Tag",
         secondary=video_tag,
         back_populates="videos")
+    data = relationship("VideoData")
 
     def __repr__(self):
         return self.__str__()
@@ -77,5 +89,94 @@ class VideoData(Base):
     """
     __tablename__ = "video_data"
     id = Column(Integer, primary_key=True)
+    video_id = Column(Integer, ForeignKey("video.id"), index=True)
     title = Column(String(100), nullable=False)
     language = Column(String(20), nullable=False)
+
+
+class LibraryFile(Base):
+    """Manifest entry of a file seen by the library scanner
+    @attrs
+        path (str): Absolute path of the file
+        mtime (float)
+        size (int)
+        codes (str): Comma separated canonical codes found in the filename
+        looked_up (bool): Have the codes of the file been searched
+    """
+    __tablename__ = "library_file"
+    id = Column(Integer, primary_key=True)
+    path = Column(String(1024), nullable=False, unique=True)
+    mtime = Column(Float, nullable=False)
+    size = Column(Integer, nullable=False)
+    codes = Column(String(255), nullable=False, default="")
+    looked_up = Column(Boolean, nullable=False, default=False, index=True)
+
+
+class Lookup(Base):
+    """Ledger entry of the last lookup of a code against the remote site
+    @attrs
+        code (str): Canonical code
+        outcome (str): found, ambiguous, missing or error, see LookupLedger
+        looked_up_at (float): Timestamp of the lookup
+        access_url (str): Url of the video page if found, to refresh it without searching again
+    """
+    __tablename__ = "lookup"
+    __table_args__ = (Index("ix_lookup_outcome_time", "outcome", "looked_up_at"),)
+    id = Column(Integer, primary_key=True)
+    code = Column(String(50), nullable=False, unique=True)
+    outcome = Column(String(20), nullable=False)
+    looked_up_at = Column(Float, nullable=False)
+    access_url = Column(String(255), nullable=True)
+
+
+class CrawlJob(Base):
+    """Work item of a crawl, see JobQueue
+    @attrs
+        queue (str): Name of the crawl the job belongs to
+        code (str): Code to look up
+        status (str): pending, running, done or failed
+        attempts (int): Number of failed attempts so far
+        available_at (float): Timestamp from which the job may be claimed
+        outcome (str): Lookup outcome once done, see LookupLedger
+        error (str): Last error of the job
+    """
+    __tablename__ = "crawl_job"
+    __table_args__ = (Index("ix_crawl_job_claim", "queue", "status", "available_at"),
+                      Index("ix_crawl_job_code", "queue", "code", unique=True))
+    id = Column(Integer, primary_key=True)
+    queue = Column(String(50), nullable=False)
+    code = Column(String(50), nullable=False)
+    status = Column(String(10), nullable=False, default="pending")
+    attempts = Column(Integer, nullable=False, default=0)
+    available_at = Column(Float, nullable=False, default=0.0)
+    updated_at = Column(Float, nullable=True)
+    outcome = Column(String(20), nullable=True)
+    error = Column(String(255), nullable=True)
+
+
+def create_all(engine):
+    """Creates the missing tables, and adds the nullable columns and the indexes introduced
+    since an existing table was created, so databases of earlier versions keep working
+    @args
+        engine: SQLAlchemy engine
+    """
+    Base.metadata.create_all(engine)
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        present = {column["name"] for column in inspector.get_columns(table.name)}
+        indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+        with engine.begin() as conn:
+            for column in table.columns:
+                if column.name not in present and column.nullable:
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} "
+                                      f"{column.type.compile(engine.dialect)}"))
+        for index in table.indexes:
+            if index.name in indexes:
+                continue
+            try:
+                with engine.begin() as conn:
+                    index.create(conn, checkfirst=True)
+            except IntegrityError:
+                # Rows written by earlier versions break the constraint, they have to be merged by hand
+                logging.warning(f"Unable to create the unique index {index.name}, "
+                                f"{table.name} holds duplicates")
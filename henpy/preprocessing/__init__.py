@@ -0,0 +1,3 @@
+from henpy._lazy import lazy_submodules
+
+__getattr__, __dir__ = lazy_submodules(__name__, ["codes", "scanner"])
@@ -0,0 +1,182 @@
+"""
+Canonicalization of video codes.
+
+Codes come in many spellings ("love49", "LOVE-049", "LOVE049", "[hd]love_049.mp4"), which
+all map to a single canonical (prefix, number, suffix) key, rendered as "LOVE-049".
+"""
+
+import re
+from collections import namedtuple
+
+# A code on its own: letters, optional separator, digits and an optional single letter suffix.
+# Matched against uppercased input, which is cheaper than a case insensitive pattern
+_code_re = re.compile(r"\s*([A-Z]{2,8})[-_ ]?0*(\d{1,6})(?:[-_ ]?([A-Z]))?\s*$")
+# Same as _code_re, for a batch of codes joined by newlines. Lines that aren't codes match the
+# second branch with empty groups, so the results line up with the batch. [^\S\n] is the \s of
+# _code_re without the newline separating the codes
+_batch_re = re.compile(r"^[^\S\n]*(?:([A-Z]{2,8})[-_ ]?0*(\d{1,6})(?:[-_ ]?([A-Z]))?[^\S\n]*$|.*$)",
+                       re.MULTILINE)
+# Codes embedded in filenames. Requires two digits and no adjoining letters or digits,
+# to avoid matching words or resolutions. Unlike _code_re, spaces don't separate the letters from
+# the digits, as they would join words with years or resolutions ("Title 2021", "Movie 1080p").
+# A suffix letter has to follow the digits directly: a separated letter ("SSIS-001-C", "ABC-123-A")
+# tags subtitles or parts of the file, not the code. Part markers such as "cd2" may follow the
+# digits directly too, domains ("hhd800.com@SSIS-001") may not
+_fragment_re = re.compile(r"(?<![a-z\d])([a-z]{2,8})[-_]?0*(\d{2,6})([a-z])?"
+                          r"(?=(?:cd|pt|part|disc|disk)\d|(?![a-z\d]))"
+                          r"(?!\.(?:com|net|org|info|xyz|top|vip|club|cc|tv|me|la|io)(?![a-z\d]))",
+                          re.IGNORECASE)
+# Filename tokens shaped like codes that never are ones
+_ignored_prefixes = frozenset(["fhd", "uhd", "hd", "sd", "mp", "dvd", "aac", "ac", "dts", "ddp", "hevc",
+                               "avc", "rip", "bd", "bluray", "web", "vol", "part", "cd", "disc", "ch"])
+
+
+class CodeKey(namedtuple("CodeKey", ["prefix", "number", "suffix"])):
+    """Canonical key of a video code
+    @attrs
+        prefix (str): Uppercase letters of the code
+        number (int)
+        suffix (str): Uppercase single letter suffix, "" if none
+    """
+    __slots__ = ()
+
+    def __str__(self):
+        return f"{self.prefix}-{self.number:03d}{self.suffix}"
+
+
+_new_key = tuple.__new__
+
+
+def _key(prefix, number, suffix):
+    return _new_key(CodeKey, (prefix.upper(), int(number), suffix.upper() if suffix else ""))
+
+
+def canonicalize(raw, _match=_code_re.match):
+    """Canonicalizes a raw code
+    @args
+        raw (str): Code as typed or scraped, eg "love49"
+    @returns
+        CodeKey object, or None if raw isn't shaped like a code
+    """
+    match = _match(raw.upper())
+    if match is None:
+        return None
+    prefix, number, suffix = match.groups()
+    return _new_key(CodeKey, (prefix, int(number), suffix or ""))
+
+
+def canonical_code(raw):
+    """Canonical string form of a raw code, eg "LOVE-049". raw is returned unchanged if it can't be parsed
+    """
+    key = canonicalize(raw)
+    return raw if key is None else str(key)
+
+
+def canonicalize_many(raws):
+    """Canonicalizes a batch of raw codes. The whole batch is parsed by a single regex pass,
+    which handles a million codes in a couple of seconds
+    @args
+        raws (iterable of str)
+    @returns
+        list of CodeKey objects (or None for unparseable codes) in the order of raws
+    """
+    raws = list(raws)
+    if not raws:
+        return []
+    groups = _batch_re.findall("\n".join(raws).upper())
+    if len(groups) != len(raws):
+        # Some raw code spans several lines, the batch doesn't line up
+        return [canonicalize(raw) for raw in raws]
+    return [_new_key(CodeKey, (prefix, int(number), suffix)) if prefix else None
+            for prefix, number, suffix in groups]
+
+
+def extract_codes(name):
+    """Finds the codes in a filename or other free text
+    @args
+        name (str): eg "[hd]love_049.mp4"
+    @returns
+        list of unique CodeKey objects in order of appearance
+    """
+    res = []
+    for prefix, number, suffix in _fragment_re.findall(name):
+        if prefix.lower() in _ignored_prefixes:
+            continue
+        key = _key(prefix, number, suffix)
+        if key not in res:
+            res.append(key)
+    return res
+
+
+def same_code(a, b):
+    """Checks whether two raw codes are spellings of the same code
+    """
+    key = canonicalize(a)
+    return key is not None and key == canonicalize(b)
+
+
+class CodeIndex:
+    """Deduplicating index of raw codes grouped by their canonical key
+    @attrs
+        rejected (list): Raw codes that couldn't be canonicalized
+    """
+
+    def __init__(self, raws=()):
+        # Raw spellings keyed by canonical key, in insertion order
+        self._groups = {}
+        self.rejected = []
+        self.update(raws)
+
+    def add(self, raw):
+        """Adds a raw code to the index
+        @returns
+            CodeKey object the code was filed under, None if rejected
+        """
+        return self._file(raw, canonicalize(raw))
+
+    def update(self, raws):
+        """Adds a batch of raw codes to the index, see canonicalize_many
+        """
+        raws = list(raws)
+        keys = canonicalize_many(raws)
+        groups = self._groups
+        for raw, key in zip(raws, keys):
+            if key is None:
+                self.rejected.append(raw)
+                continue
+            group = groups.get(key)
+            if group is None:
+                groups[key] = [raw]
+            else:
+                group.append(raw)
+
+    def _file(self, raw, key):
+        if key is None:
+            self.rejected.append(raw)
+            return None
+        group = self._groups.get(key)
+        if group is None:
+            self._groups[key] = [raw]
+        else:
+            group.append(raw)
+        return key
+
+    def spellings(self, key):
+        """Raw codes filed under key
+        """
+        return self._groups.get(key, [])
+
+    def codes(self):
+        """Canonical code strings, each code once
+        """
+        return [str(key) for key in self._groups]
+
+    def __iter__(self):
+        return iter(self._groups)
+
+    def __contains__(self, raw):
+        key = raw if isinstance(raw, CodeKey) else canonicalize(raw)
+        return key in self._groups
+
+    def __len__(self):
+        return len(self._groups)
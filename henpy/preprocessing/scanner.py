@@ -0,0 +1,228 @@
+"""
+Incremental scanner turning a media library into batches of codes to look up.
+
+A manifest of every file seen (path, mtime, size and the codes in its name) is kept in the
+library_file table, so rescans only extract codes from new or changed files and only
+their codes are searched again.
+
+usage: python -m henpy.preprocessing.scanner <library root> <database url>
+"""
+
+import os
+import sys
+import time
+import logging
+from sqlalchemy import select, bindparam
+from henpy.persist import tables as T
+from henpy.preprocessing.codes import extract_codes, canonicalize
+
+VIDEO_EXTENSIONS = frozenset([".mp4", ".mkv", ".avi", ".wmv", ".mov", ".m4v", ".mpg", ".mpeg", ".ts",
+                              ".m2ts", ".flv", ".webm", ".iso", ".rmvb"])
+
+
+class LibraryScanner:
+    """Scans directory trees for video files and keeps track of their codes
+    """
+
+    def __init__(self, engine, extensions=VIDEO_EXTENSIONS, batch_size=5000):
+        """
+        @args
+            engine: SQLAlchemy engine holding the manifest, for instance SQLTagManager.engine
+            extensions (iterable of str): Lowercase file extensions considered videos
+            batch_size (int): Number of manifest rows written per statement
+        """
+        self.engine = engine
+        self.extensions = frozenset(extensions)
+        self.batch_size = batch_size
+        T.create_all(self.engine)
+
+    def _walk(self, root):
+        """Yields (path, stat) for every video file under root
+        """
+        stack = [root]
+        while stack:
+            directory = stack.pop()
+            try:
+                entries = os.scandir(directory)
+            except OSError as e:
+                logging.warning(f"Unable to scan {directory}: {e}")
+                continue
+            with entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif os.path.splitext(entry.name)[1].lower() in self.extensions:
+                            yield entry.path, entry.stat()
+                    except OSError as e:
+                        logging.warning(f"Unable to stat {entry.path}: {e}")
+
+    def scan(self, root):
+        """Scans root, updating the manifest with new, changed and removed files
+        @args
+            root (str): Directory to scan
+        @returns
+            dict with the counts of files seen, new, changed and removed and the scan time
+        """
+        start = time.perf_counter()
+        root = os.path.abspath(root)
+        table = T.LibraryFile.__table__
+        prefix = os.path.join(root, "")
+        with self.engine.connect() as conn:
+            known = {path: (mtime, size, codes, looked_up) for path, mtime, size, codes, looked_up in conn.execute(
+                select(table.c.path, table.c.mtime, table.c.size, table.c.codes, table.c.looked_up)
+                .where(table.c.path.startswith(prefix, autoescape=True)))}
+
+        stats = {"seen": 0, "new": 0, "changed": 0, "removed": 0}
+        new, changed = [], []
+        for path, stat in self._walk(root):
+            stats["seen"] += 1
+            entry = known.pop(path, None)
+            if entry is not None and entry[0] == stat.st_mtime and entry[1] == stat.st_size:
+                continue
+            codes = ",".join(str(key) for key in extract_codes(os.path.basename(path)))
+            row = {"path": path, "mtime": stat.st_mtime, "size": stat.st_size, "codes": codes}
+            if entry is None:
+                row["looked_up"] = False
+                new.append(row)
+            else:
+                # Files only need searching again if their codes changed
+                row["looked_up"] = entry[3] and codes == entry[2]
+                changed.append(row)
+            if len(new) + len(changed) >= self.batch_size:
+                stats["new"] += len(new)
+                stats["changed"] += len(changed)
+                self._write(new, changed, [])
+                new, changed = [], []
+        # Whatever is left wasn't found on disk anymore
+        removed = list(known)
+        stats["new"] += len(new)
+        stats["changed"] += len(changed)
+        stats["removed"] = len(removed)
+        self._write(new, changed, removed)
+        stats["seconds"] = time.perf_counter() - start
+        logging.info(f"Scanned {root}: {stats['seen']} files, {stats['new']} new, {stats['changed']} changed, "
+                     f"{stats['removed']} removed in {stats['seconds']:.2f}s")
+        return stats
+
+    def _write(self, new, changed, removed):
+        table = T.LibraryFile.__table__
+        with self.engine.begin() as conn:
+            if new:
+                conn.execute(table.insert(), new)
+            if changed:
+                conn.execute(table.update()
+                             .where(table.c.path == bindparam("_path"))
+                             .values(mtime=bindparam("mtime"), size=bindparam("size"),
+                                     codes=bindparam("codes"), looked_up=bindparam("looked_up")),
+                             [dict(row, _path=row["path"]) for row in changed])
+            for i in range(0, len(removed), 500):
+                conn.execute(table.delete().where(table.c.path.in_(removed[i:i + 500])))
+
+    def pending(self):
+        """Files whose codes haven't been searched yet
+        @returns
+            dict mapping canonical codes to the paths of the files carrying them
+        """
+        table = T.LibraryFile.__table__
+        res = {}
+        with self.engine.connect() as conn:
+            for path, codes in conn.execute(select(table.c.path, table.c.codes)
+                                            .where(table.c.looked_up == False)):  # noqa: E712
+                for code in filter(None, codes.split(",")):
+                    res.setdefault(code, []).append(path)
+        return res
+
+    def mark_looked_up(self, paths):
+        """Flags files as searched
+        """
+        paths = list(paths)
+        table = T.LibraryFile.__table__
+        with self.engine.begin() as conn:
+            for i in range(0, len(paths), 500):
+                conn.execute(table.update().where(table.c.path.in_(paths[i:i + 500])).values(looked_up=True))
+
+    def feed(self, searcher, video_manager, max_concurrency=8, batch_size=200, ledger=None):
+        """Searches the pending codes and stores the matching videos. Files are flagged as
+        searched once all of their codes were searched without errors
+        @args
+            searcher (SiteSearcher)
+            video_manager (VideoManager): Where the matched videos are stored
+            max_concurrency (int): Number of concurrent searches, see SiteSearcher.search_many
+            batch_size (int): Number of videos handed to the video manager at once
+            ledger (LookupLedger): Optional lookup ledger. Codes it doesn't consider due are skipped,
+                                   and the outcome of every search is recorded in it
+        @returns
+            dict with the counts of codes searched, matched, failed and skipped
+        """
+        pending = self.pending()
+        codes = list(pending)
+        if ledger is not None:
+            codes = ledger.due(codes)
+        # Files with several codes are done once they are all searched
+        remaining = {}
+        for code, paths in pending.items():
+            for path in paths:
+                remaining[path] = remaining.get(path, 0) + 1
+
+        stats = {"searched": 0, "matched": 0, "failed": 0, "skipped": len(pending) - len(codes)}
+        videos, done, outcomes = [], [], []
+        for code, results in searcher.search_many(codes, max_concurrency=max_concurrency, ordered=False):
+            stats["searched"] += 1
+            if results is None:
+                stats["failed"] += 1
+                outcomes.append((code, "error", None))
+                continue
+            key = canonicalize(code)
+            # Only keep exact matches, candidates of other codes aren't what the file holds
+            matches = [metadata for metadata in results if canonicalize(metadata.code) == key]
+            if matches:
+                stats["matched"] += 1
+                videos.append(matches[0])
+                outcomes.append((code, "found", matches[0].url))
+            else:
+                outcomes.append((code, "ambiguous" if results.metadata else "missing", None))
+            for path in pending.get(code, []):
+                remaining[path] -= 1
+                if not remaining[path]:
+                    done.append(path)
+            if len(videos) >= batch_size:
+                video_manager.upsert(videos)
+                self.mark_looked_up(done)
+                if ledger is not None:
+                    ledger.record(outcomes)
+                videos, done, outcomes = [], [], []
+        if videos:
+            video_manager.upsert(videos)
+        self.mark_looked_up(done)
+        if ledger is not None:
+            ledger.record(outcomes)
+        logging.info(f"Searched {stats['searched']} codes, {stats['matched']} matched, {stats['failed']} failed, "
+                     f"{stats['skipped']} skipped")
+        return stats
+
+
+def main(argv=None):
+    import argparse
+    from henpy.utilities.tagtools import SQLTagManager
+    from henpy.persist.managers import VideoManager, LookupLedger
+    from henpy.searchers.searchers import JavlibrarySearcher
+
+    parser = argparse.ArgumentParser(description="Scans a media library and looks up the codes of new files")
+    parser.add_argument("root", help="Library directory to scan")
+    parser.add_argument("db_path", help="SQLAlchemy database url, eg sqlite:///henpy.db")
+    parser.add_argument("--scan-only", action="store_true", help="Only update the manifest")
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    tm = SQLTagManager(args.db_path)
+    scanner = LibraryScanner(tm.engine)
+    scanner.scan(args.root)
+    if not args.scan_only:
+        scanner.feed(JavlibrarySearcher(tm), VideoManager(tm.engine), max_concurrency=args.concurrency,
+                     ledger=LookupLedger(tm.engine))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1 +1,3 @@
-from . import searchers
+from henpy._lazy import lazy_submodules
+
+__getattr__, __dir__ = lazy_submodules(__name__, ["searchers", "cache", "images", "refresh", "ratelimit", "crawl"])
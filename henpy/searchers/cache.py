@@ -0,0 +1,180 @@
+"""
+On-disk HTTP response cache for the site searchers.
+
+Entries are keyed by the requested url and stored zlib compressed, one file per url.
+The file modification time doubles as the last access time for LRU eviction.
+"""
+
+import os
+import json
+import time
+import zlib
+import hashlib
+import logging
+import tempfile
+import threading
+import requests
+
+
+class CacheMiss(KeyError):
+    """Raised in offline mode when a url isn't available from the cache
+    """
+    pass
+
+
+class CachedResponse:
+    """Minimal stand in for a requests.Response replayed from the cache
+    @attrs
+        url (str): Final url of the response, after redirects
+        status_code (int)
+        content (bytes): Raw body of the response
+        encoding (str)
+        from_cache (bool): Always True, to tell replayed responses apart
+    """
+
+    def __init__(self, url, status_code, content, encoding=None):
+        self.url = url
+        self.status_code = status_code
+        self.content = content
+        self.encoding = encoding
+        self.from_cache = True
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding or "utf-8", errors="replace")
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} Error for url: {self.url}", response=self)
+
+    def __repr__(self):
+        return f"<CachedResponse [{self.status_code}]:url={self.url}>"
+
+
+class ResponseCache:
+    """Size bounded, compressed on-disk cache of HTTP responses keyed by url
+    """
+
+    def __init__(self, directory, ttl=7 * 24 * 3600, max_bytes=1 << 30, offline=False, compress_level=6):
+        """
+        @args
+            directory (str): Directory to store the cache entries in. Created if missing
+            ttl (float): Seconds an entry stays fresh. None to never expire
+            max_bytes (int): Maximum size of the cache on disk before least recently used entries are evicted
+            offline (bool): Replay mode. Only serve from the cache, ignoring the ttl, and raise CacheMiss otherwise
+            compress_level (int): zlib compression level
+        """
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.compress_level = compress_level
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._size = sum(size for path, mtime, size in self._entries())
+
+    def _path(self, url):
+        key = hashlib.sha1(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, key[:2], key + ".z")
+
+    def _entries(self):
+        """Yields (path, mtime, size) for every entry in the cache
+        """
+        for sub in os.scandir(self.directory):
+            if not sub.is_dir():
+                continue
+            for entry in os.scandir(sub.path):
+                if entry.name.endswith(".z"):
+                    stat = entry.stat()
+                    yield entry.path, stat.st_mtime, stat.st_size
+
+    def get(self, url):
+        """Gets the cached response for a url
+        @args
+            url (str)
+        @returns
+            CachedResponse object, or None if missing or expired. Raises CacheMiss instead in offline mode
+        """
+        path = self._path(url)
+        try:
+            with open(path, "rb") as f:
+                raw = zlib.decompress(f.read())
+        except (FileNotFoundError, zlib.error):
+            return self._miss(url)
+        header, content = raw.split(b"\n", 1)
+        header = json.loads(header)
+        if not self.offline and self.ttl is not None and time.time() - header["stored_at"] > self.ttl:
+            return self._miss(url)
+        # Mark as recently used
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        self.hits += 1
+        return CachedResponse(header["url"], header["status_code"], content, header["encoding"])
+
+    def _miss(self, url):
+        self.misses += 1
+        if self.offline:
+            raise CacheMiss(url)
+        return None
+
+    def put(self, url, resp):
+        """Stores a response under url. Only successful responses are cached
+        @args
+            url (str): Requested url
+            resp: response object to store
+        """
+        if resp.status_code != 200:
+            return
+        header = json.dumps({"url": resp.url,
+                             "status_code": resp.status_code,
+                             "encoding": resp.encoding,
+                             "stored_at": time.time()}).encode("utf-8")
+        data = zlib.compress(header + b"\n" + resp.content, self.compress_level)
+        path = self._path(url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file first so readers never see partial entries
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        with self._lock:
+            try:
+                self._size -= os.path.getsize(path)
+            except FileNotFoundError:
+                pass
+            os.replace(tmp, path)
+            self._size += len(data)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Removes the least recently used entries until the cache is back under 90% of max_bytes.
+        Expects the lock to be held
+        """
+        target = self.max_bytes * 0.9
+        entries = sorted(self._entries(), key=lambda entry: entry[1])
+        removed = 0
+        for path, mtime, size in entries:
+            if self._size <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            self._size -= size
+            removed += 1
+        logging.debug(f"Evicted {removed} entries from response cache, size={self._size}")
+
+    def clear(self):
+        """Removes every entry from the cache
+        """
+        with self._lock:
+            for path, mtime, size in list(self._entries()):
+                os.remove(path)
+            self._size = 0
+
+    def __len__(self):
+        return sum(1 for entry in self._entries())
@@ -0,0 +1,133 @@
+"""
+Resumable crawls of large code batches.
+
+Codes are queued in a JobQueue and looked up in batches. The outcome of each batch is
+checkpointed (videos stored, ledger updated, jobs marked done) before the next batch is claimed,
+so an interrupted crawl loses at most the batch in flight, which the next run picks up again.
+Failed lookups are retried with jittered backoff, and lookups refused by an open circuit breaker
+wait for the breaker without using up their attempts.
+
+Pair the searcher with an AdaptiveRateLimiter to pace the crawl:
+
+    limiter = AdaptiveRateLimiter(rate=1.0)
+    searcher = JavlibrarySearcher(tm, rate_limiter=limiter)
+    Crawler(JobQueue(tm.engine, "backfill"), searcher, VideoManager(tm.engine)).run(codes)
+"""
+
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from henpy.searchers.ratelimit import CircuitOpen, backoff_delay
+from henpy.searchers.refresh import classify
+
+
+class Crawler:
+    """Works through a JobQueue with a searcher
+    """
+
+    def __init__(self, queue, searcher, video_manager=None, ledger=None, workers=4, batch_size=None,
+                 max_attempts=5, backoff_base=30.0, backoff_cap=3600.0, idle_wait=5.0):
+        """
+        @args
+            queue (JobQueue)
+            searcher (SiteSearcher): Usually with a rate_limiter set
+            video_manager (VideoManager): Where found videos are stored, if anywhere
+            ledger (LookupLedger): Optional ledger the outcomes are recorded in
+            workers (int): Number of concurrent lookups
+            batch_size (int): Jobs claimed and checkpointed at once. Defaults to 4 per worker
+            max_attempts (int): Attempts before a job is given up on
+            backoff_base (float): Scale of the jittered backoff between attempts of a job, see backoff_delay
+            backoff_cap (float): Maximum backoff between attempts
+            idle_wait (float): Longest sleep while waiting on jobs to become available
+        """
+        self.queue = queue
+        self.searcher = searcher
+        self.video_manager = video_manager
+        self.ledger = ledger
+        self.workers = workers
+        self.batch_size = batch_size or 4 * workers
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.idle_wait = idle_wait
+
+    def _lookup(self, code):
+        """
+        @returns
+            (outcome, matching VideoMetadata or None) tuple
+        """
+        return classify(code, list(self.searcher.search(code)))
+
+    def _checkpoint(self, done, retries, failures, videos):
+        """Persists the outcome of a batch. Videos go first, so a crash in between only
+        leads to the jobs being redone, rewriting the same videos
+        """
+        if videos and self.video_manager is not None:
+            self.video_manager.upsert(videos)
+        if self.ledger is not None:
+            self.ledger.record([(code, outcome, url) for job_id, code, outcome, url in done])
+        self.queue.complete([(job_id, outcome) for job_id, code, outcome, url in done])
+        self.queue.retry(retries)
+        self.queue.fail(failures)
+
+    def run(self, codes=(), max_jobs=None):
+        """Queues codes and works through the queue until it is empty.
+        Jobs waiting on a backoff are waited for
+        @args
+            codes (iterable of str): Codes to add to the queue. Codes already queued are kept as they are
+            max_jobs (int): Stop after this many jobs, None to empty the queue
+        @returns
+            dict with the number of jobs done, retried, failed and recovered
+        """
+        stats = {"recovered": self.queue.recover(), "queued": self.queue.enqueue(codes),
+                 "done": 0, "found": 0, "retried": 0, "failed": 0}
+        if stats["recovered"]:
+            logging.info(f"Recovered {stats['recovered']} jobs of an interrupted crawl")
+        start = time.perf_counter()
+        processed = 0
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while max_jobs is None or processed < max_jobs:
+                limit = self.batch_size if max_jobs is None else min(self.batch_size, max_jobs - processed)
+                jobs = self.queue.claim(limit)
+                if not jobs:
+                    available_at = self.queue.next_available()
+                    if available_at is None:
+                        break
+                    time.sleep(min(max(available_at - time.time(), 0.05), self.idle_wait))
+                    continue
+                done, retries, failures, videos = [], [], [], []
+                futures = {pool.submit(self._lookup, code): (job_id, code, attempts)
+                           for job_id, code, attempts in jobs}
+                for future in as_completed(futures):
+                    job_id, code, attempts = futures[future]
+                    try:
+                        outcome, match = future.result()
+                    except CircuitOpen as e:
+                        # Not the job's fault, wait for the breaker without using up an attempt
+                        retries.append((job_id, attempts, max(e.retry_at - time.time(), 0), e))
+                        continue
+                    except Exception as e:
+                        attempts += 1
+                        if attempts >= self.max_attempts:
+                            logging.error(f"Giving up on code={code} after {attempts} attempts: {e!r}")
+                            failures.append((job_id, attempts, repr(e)))
+                        else:
+                            logging.warning(f"Lookup of code={code} failed (attempt {attempts}): {e!r}")
+                            retries.append((job_id, attempts,
+                                            backoff_delay(attempts, self.backoff_base, self.backoff_cap), repr(e)))
+                        continue
+                    done.append((job_id, code, outcome, match.url if match is not None else None))
+                    if match is not None:
+                        videos.append(match)
+                self._checkpoint(done, retries, failures, videos)
+                processed += len(jobs)
+                stats["done"] += len(done)
+                stats["found"] += len(videos)
+                stats["retried"] += len(retries)
+                stats["failed"] += len(failures)
+        elapsed = time.perf_counter() - start
+        stats["seconds"] = elapsed
+        stats["jobs_per_sec"] = stats["done"] / elapsed if elapsed else 0.0
+        logging.info(f"Crawl of queue {self.queue.name}: {stats['done']} done ({stats['found']} found), "
+                     f"{stats['retried']} retried, {stats['failed']} failed in {elapsed:.1f}s")
+        return stats
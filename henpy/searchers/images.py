@@ -0,0 +1,129 @@
+"""
+Concurrent downloader for the jacket images of videos.
+
+Images are streamed to disk in chunks, named after the hash of their url so videos sharing
+an image download it once. Partial downloads are kept as .part files and resumed with range
+requests, and images already on disk are skipped.
+"""
+
+import os
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+
+class ImageDownloader:
+    """Downloads images into a local directory with a bounded pool of workers
+    """
+
+    def __init__(self, directory, max_workers=4, chunk_size=64 * 1024, timeout=30):
+        """
+        @args
+            directory (str): Directory the images are stored in. Created if missing
+            max_workers (int): Number of concurrent downloads
+            chunk_size (int): Bytes read from the network per write
+            timeout (float): Seconds to wait on the connection before giving up
+        """
+        self.directory = directory
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self._local = threading.local()
+        os.makedirs(directory, exist_ok=True)
+
+    def _create_session(self):
+        return requests.Session()
+
+    @property
+    def s(self):
+        """HTTP session bound to the calling thread
+        """
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = self._create_session()
+        return session
+
+    @staticmethod
+    def normalize_url(url):
+        """Resolves the protocol relative urls scraped from pages, eg //pics.dmm.co.jp/...
+        """
+        if url.startswith("//"):
+            return "http:" + url
+        return url
+
+    def path_for(self, url):
+        """Local path of the image at url
+        """
+        url = self.normalize_url(url)
+        key = hashlib.sha1(url.encode("utf-8")).hexdigest()
+        ext = os.path.splitext(url.split("?")[0])[1].lower() or ".jpg"
+        return os.path.join(self.directory, key[:2], key + ext)
+
+    def fetch(self, url):
+        """Downloads a single image, resuming a previous partial download if any
+        @args
+            url (str)
+        @returns
+            local path of the image
+        """
+        url = self.normalize_url(url)
+        path = self.path_for(url)
+        if os.path.exists(path):
+            return path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        part = path + ".part"
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        with self.s.get(url, headers=headers, stream=True, timeout=self.timeout) as resp:
+            if resp.status_code == 416:
+                # The partial file already holds everything
+                os.replace(part, path)
+                return path
+            resp.raise_for_status()
+            # Servers ignoring the range send the whole image again
+            mode = "ab" if resp.status_code == 206 else "wb"
+            with open(part, mode) as f:
+                for chunk in resp.iter_content(self.chunk_size):
+                    f.write(chunk)
+        os.replace(part, path)
+        return path
+
+    def download(self, items):
+        """Downloads the images of many videos concurrently. Each distinct url is fetched once
+        @args
+            items (iterable): (code, url) tuples
+        @returns
+            dict of local image paths keyed by code. Failed downloads are logged and left out
+        """
+        by_url = {}
+        for code, url in items:
+            if url:
+                by_url.setdefault(self.normalize_url(url), []).append(code)
+
+        res = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = {pool.submit(self.fetch, url): url for url in by_url}
+            for future, url in futures.items():
+                try:
+                    path = future.result()
+                except Exception as e:
+                    logging.warning(f"Failed to download {url}: {e}")
+                    continue
+                for code in by_url[url]:
+                    res[code] = path
+        logging.info(f"Downloaded {len(futures)} images for {len(res)} videos")
+        return res
+
+    def download_videos(self, video_manager):
+        """Downloads the images of every stored video still pointing at a remote image,
+        and stores the local paths
+        @args
+            video_manager (VideoManager)
+        @returns
+            dict of local image paths keyed by code
+        """
+        paths = self.download(video_manager.remote_images())
+        video_manager.set_image_paths(paths)
+        return paths
@@ -0,0 +1,221 @@
+"""
+Request pacing for the site searchers.
+
+AdaptiveRateLimiter keeps a token bucket per host whose rate follows the site: it creeps up
+while requests succeed and is cut whenever the site throttles (429/503 or a cloudflare challenge),
+honouring Retry-After. Consecutive failures against a host open its circuit breaker, failing
+requests fast until a cooldown passes and a probe request gets through.
+"""
+
+import time
+import random
+import logging
+import threading
+import requests
+
+THROTTLE_STATUSES = (429, 503)
+
+
+class Throttled(requests.HTTPError):
+    """Raised when the site keeps throttling a request after the retries
+    @attrs
+        retry_after (float): Seconds the site asked to wait, None if it didn't say
+    """
+
+    def __init__(self, url, response=None, retry_after=None):
+        status = getattr(response, "status_code", None)
+        super().__init__(f"Throttled ({status}) for url: {url}", response=response)
+        self.retry_after = retry_after
+
+
+class CircuitOpen(Exception):
+    """Raised instead of requesting a host whose circuit breaker is open
+    @attrs
+        host (str)
+        retry_at (float): Timestamp from which the host is probed again
+    """
+
+    def __init__(self, host, retry_at):
+        super().__init__(f"Circuit open for {host}, retrying in {max(retry_at - time.time(), 0):.0f}s")
+        self.host = host
+        self.retry_at = retry_at
+
+
+def backoff_delay(attempt, base=1.0, cap=60.0):
+    """Exponential backoff with full jitter
+    @args
+        attempt (int): Number of attempts made so far, starting at 0
+        base (float): Delay scale in seconds
+        cap (float): Maximum delay
+    @returns
+        float seconds
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def _retry_after(resp):
+    value = getattr(resp, "headers", {}).get("Retry-After")
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def is_challenge(resp):
+    """Detects cloudflare challenge pages, which cfscrape failed to get past
+    """
+    if resp.status_code not in (403, 503):
+        return False
+    headers = getattr(resp, "headers", {})
+    if headers.get("cf-mitigated") == "challenge":
+        return True
+    if not headers.get("Server", "").lower().startswith("cloudflare"):
+        return False
+    text = resp.text
+    return "jschl" in text or "cf-chl" in text or "Just a moment" in text
+
+
+def is_throttled(resp):
+    return resp.status_code in THROTTLE_STATUSES or is_challenge(resp)
+
+
+class _HostState:
+    __slots__ = ("rate", "tokens", "updated", "blocked_until", "failures", "open_until", "probing")
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.failures = 0
+        # Wall clock timestamp the breaker stays open until, 0 if closed
+        self.open_until = 0.0
+        self.probing = False
+
+
+class AdaptiveRateLimiter:
+    """Per host token buckets with additive increase / multiplicative decrease of the rate,
+    and a circuit breaker per host
+    """
+
+    def __init__(self, rate=1.0, min_rate=0.05, max_rate=5.0, burst=2, increase=0.02, decrease=0.5,
+                 retries=3, backoff_base=2.0, backoff_cap=120.0, breaker_threshold=8, breaker_cooldown=300.0):
+        """
+        @args
+            rate (float): Initial requests per second per host
+            min_rate (float): Floor the rate is cut down to
+            max_rate (float): Ceiling the rate climbs up to
+            burst (int): Bucket capacity, the number of requests that can go out at once
+            increase (float): Requests per second added after each successful request
+            decrease (float): Factor the rate is multiplied by when throttled
+            retries (int): Times a throttled or failed request is retried by SiteSearcher._get
+            backoff_base (float): Scale of the jittered backoff between retries, see backoff_delay
+            backoff_cap (float): Maximum backoff between retries
+            breaker_threshold (int): Consecutive failures opening the circuit breaker of a host
+            breaker_cooldown (float): Seconds the breaker stays open before letting a probe through
+        """
+        self.initial_rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self.increase = increase
+        self.decrease = decrease
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def _state(self, host):
+        state = self._hosts.get(host)
+        if state is None:
+            state = self._hosts[host] = _HostState(self.initial_rate, self.burst)
+        return state
+
+    def acquire(self, host):
+        """Blocks until a request to host may go out
+        @raises
+            CircuitOpen if the breaker of the host is open
+        """
+        while True:
+            with self._lock:
+                state = self._state(host)
+                if state.open_until and (time.time() < state.open_until or state.probing):
+                    raise CircuitOpen(host, max(state.open_until, time.time() + 1))
+                now = time.monotonic()
+                state.tokens = min(self.burst, state.tokens + (now - state.updated) * state.rate)
+                state.updated = now
+                if now >= state.blocked_until and state.tokens >= 1:
+                    state.tokens -= 1
+                    if state.open_until:
+                        # Half open, the probe is only claimed once it may go out, so a probe
+                        # waiting for a token doesn't shut itself out
+                        state.probing = True
+                    return
+                wait = max(state.blocked_until - now, (1 - state.tokens) / state.rate)
+            time.sleep(wait)
+
+    def success(self, host):
+        with self._lock:
+            state = self._state(host)
+            state.rate = min(self.max_rate, state.rate + self.increase)
+            state.failures = 0
+            if state.open_until:
+                logging.info(f"Circuit closed for {host}")
+            state.open_until = 0.0
+            state.probing = False
+
+    def failure(self, host, throttled=False, retry_after=None):
+        """Records a failed request
+        @args
+            throttled (bool): The site throttled the request, so the rate is cut
+            retry_after (float): Seconds the site asked to wait
+        """
+        with self._lock:
+            state = self._state(host)
+            if throttled:
+                state.rate = max(self.min_rate, state.rate * self.decrease)
+                state.tokens = 0
+                if retry_after:
+                    state.blocked_until = max(state.blocked_until, time.monotonic() + retry_after)
+                logging.warning(f"Throttled by {host}, rate cut to {state.rate:.2f} req/s")
+            state.failures += 1
+            if state.probing or state.failures >= self.breaker_threshold:
+                state.open_until = time.time() + self.breaker_cooldown
+                state.probing = False
+                logging.warning(f"Circuit opened for {host} after {state.failures} failures")
+
+    def feedback(self, host, resp):
+        """Records the outcome of a response
+        @returns
+            True if the response was throttled
+        """
+        if is_throttled(resp):
+            self.failure(host, throttled=True, retry_after=_retry_after(resp))
+            return True
+        if resp.status_code >= 500:
+            self.failure(host)
+        else:
+            self.success(host)
+        return False
+
+    def retry_delay(self, attempt, resp=None):
+        """Seconds to wait before retrying attempt, at least what the site asked for
+        """
+        delay = backoff_delay(attempt, self.backoff_base, self.backoff_cap)
+        retry_after = _retry_after(resp) if resp is not None else None
+        return max(delay, retry_after or 0.0)
+
+    def rate(self, host):
+        with self._lock:
+            return self._state(host).rate
+
+    def stats(self):
+        """Current rate, failure count and breaker state of each host
+        """
+        with self._lock:
+            return {host: {"rate": state.rate, "failures": state.failures,
+                           "open": bool(state.open_until) and time.time() < state.open_until}
+                    for host, state in self._hosts.items()}
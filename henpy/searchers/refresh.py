@@ -0,0 +1,140 @@
+"""
+Budgeted lookups against the LookupLedger.
+
+Each run looks up the requested codes the ledger considers due, then spends what is left of
+its request budget refreshing stale ledger entries, most overdue first. Found codes are refreshed
+through their access url, skipping the search.
+"""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from henpy.preprocessing.codes import canonicalize, canonical_code
+
+
+def classify(code, results):
+    """Outcome of a lookup, see LookupLedger
+    @args
+        code (str): Searched code
+        results (list of VideoMetadata): Search results
+    @returns
+        (outcome, exact match or None) tuple
+    """
+    key = canonicalize(code)
+    for metadata in results:
+        if metadata.code == code or key is not None and canonicalize(metadata.code) == key:
+            return "found", metadata
+    return ("ambiguous" if results else "missing"), None
+
+
+class RefreshScheduler:
+    """Runs lookups through a searcher within a request budget, recording them in a LookupLedger
+    """
+
+    def __init__(self, ledger, searcher, video_manager=None, budget=1000, search_cost=3, fetch_cost=2,
+                 max_concurrency=8, batch_size=200):
+        """
+        @args
+            ledger (LookupLedger)
+            searcher (SiteSearcher)
+            video_manager (VideoManager): Where found videos are stored, if anywhere
+            budget (int): Requests a run may spend
+            search_cost (int): Requests a search is expected to take (search page + one page per language)
+            fetch_cost (int): Requests a refresh through the access url is expected to take
+            max_concurrency (int): Number of concurrent lookups
+            batch_size (int): Number of outcomes recorded and videos stored at once
+        """
+        self.ledger = ledger
+        self.searcher = searcher
+        self.video_manager = video_manager
+        self.budget = budget
+        self.search_cost = search_cost
+        self.fetch_cost = fetch_cost
+        self.max_concurrency = max_concurrency
+        self.batch_size = batch_size
+
+    def plan(self, codes=(), now=None):
+        """Picks the lookups of a run: the due codes among codes, in order, then the stale ledger entries
+        @args
+            codes (iterable of str): Codes wanted by the caller, eg the pending codes of a library scan
+        @returns
+            (lookups, skipped) tuple. lookups is a list of (code, access_url) tuples, access_url being None
+            for codes to search. skipped is the number of codes left out as not due
+        """
+        codes = list(codes)
+        budget = self.budget
+        lookups = []
+        planned = set()
+        due = self.ledger.due(codes, now=now)
+        known = self.ledger.get(due)
+        for code in due:
+            url = known[code][2] if code in known else None
+            cost = self.fetch_cost if url else self.search_cost
+            if budget < cost:
+                break
+            budget -= cost
+            lookups.append((code, url))
+            planned.add(code)
+        if budget >= self.fetch_cost:
+            for code, outcome, url in self.ledger.stale(budget // self.fetch_cost, now=now):
+                cost = self.fetch_cost if url else self.search_cost
+                if code in planned or budget < cost:
+                    continue
+                budget -= cost
+                lookups.append((code, url))
+                planned.add(code)
+        skipped = len({canonical_code(code) or code for code in codes}) - len(due)
+        return lookups, skipped
+
+    def _lookup(self, code, url):
+        """Looks up a single code, through its access url if it has one
+        @returns
+            (code, outcome, access_url, matching VideoMetadata or None) tuple
+        """
+        try:
+            if url:
+                try:
+                    outcome, match = classify(code, list(self.searcher.fetch(url)))
+                    if outcome == "found":
+                        return code, outcome, match.url or url, match
+                except NotImplementedError:
+                    pass
+                except Exception as e:
+                    logging.debug(f"Refreshing {code} through {url} failed, searching instead: {e!r}")
+            outcome, match = classify(code, list(self.searcher.search(code)))
+            return code, outcome, match.url if match is not None else None, match
+        except Exception:
+            logging.exception(f"Lookup failed for code={code}")
+            return code, "error", None, None
+
+    def run(self, codes=(), now=None):
+        """Plans and runs the lookups of a run, see plan
+        @returns
+            dict with the number of lookups per outcome, the codes skipped as not due and the planned requests
+        """
+        lookups, skipped = self.plan(codes, now=now)
+        stats = {"lookups": len(lookups), "skipped": skipped,
+                 "found": 0, "ambiguous": 0, "missing": 0, "error": 0,
+                 "requests_planned": sum(self.fetch_cost if url else self.search_cost for code, url in lookups)}
+        outcomes, videos = [], []
+
+        def flush():
+            if videos and self.video_manager is not None:
+                self.video_manager.upsert(videos)
+            self.ledger.record(outcomes)
+            outcomes.clear()
+            videos.clear()
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as pool:
+            futures = [pool.submit(self._lookup, code, url) for code, url in lookups]
+            for future in as_completed(futures):
+                code, outcome, url, match = future.result()
+                stats[outcome] += 1
+                outcomes.append((code, outcome, url))
+                if match is not None:
+                    videos.append(match)
+                if len(outcomes) >= self.batch_size:
+                    flush()
+        flush()
+        logging.info(f"Ran {stats['lookups']} lookups ({stats['found']} found, {stats['missing']} missing, "
+                     f"{stats['ambiguous']} ambiguous, {stats['error']} failed), skipped {skipped} codes")
+        return stats
@@ -1,22 +1,210 @@
 import re
+import time
 import requests
 import cfscrape
 import logging
+import threading
 from abc import ABC, abstractmethod
-from henpy.models import Tag, TagData, VideoMetadata
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urlsplit
+from collections import deque
+from itertools import islice
+from henpy.models import Tag, TagData, VideoMetadata, QuerySet
+from henpy.metrics import NULL_METRICS
+from henpy.searchers.ratelimit import Throttled
+from henpy.preprocessing.codes import CodeIndex, canonicalize, canonical_code
+
+# SiteSearcher implementations keyed by name, see register_searcher
+SEARCHERS = {}
+
+
+def register_searcher(name):
+    """Class decorator registering a SiteSearcher implementation under name
+    """
+    def decorator(cls):
+        cls.name = name
+        SEARCHERS[name] = cls
+        return cls
+    return decorator
+
+
+def get_searcher(name, tag_manager, **kwargs):
+    """Creates the searcher registered under name
+    @args
+        name (str): Registered name, eg "javlibrary"
+        tag_manager
+        **kwargs: Passed on to the searcher
+    @returns
+        SiteSearcher object
+    """
+    try:
+        cls = SEARCHERS[name]
+    except KeyError:
+        raise KeyError(f"No searcher registered as {name}, available: {sorted(SEARCHERS)}") from None
+    return cls(tag_manager, **kwargs)
 
 
 class SiteSearcher(ABC):
     """Dummy prototype for generic API for data retrieval from a specific site
     """
+    name = None
 
-    def __init__(self, tag_manager):
+    def __init__(self, tag_manager, per_host_limit=4, fetch_workers=8, cache=None, metrics=None,
+                 rate_limiter=None):
         """General init method
         @args
             tag_manager
+            per_host_limit (int): Maximum number of requests in flight against a single host
+            fetch_workers (int): Number of threads used to fetch pages belonging to a single search
+            cache (ResponseCache): Optional cache to serve and store responses from
+            metrics (Metrics): Optional henpy.metrics.Metrics to record stage timings and counters into
+            rate_limiter (AdaptiveRateLimiter): Optional pacing of the requests, with retries of throttled
+                                                and failed requests. See henpy.searchers.ratelimit
         """
-        pass
         self.tm = tag_manager
+        self.cache = cache
+        self.rate_limiter = rate_limiter
+        self.metrics = NULL_METRICS if metrics is None else metrics
+        self.per_host_limit = per_host_limit
+        self.fetch_workers = fetch_workers
+        self._fetch_pool = None
+        # Semaphores keyed by host, bounding the requests in flight per site
+        self._host_limits = {}
+        self._host_lock = threading.Lock()
+        # Sessions aren't thread safe, so each worker thread gets its own
+        self._local = threading.local()
+
+    def _create_session(self):
+        """Creates the HTTP session used by the calling thread
+        """
+        return requests.Session()
+
+    @property
+    def s(self):
+        """HTTP session bound to the calling thread
+        """
+        session = getattr(self._local, "session", None)
+        if session is None:
+            with self.metrics.timer("session"):
+                session = self._local.session = self._create_session()
+        return session
+
+    def _host_limit(self, url):
+        """Gets the semaphore bounding concurrent requests to the host of url. Requests of a
+        search_many call with its own per_host_limit use the semaphores of that call
+        """
+        host = urlsplit(url).netloc
+        per_host_limit, limits = getattr(self._local, "host_limits", None) or (self.per_host_limit,
+                                                                              self._host_limits)
+        with self._host_lock:
+            limit = limits.get(host)
+            if limit is None:
+                limit = limits[host] = threading.BoundedSemaphore(per_host_limit)
+        return limit
+
+    def _get_scoped(self, url, stage, host_limits):
+        """_get with the host limits of the thread that dispatched the request, see _fetch_all
+        """
+        self._local.host_limits = host_limits
+        try:
+            return self._get(url, stage)
+        finally:
+            self._local.host_limits = None
+
+    def _get(self, url, stage="fetch"):
+        """Performs a GET against url, respecting the per host request limit.
+        Served from the cache when one is set and holds the url
+        @args
+            url (str): Url to fetch
+            stage (str): Name the request is timed under in the metrics
+        @returns
+            response object
+        """
+        metrics = self.metrics
+        if self.cache is not None:
+            resp = self.cache.get(url)
+            if resp is not None:
+                metrics.incr("cache_hits")
+                return resp
+            metrics.incr("cache_misses")
+        if self.rate_limiter is None:
+            resp = self._request(url, stage)
+        else:
+            resp = self._paced_request(url, stage)
+        if self.cache is not None:
+            self.cache.put(url, resp)
+        return resp
+
+    def _request(self, url, stage):
+        metrics = self.metrics
+        with metrics.timer(stage):
+            with self._host_limit(url):
+                resp = self.s.get(url)
+        if metrics.enabled:
+            metrics.incr("requests")
+            metrics.incr(f"status_{resp.status_code}")
+            metrics.incr("bytes", len(resp.content))
+        return resp
+
+    def _paced_request(self, url, stage):
+        """Performs a request through the rate limiter, retrying throttled and failed requests
+        with jittered backoff
+        """
+        limiter = self.rate_limiter
+        host = urlsplit(url).netloc
+        for attempt in range(limiter.retries + 1):
+            # Waits outside of the host semaphore, so waiting threads don't hold slots
+            limiter.acquire(host)
+            try:
+                resp = self._request(url, stage)
+            except (requests.ConnectionError, requests.Timeout):
+                limiter.failure(host)
+                if attempt == limiter.retries:
+                    raise
+                time.sleep(limiter.retry_delay(attempt))
+                continue
+            except Exception:
+                # Still a failure of the host, otherwise a half open probe would never be resolved
+                # and the breaker would stay open for good
+                limiter.failure(host)
+                raise
+            if not limiter.feedback(host, resp):
+                return resp
+            self.metrics.incr("throttled")
+            if attempt == limiter.retries:
+                raise Throttled(url, resp, limiter.retry_delay(attempt, resp))
+            time.sleep(limiter.retry_delay(attempt, resp))
+
+    def _fetch_all(self, urls, stages=None):
+        """Fetches several urls concurrently
+        @args
+            urls (iterable of str): Urls to fetch
+            stages (iterable of str): Metrics stage of each url, "fetch" for all of them by default
+        @returns
+            list of response objects in the order of urls
+        """
+        urls = list(urls)
+        stages = ["fetch"] * len(urls) if stages is None else list(stages)
+        if len(urls) <= 1:
+            return [self._get(url, stage) for url, stage in zip(urls, stages)]
+        # Pool threads take over the host limits of the search they fetch for
+        host_limits = getattr(self._local, "host_limits", None)
+        return list(self._pool().map(self._get_scoped, urls, stages, [host_limits] * len(urls)))
+
+    def _pool(self):
+        """Gets the thread pool used to fetch the pages of a search
+        """
+        with self._host_lock:
+            if self._fetch_pool is None:
+                self._fetch_pool = ThreadPoolExecutor(max_workers=self.fetch_workers)
+            return self._fetch_pool
+
+    def close(self):
+        """Releases the worker threads held by the searcher
+        """
+        if self._fetch_pool is not None:
+            self._fetch_pool.shutdown()
+            self._fetch_pool = None
 
     @abstractmethod
     def search(self, code, topn=10):
@@ -30,15 +218,102 @@ class SiteSearcher(ABC):
         """
         pass
 
+    def fetch(self, url):
+        """Gets the metadata of a video page directly, skipping the search. Optional for implementations
+        @args
+            url (str): Url of the page, as kept in VideoMetadata.url
+        @returns
+            Iterable QuerySet object containing the VideoMetadata of the page
+        """
+        raise NotImplementedError(f"{type(self).__name__} can't fetch pages directly")
+
+    def search_many(self, codes, max_concurrency=8, per_host_limit=None, ordered=False, dedupe=True, **kwargs):
+        """Searches multiple codes concurrently, producing the results as they are completed.
+        Failed searches are logged and produce a None result.
+
+        @args
+            codes (iterable of str): Codes to search
+            dedupe (bool): Canonicalize the codes and search each canonical code once, see
+                           henpy.preprocessing.codes. Results are then keyed by the canonical code
+            max_concurrency (int): Number of searches to run at once
+            per_host_limit (int): Maximum number of requests in flight per host for this call only,
+                                  instead of the limit of the searcher
+            ordered (bool): Produce the results in the order of codes rather than on completion
+            **kwargs: Passed on to search
+        @returns
+            Lazy, uncached QuerySet of (code, QuerySet) tuples, so results aren't held once consumed.
+            It can only be iterated once. Searches still queued when the consumer stops iterating
+            (or closes the QuerySet) are cancelled
+        """
+        # The override only applies to the requests of this call, through semaphores of its own
+        host_limits = None if per_host_limit is None else (per_host_limit, {})
+        if dedupe:
+            index = CodeIndex(codes)
+            # Codes that can't be canonicalized are still searched as they are
+            codes = index.codes() + list(dict.fromkeys(index.rejected))
+        return QuerySet(self._iter_many(codes, max_concurrency, ordered, kwargs, host_limits), cache=False)
+
+    def _iter_many(self, codes, max_concurrency, ordered, kwargs, host_limits=None):
+        def task(code):
+            self._local.host_limits = host_limits
+            try:
+                # Evaluated in the worker so the network work happens there
+                with self.metrics.timer("search_total"):
+                    return code, QuerySet(list(self.search(code, **kwargs)))
+            except Exception:
+                logging.exception(f"Search failed for code={code}")
+                return code, None
+            finally:
+                self._local.host_limits = None
+
+        # Only a window of searches is submitted at a time, and each future is dropped once its
+        # result is produced, so neither the codes nor the results pile up over long batches
+        codes = iter(codes)
+        window = 2 * max_concurrency
+        pending = deque() if ordered else set()
+        submit = pending.append if ordered else pending.add
+
+        with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+            def fill():
+                for code in islice(codes, window - len(pending)):
+                    submit(pool.submit(task, code))
 
+            try:
+                fill()
+                while pending:
+                    if ordered:
+                        result = pending.popleft().result()
+                    else:
+                        done = next(iter(wait(pending, return_when=FIRST_COMPLETED).done))
+                        pending.discard(done)
+                        result = done.result()
+                        done = None
+                    fill()
+                    yield result
+                    result = None
+            finally:
+                # Early exits from the consumer shouldn't leave queued searches running
+                for future in pending:
+                    future.cancel()
+
+
+@register_searcher("javlibrary")
 class JavlibrarySearcher(SiteSearcher):
-    def __init__(self, tag_manager):
-        super().__init__(tag_manager)
-        self.search_path = "http://www.javlibrary.com/{lang}/vl_searchbyid.php?keyword={code}"
+    def __init__(self, tag_manager, per_host_limit=4, fetch_workers=8, cache=None, metrics=None,
+                 base_url="http://www.javlibrary.com", rate_limiter=None):
+        """
+        @args
+            base_url (str): Root of the site, overridable to point at a mirror or a local stand-in
+        """
+        super().__init__(tag_manager, per_host_limit=per_host_limit, fetch_workers=fetch_workers,
+                         cache=cache, metrics=metrics, rate_limiter=rate_limiter)
+        base_url = base_url.rstrip("/")
+        self.base_url = base_url
+        self.search_path = base_url + "/{lang}/vl_searchbyid.php?keyword={code}"
         # Where it ends up if it fails (0 or >1 entries)
-        self.fail_path = "http://www.javlibrary.com/{0}/vl_search"
+        self.fail_path = base_url + "/{0}/vl_search"
         # Path template to do a direct access to a specifc entry
-        self.access_path = "http://www.javlibrary.com/{lang}{suffix}"
+        self.access_path = base_url + "/{lang}{suffix}"
         self.langs = ["en", "ja"]
 
         # Regexes for the acquisiton of metadata
@@ -59,9 +334,47 @@ class JavlibrarySearcher(SiteSearcher):
         # image_url regex
         self.image_re = re.compile(r'video_jacket_img" src="(\/\/[\w+\.\/]+)"')
 
-        # Session initialization
+        # Single pass extraction used by _extract_metadata. Each field is located by a literal anchor
+        # and matched in place, in the order the fields appear on the page, so the page is scanned
+        # once from start to end rather than once per field.
+        # (field, anchor, regex matched at the anchor, repeated)
+        self.page_fields = [
+            ("title", 'og:title" content="',
+             re.compile(r'og:title" content="[^"\s]*\s([^"]*)\s-\sJAVLibrary"'), False),
+            ("image_url", 'video_jacket_img" src="',
+             re.compile(r'video_jacket_img" src="(//[\w+./]+)"'), False),
+            ("code", "ID:</td>",
+             re.compile(r'ID:</td>\s+<td class="text">([\w-]+)</td>'), False),
+            ("release_date", "video_date",
+             re.compile(r'video_date(?:[^\n]*\n){4}[^\n]*?"text">([^<]*)</td>'), False),
+            ("director", "vl_director.php?d=",
+             re.compile(r'vl_director\.php\?d=[a-z0-9]+" rel="tag">([^<]{1,20})</a>'), False),
+            ("maker", "vl_maker.php?m=",
+             re.compile(r'vl_maker\.php\?m=[a-z0-9]+"\srel="tag">([^<]{1,20})</a>'), False),
+            ("label", "vl_label.php?l=",
+             re.compile(r'vl_label\.php\?l=[a-z0-9]+"\srel="tag">([^<]{1,20})</a>'), False),
+            ("tags", "vl_genre.php?g=",
+             re.compile(r'vl_genre\.php\?g=[a-z0-9]+" rel="category tag">([^<]{1,20})</a>'), True),
+            ("stars", "vl_star.php?s=",
+             re.compile(r'vl_star\.php\?s=[a-z0-9]{1,10}" rel="tag">([^<]{1,20})</a>'), True),
+        ]
+
+        # Session initialization happens lazily per thread, see _create_session
+        self._seed_session = None
+
+    def _create_session(self):
+        """Creates a cloudflare capable session for the calling thread. Sessions after the first
+        share its headers and cookies, so the challenge clearance carries across threads
+        """
         session = requests.Session()
-        self.s = cfscrape.create_scraper(sess=session)
+        scraper = cfscrape.create_scraper(sess=session)
+        with self._host_lock:
+            if self._seed_session is None:
+                self._seed_session = scraper
+            else:
+                scraper.headers.update(self._seed_session.headers)
+                scraper.cookies.update(self._seed_session.cookies)
+        return scraper
 
     def _unpack_search(self, obj):
         """Unpacks a re.search object, return "" if obj is none
@@ -81,7 +394,7 @@ class JavlibrarySearcher(SiteSearcher):
         if lang is None:
             lang = self.langs[0]
         site = self.search_path.format(lang=lang, code=code)
-        req = self.s.get(site)
+        req = self._get(site, stage="search")
         req.raise_for_status()
         return req
 
@@ -91,61 +404,106 @@ class JavlibrarySearcher(SiteSearcher):
             req: request object to process for information
         @returns
             response containing the single page if only one entry is present,
-            or an iterable of all page_paths if multiple matching detected
+            or an iterable of all page_paths if multiple matching detected.
+            None if nothing matched
         """
         req.raise_for_status()
         lang = self.langs[0]
         if req.url.startswith(self.fail_path.format(lang)):
             # multi re returns a list of (path, code) tuples
             multi = self.multi_results_re.findall(req.text)
-            # Check if the database contains multiple results
-            if multi:
-                if len(multi) == 0:
-                    return
-                # Try to guess which one is the code we want (exact match)
-                options = [suffix for suffix, icode, image_url in multi if icode == code]
-                # In the case of an exact match, return the match
-                if len(options) == 1:
-                    req = self.s.get(self.access_path.format(lang=lang,
-                                                             suffix=options[0]))
-                else:
-                    return [(self.access_path.format(lang="{lang}",
-                                                     suffix=suffix),
-                             icode,
-                             image_url) for suffix, icode, image_url in multi]
+            # No entries in the database
+            if not multi:
+                return None
+            # Try to guess which one is the code we want (exact match), ignoring spelling differences
+            key = canonicalize(code)
+            options = [suffix for suffix, icode, image_url in multi
+                       if icode == code or key is not None and canonicalize(icode) == key]
+            # In the case of an exact match, return the match
+            if len(options) == 1:
+                req = self._get(self.access_path.format(lang=lang,
+                                                        suffix=options[0]),
+                                stage="redirect")
+            else:
+                return [(self.access_path.format(lang="{lang}",
+                                                 suffix=suffix),
+                         icode,
+                         image_url) for suffix, icode, image_url in multi]
 
         return req
 
     def _extract_metadata(self, resp):
-        """Extracts the relevant metadata from a given request
+        """Extracts the relevant metadata from a given request in a single pass over the page.
+        See page_fields. A field missing from the rest of the page is looked for once more from its start
         @args
+            resp: response object of a video page
         @returns
             dictionary containing the raw metadata in the following structure
         """
         text = resp.text
+        metadata = {}
+        pos = 0
 
-        title = self._unpack_search(self.title_re.search(text))
-        star = self.star_re.findall(text)
-        genre = self.genre_re.findall(text)
-        maker = self._unpack_search(self.maker_re.search(text))
-        label = self._unpack_search(self.label_re.search(text))
-        director = self._unpack_search(self.director_re.search(text))
-        release_date = self._unpack_search(self.release_date_re.search(text))
-        code = self._unpack_search(self.code_re.search(text))
-        image_url = self._unpack_search(self.image_re.search(text))
-
-        # Create the tags from the genre and star fields
-        tags = [genre_name for genre_name in genre]
-        stars = [star_name for star_name in star]
-        return {"title": title,
-                "code": code,
-                "tags": tags,
-                "stars": stars,
-                "maker": maker,
-                "label": label,
-                "director": director,
-                "release_date": release_date,
-                "image_url": image_url}
+        def scan(anchor, regex, repeated, start):
+            """
+            @returns
+                (values, end of the last match) tuple, the end is start if nothing matched
+            """
+            values = []
+            idx = text.find(anchor, start)
+            while idx != -1:
+                match = regex.match(text, idx)
+                if match:
+                    values.append(match.group(1))
+                    start = match.end()
+                    if not repeated:
+                        break
+                    idx = text.find(anchor, start)
+                else:
+                    idx = text.find(anchor, idx + len(anchor))
+            return values, start
+
+        for field, anchor, regex, repeated in self.page_fields:
+            values, end = scan(anchor, regex, repeated, pos)
+            if values:
+                pos = end
+            elif pos:
+                # The page may lay the fields out in another order, look once more from the start.
+                # The position stays put, the fields after this one are still expected further on
+                values, _ = scan(anchor, regex, repeated, 0)
+            # Fields missing from the page leave the position untouched for the next one
+            if repeated:
+                metadata[field] = values
+            else:
+                metadata[field] = values[0] if values else ""
+        return metadata
+
+    def _build_metadata(self, responses):
+        """Builds the metadata of a single video from its pages
+        @args
+            responses (list): Response objects for the video page, one per language in self.langs
+        @returns
+            VideoMetadata object
+        @raises
+            requests.HTTPError if any of the pages failed, so error pages aren't parsed into empty metadata
+        """
+        for resp in responses:
+            resp.raise_for_status()
+        for num, (lang, resp) in enumerate(zip(self.langs, responses)):
+            with self.metrics.timer("parse"):
+                metadata = self._extract_metadata(resp)
+            # Initialize the result object using the first language
+            if num == 0:
+                # Create the taglist for the video, resolving every tag of the page at once
+                with self.metrics.timer("tag_resolve"):
+                    tags = self.tm.get_or_create_tags([(tag, "genre") for tag in metadata["tags"]] +
+                                                      [(star, "star") for star in metadata["stars"]],
+                                                      language=lang)
+                res = VideoMetadata(metadata["code"], metadata["release_date"], tags,
+                                    metadata["director"], metadata["maker"], metadata["label"],
+                                    metadata["image_url"], url=resp.url)
+            res.title[lang] = metadata["title"]
+        return res
 
     def _process_page(self, search_data):
         """Handles the processing of a single page from normalize_search. Maybe raise and catch if multiple
@@ -156,51 +514,253 @@ class JavlibrarySearcher(SiteSearcher):
             raise TypeError("Iterable input when singular expected")
         # If it's gotten this far, we know the search_data is a http response
         resp = search_data
-        for num, lang in enumerate(self.langs):
-            metadata = self._extract_metadata(resp)
-            # Initialize the result object using the first language
-            if num == 0:
-                # Create the taglist for the video
-                tags = [self.tm.get_or_create(tag, "genre") for tag in metadata["tags"]]
-                stars = [self.tm.get_or_create(star, "star") for star in metadata["stars"]]
-                tags += stars
-                res = VideoMetadata(metadata["code"], metadata["release_date"], tags,
-                                    metadata["director"], metadata["maker"], metadata["label"],
-                                    metadata["image_url"])
+        # The remaining languages are pulled concurrently, since this bit is slow
+        root, path = resp.url.split(f"/{self.langs[0]}/", 1)
+        others = self._fetch_all((f"{root}/{lang}/{path}" for lang in self.langs[1:]),
+                                 (f"fetch.{lang}" for lang in self.langs[1:]))
+        return self._build_metadata([resp] + others)
 
-            # If we're looking at not the first language, we'll need to pull the data.
-            # We do it here to reduce query count, since this bit is slow
-            if num != 0:
-                resp = self.s.get(resp.url.replace(".com/en/", f".com/{lang}/"))
-                metadata = self._extract_metadata(resp)
+    def _iter_pages(self, candidates, lookahead=2):
+        """Lazily processes candidate pages from normalize_search. The pages of the next
+        lookahead candidates are fetched concurrently while the current one is consumed.
+        @args
+            candidates (iterable): (path_template, code, image_url) tuples from _normalize_search
+            lookahead (int): Number of candidates fetched ahead of the consumer
+        @returns
+            generator of VideoMetadata objects, one per candidate
+        """
+        candidates = iter(candidates)
+        pending = deque()
+        pool = self._pool()
+        # Pool threads take over the host limits of the search they fetch for, see _fetch_all
+        host_limits = getattr(self._local, "host_limits", None)
 
-            res.title[lang] = metadata["title"]
-        return res
+        def submit():
+            candidate = next(candidates, None)
+            if candidate is None:
+                return
+            path = candidate[0]
+            pending.append([pool.submit(self._get_scoped, path.format(lang=lang), f"fetch.{lang}", host_limits)
+                            for lang in self.langs])
+
+        try:
+            for i in range(max(lookahead, 1)):
+                submit()
+            while pending:
+                futures = pending.popleft()
+                submit()
+                yield self._build_metadata([future.result() for future in futures])
+        finally:
+            # Drop the prefetches nobody is going to consume
+            for futures in pending:
+                for future in futures:
+                    future.cancel()
 
     def process_pages(self, search_data, topn=10):
-        targets = None
+        """Handles the processing of multiple candidate pages from normalize_search.
+        All pages of the top candidates are fetched concurrently.
+        @args
+            search_data (list): (path_template, code, image_url) tuples from _normalize_search
+            topn (int): Number of candidates to process
+        @returns
+            list of VideoMetadata objects, one per candidate
+        """
+        return list(self._iter_pages(search_data[:topn], lookahead=topn))
 
-    def search(self, code, topn=5, return_multi=False):
+    def _iter_search(self, code, topn):
+        resp = self._search_code(code)
+        search_data = self._normalize_search(code, resp)
+        if search_data is None:
+            return
+        if isinstance(search_data, list):
+            yield from self._iter_pages(search_data[:topn])
+        else:
+            yield self._process_page(search_data)
+
+    def _iter_fetch(self, url):
+        resp = self._get(url, stage=f"fetch.{self.langs[0]}")
+        resp.raise_for_status()
+        yield self._process_page(resp)
+
+    def fetch(self, url):
+        """Gets the metadata of a video page directly, skipping the search and its redirect
+        @args
+            url (str): Url of the page in the first language of self.langs, as kept in VideoMetadata.url
+        @returns
+            Lazy QuerySet holding the VideoMetadata of the page
+        """
+        return QuerySet(self._iter_fetch(url))
+
+    def search(self, code, topn=5):
         """Flow is as follows: Seach using english -> Identify pages/candidate pages
         -> For top N pages, extract information for each language (Currently implement using multiple queries)
+        Nothing is fetched until the result is iterated, and candidates are only fetched as they are consumed.
         @ args
             code (string):
             topn (int): Top n results to use to query if any
-            return_multi (bool): Should search return multiple entries. If true, returns all entries
-                                 as a list regardless of the length
         @ returns
-            FIGURE THIS ONE OUT
+            Lazy QuerySet of VideoMetadata objects. Holds the single match if the code matched exactly,
+            the top n candidates otherwise, and nothing if the code isn't in the database
         """
-        resp = self._search_code(code)
-        search_data = self._normalize_search(code, resp)
-        try:
-            res = self._process_page(search_data)
-        except TypeError:
-            if return_multi:
-                res = self._process_pages(search_data, topn)
-            else:
-                res = None
+        return QuerySet(self._iter_search(code, topn))
+
+
+class CompositeSearcher(SiteSearcher):
+    """Searches several SiteSearcher backends for each code, hedging across them.
+
+    Backends are tried in order of health (fewest recent failures, then lowest average latency, backends
+    without one last).
+    The first one is queried straight away, and whenever hedge_delay passes without a complete
+    result the next backend is queried as well. Backends that fail or come back empty hand over
+    immediately. The first complete result wins and the queries still queued are cancelled;
+    backend queries already running finish in the background and their results are dropped.
+    If no backend produces a complete result, the partial results are merged field by field.
+    """
+    name = "composite"
+
+    def __init__(self, searchers, hedge_delay=0.5, merge=False, max_failures=3, workers=None, metrics=None,
+                 required_fields=("title", "release_date", "image_path", "tags")):
+        """
+        @args
+            searchers (iterable of SiteSearcher): Backends, in order of preference
+            hedge_delay (float): Seconds to wait on the running queries before also querying the next backend
+            merge (bool): Query every backend at once and merge their results rather than returning the first
+                          complete one
+            max_failures (int): Consecutive failures after which a backend is only tried after the healthy ones
+            workers (int): Number of threads running backend queries. Defaults to 8 per backend
+            metrics (Metrics): Optional henpy.metrics.Metrics to record hedges and wins into
+            required_fields (iterable of str): VideoMetadata fields a result needs to count as complete
+        """
+        searchers = list(searchers)
+        if not searchers:
+            raise ValueError("CompositeSearcher needs at least one searcher")
+        super().__init__(searchers[0].tm, metrics=metrics)
+        self.searchers = searchers
+        self.hedge_delay = hedge_delay
+        self.merge = merge
+        self.max_failures = max_failures
+        self.required_fields = tuple(required_fields)
+        self._backend_pool = ThreadPoolExecutor(max_workers=workers or 8 * len(searchers))
+        # [average latency, consecutive failures] of each backend
+        self._health = [[None, 0] for searcher in searchers]
+        self._health_lock = threading.Lock()
+
+    def _label(self, i):
+        """Name of backend i in logs and metrics, the same searcher class can back several
+        """
+        return f"{i}.{self.searchers[i].name}"
+
+    def _ranked(self):
+        """Backend indices, healthy and fast ones first. Backends without a measured latency come after
+        the measured ones, in order of preference: a backend whose queries never complete in time isn't fast
+        """
+        with self._health_lock:
+            return sorted(range(len(self.searchers)),
+                          key=lambda i: (self._health[i][1] >= self.max_failures, self._health[i][0] is None,
+                                         self._health[i][0] or 0.0, i))
 
-        if return_multi:
-            return [res]
+    def _run(self, i, code, topn):
+        """Runs a search against backend i, recording its health
+        @returns
+            list of VideoMetadata, None on failure
+        """
+        start = time.perf_counter()
+        try:
+            res = list(self.searchers[i].search(code, topn=topn))
+        except Exception as e:
+            # Other backends cover for it, so this isn't worth a traceback
+            logging.warning(f"Search failed for code={code} on backend {self._label(i)}: {e!r}")
+            with self._health_lock:
+                self._health[i][1] += 1
+            self.metrics.incr(f"backend_errors.{self._label(i)}")
+            return None
+        elapsed = time.perf_counter() - start
+        with self._health_lock:
+            health = self._health[i]
+            # Exponentially weighted, so the ranking follows changes in the backends
+            health[0] = elapsed if health[0] is None else 0.8 * health[0] + 0.2 * elapsed
+            health[1] = 0
         return res
+
+    def _complete(self, entries):
+        if not entries:
+            return False
+        return all(getattr(entries[0], field) for field in self.required_fields)
+
+    def _merge(self, results):
+        """Merges the results of several backends. Entries describing the same code are combined,
+        missing fields being filled from the lower ranked backends
+        @args
+            results (list): Lists of VideoMetadata, highest ranked backend first
+        @returns
+            list of VideoMetadata
+        """
+        merged = {}
+        for entries in results:
+            for entry in entries:
+                key = canonical_code(entry.code) or entry.code
+                base = merged.get(key)
+                if base is None:
+                    merged[key] = entry
+                    continue
+                for field in ("release_date", "director", "maker", "label", "image_path", "url"):
+                    if not getattr(base, field) and getattr(entry, field):
+                        setattr(base, field, getattr(entry, field))
+                for lang, title in entry.title.items():
+                    if not base.title.get(lang):
+                        base.title[lang] = title
+                known = set(base.tags)
+                base.tags.extend(tag for tag in entry.tags if tag not in known)
+        return list(merged.values())
+
+    def _iter_search(self, code, topn):
+        order = self._ranked()
+        pending = {}
+        results = {}
+        metrics = self.metrics
+
+        def launch():
+            i = order[len(pending) + len(results)]
+            pending[self._backend_pool.submit(self._run, i, code, topn)] = i
+
+        launch()
+        if self.merge:
+            while len(pending) < len(order):
+                launch()
+        try:
+            while pending:
+                can_hedge = len(pending) + len(results) < len(order)
+                done, running = wait(pending, timeout=self.hedge_delay if can_hedge else None,
+                                     return_when=FIRST_COMPLETED)
+                if not done:
+                    metrics.incr("hedges")
+                    launch()
+                    continue
+                for future in done:
+                    i = pending.pop(future)
+                    results[i] = future.result() or []
+                    if not self.merge and self._complete(results[i]):
+                        metrics.incr(f"wins.{self._label(i)}")
+                        yield from results[i]
+                        return
+                # The finished backends came back failed or incomplete, hand over straight away
+                for future in done:
+                    if len(pending) + len(results) < len(order):
+                        launch()
+        finally:
+            for future in pending:
+                future.cancel()
+        yield from self._merge([results[i] for i in order if results.get(i)])
+
+    def search(self, code, topn=5):
+        """Searches code on the backends, see CompositeSearcher
+        @returns
+            Lazy QuerySet of VideoMetadata objects
+        """
+        return QuerySet(self._iter_search(code, topn))
+
+    def close(self):
+        super().close()
+        self._backend_pool.shutdown(wait=False)
+        for searcher in self.searchers:
+            searcher.close()
@@ -1,2 +1,3 @@
-from . import tagtools
+from henpy._lazy import lazy_submodules
 
+__getattr__, __dir__ = lazy_submodules(__name__, ["tagtools", "tagindex", "normalize_tags"])
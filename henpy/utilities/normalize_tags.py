@@ -1,3 +1,242 @@
 """
 Handles tag normalization for datatype_tags
-"""
\ No newline at end of file
+
+Scraped tag names come in variant forms (case, full-width/half-width characters, separators),
+which would otherwise become duplicate tags. Names are reduced to a normalized key with
+normalize, and a Vocabulary maps those keys back to the canonical tag names of the vocabulary.
+
+The vocabulary is compiled once from the supplementary files into a binary artifact holding the
+key map and an Aho-Corasick automaton over the keys, so free text such as titles can be scanned
+for every tag in a single pass:
+
+    python -m henpy.utilities.normalize_tags supplementary/tagdata.tsv supplementary/tagvocab.bin
+"""
+
+import re
+import sys
+import zlib
+import marshal
+import logging
+import argparse
+import unicodedata
+from collections import deque
+
+_separator_re = re.compile(r"[\s\-_・/]+")
+_word_char_re = re.compile(r"\w")
+
+MAGIC = b"HENVOCAB"
+VERSION = 2
+
+# Vocabulary column holding the name of each language
+_languages = {"en": 2, "jp": 3, "ja": 3}
+
+
+def normalize(text):
+    """Normalized key of a tag name. Applies NFKC (folding full-width/half-width forms),
+    casefolds and collapses runs of separators into a single space
+    @args
+        text (str)
+    @returns
+        str
+    """
+    return _separator_re.sub(" ", unicodedata.normalize("NFKC", text).casefold()).strip()
+
+
+class Vocabulary:
+    """Compiled tag vocabulary
+    @attrs
+        entries (list): (e_type, j_type, e_name, j_name) tuples, names as stored by SQLTagManager.import_tags
+        keys (dict): Entry index keyed by the normalized key of every name
+    """
+
+    def __init__(self, entries, keys, goto, fail, out):
+        self.entries = entries
+        self.keys = keys
+        # Aho-Corasick automaton: transitions, failure links and the (key length, entry) matches of each state
+        self._goto = goto
+        self._fail = fail
+        self._out = out
+
+    @classmethod
+    def build(cls, rows):
+        """Compiles the vocabulary
+        @args
+            rows (iterable): (e_type, j_type, e_name, j_name) tuples
+        @returns
+            Vocabulary object
+        """
+        entries = []
+        keys = {}
+        for row in rows:
+            row = tuple(field.strip().lower() for field in row)
+            num = len(entries)
+            entries.append(row)
+            for name in row[2:]:
+                key = normalize(name)
+                # First entry wins for names shared by several tags
+                if key and key not in keys:
+                    keys[key] = num
+
+        goto = [{}]
+        out = [()]
+        for key, num in keys.items():
+            state = 0
+            for char in key:
+                nxt = goto[state].get(char)
+                if nxt is None:
+                    nxt = goto[state][char] = len(goto)
+                    goto.append({})
+                    out.append(())
+                state = nxt
+            out[state] = ((len(key), num),)
+
+        # Breadth first so the failure link of a state's parent is known before the state
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, nxt in goto[state].items():
+                queue.append(nxt)
+                link = fail[state]
+                while link and char not in goto[link]:
+                    link = fail[link]
+                link = goto[link].get(char, 0)
+                fail[nxt] = link if link != nxt else 0
+                out[nxt] = out[nxt] + out[fail[nxt]]
+        return cls(entries, keys, goto, fail, out)
+
+    @classmethod
+    def from_tsv(cls, tag_tsv):
+        """Compiles the vocabulary of a tag tsv, see SQLTagManager._parse_tag_file
+        """
+        from henpy.utilities.tagtools import SQLTagManager
+        return cls.build(SQLTagManager._parse_tag_file(tag_tsv))
+
+    @classmethod
+    def from_yaml(cls, en_yaml, jp_yaml):
+        """Compiles the vocabulary of the tags_en.yaml and tags_jp.yaml pair, whose types and tags
+        line up one to one (see data_generation/tag_data.py)
+        """
+        import yaml
+        with open(en_yaml, encoding="utf-8") as f:
+            en = yaml.safe_load(f)
+        with open(jp_yaml, encoding="utf-8") as f:
+            jp = yaml.safe_load(f)
+        return cls.build((e_type, j_type, e_tag, j_tag)
+                         for (e_type, e_tags), (j_type, j_tags) in zip(en.items(), jp.items())
+                         for e_tag, j_tag in zip(e_tags, j_tags))
+
+    def save(self, path):
+        """Writes the compiled vocabulary to path. The marshal format is only stable within a
+        python version, so the header records the version the artifact was written with
+        """
+        data = marshal.dumps((self.entries, self.keys, self._goto, self._fail, self._out))
+        with open(path, "wb") as f:
+            f.write(MAGIC + bytes([VERSION, *sys.version_info[:2]]) + zlib.compress(data, 9))
+
+    @classmethod
+    def load(cls, path):
+        """Loads a vocabulary written by save
+        @raises
+            ValueError if path isn't a vocabulary of this format version, or was written by another python version
+        """
+        with open(path, "rb") as f:
+            raw = f.read()
+        header = len(MAGIC) + 3
+        if raw[:len(MAGIC)] != MAGIC or raw[len(MAGIC)] != VERSION:
+            raise ValueError(f"{path} isn't a compiled tag vocabulary of version {VERSION}")
+        python = tuple(raw[len(MAGIC) + 1:header])
+        if python != tuple(sys.version_info[:2]):
+            raise ValueError(f"{path} was compiled by python {python[0]}.{python[1]}, recompile it with "
+                             f"python {sys.version_info[0]}.{sys.version_info[1]}")
+        return cls(*marshal.loads(zlib.decompress(raw[header:])))
+
+    def lookup(self, name):
+        """Finds the vocabulary entry of a tag name in any language
+        @returns
+            (e_type, j_type, e_name, j_name) tuple, None if the name isn't in the vocabulary
+        """
+        num = self.keys.get(normalize(name))
+        return None if num is None else self.entries[num]
+
+    def canonical(self, name, language="en"):
+        """Canonical name of a tag in the given language
+        @args
+            name (str): Tag name, in any language and form
+            language (str): Language of the name to return
+        @returns
+            str. The normalized name if the tag isn't in the vocabulary
+        """
+        key = normalize(name)
+        num = self.keys.get(key)
+        if num is None or language not in _languages:
+            return key
+        return self.entries[num][_languages[language]]
+
+    def scan(self, text):
+        """Finds every vocabulary tag mentioned in text, in a single pass over it.
+        Matches are leftmost-longest and don't overlap. Names starting or ending in a word character
+        only match on word boundaries, so "asian" isn't found in "caucasian"
+        @args
+            text (str)
+        @returns
+            list of (start, end, entry) tuples, with positions in normalize(text)
+        """
+        text = normalize(text)
+        goto, fail, out = self._goto, self._fail, self._out
+        candidates = []
+        state = 0
+        for pos, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for length, num in out[state]:
+                start = pos + 1 - length
+                if self._bounded(text, start, pos + 1):
+                    candidates.append((start, pos + 1, num))
+        candidates.sort(key=lambda match: (match[0], match[0] - match[1]))
+        res = []
+        end = 0
+        for start, stop, num in candidates:
+            if start >= end:
+                res.append((start, stop, self.entries[num]))
+                end = stop
+        return res
+
+    @staticmethod
+    def _bounded(text, start, end):
+        if _word_char_re.match(text[start]) and start and _word_char_re.match(text[start - 1]):
+            return False
+        if _word_char_re.match(text[end - 1]) and end < len(text) and _word_char_re.match(text[end]):
+            return False
+        return True
+
+    def __contains__(self, name):
+        return normalize(name) in self.keys
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __repr__(self):
+        return f"<Vocabulary:entries={len(self.entries)}|states={len(self._goto)}>"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compiles the tag vocabulary into a binary artifact")
+    parser.add_argument("source", nargs="+", help="tagdata.tsv, or the tags_en.yaml and tags_jp.yaml pair")
+    parser.add_argument("output", help="Path of the compiled vocabulary")
+    args = parser.parse_args(argv)
+    if len(args.source) == 2:
+        vocabulary = Vocabulary.from_yaml(*args.source)
+    elif len(args.source) == 1:
+        vocabulary = Vocabulary.from_tsv(args.source[0])
+    else:
+        parser.error("Expected a tsv or a pair of yaml files")
+    vocabulary.save(args.output)
+    logging.info(f"Compiled {vocabulary} to {args.output}")
+    return vocabulary
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main(sys.argv[1:])
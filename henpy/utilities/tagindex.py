@@ -0,0 +1,361 @@
+"""
+In-memory inverted index over video_tag for tag filtering queries.
+
+Each tag maps to a posting of the videos carrying it. Sparse postings are sorted arrays of
+video ids, so a tag on a handful of videos costs a handful of words however large the ids get.
+Once a tag is on more than 1/DENSE_RATIO of the id range, its posting becomes a bitmap (a
+bytearray with bit n set for video id n) that is updated in place. Queries led by a sparse
+posting check its ids against the other postings, and queries over dense postings only are
+evaluated with AND/OR/NOT on python ints, word-level operations done in C.
+"""
+
+import re
+import logging
+from array import array
+from bisect import bisect_left
+from sqlalchemy import select
+from henpy.persist import tables as T
+
+# A posting becomes a bitmap above count * DENSE_RATIO > id range, and an array again
+# below count * SPARSE_RATIO < id range. The gap keeps postings from flipping back and forth
+DENSE_RATIO = 64
+SPARSE_RATIO = 256
+
+_nonzero_re = re.compile(rb"[^\x00]")
+
+
+def _bitmap_from_ids(ids):
+    """Builds a bitmap from an iterable of non-negative ints
+    """
+    ids = list(ids)
+    if not ids:
+        return 0
+    data = bytearray((max(ids) >> 3) + 1)
+    for i in ids:
+        data[i >> 3] |= 1 << (i & 7)
+    return int.from_bytes(data, "little")
+
+
+def _iter_bits(data):
+    """Yields the positions of the set bits of a bitmap in ascending order
+    @args
+        data (int or bytes-like): Bitmap, bytes in little endian order
+    """
+    if isinstance(data, int):
+        data = data.to_bytes((data.bit_length() + 7) // 8, "little")
+    # Let the regex engine skip the runs of empty bytes
+    for match in _nonzero_re.finditer(data):
+        pos = match.start()
+        byte = data[pos]
+        for bit in range(8):
+            if byte >> bit & 1:
+                yield pos * 8 + bit
+
+
+def _popcount(bitmap):
+    try:
+        return bitmap.bit_count()
+    except AttributeError:
+        return bin(bitmap).count("1")
+
+
+def _set_bit(data, i):
+    pos = i >> 3
+    if pos >= len(data):
+        data.extend(bytes(pos + 1 - len(data)))
+    data[pos] |= 1 << (i & 7)
+
+
+def _clear_bit(data, i):
+    pos = i >> 3
+    if pos < len(data):
+        data[pos] &= ~(1 << (i & 7)) & 0xFF
+
+
+def _contains(posting, video_id):
+    """Tests a posting, array or bytearray bitmap, for a video id
+    """
+    if isinstance(posting, bytearray):
+        pos = video_id >> 3
+        return pos < len(posting) and bool(posting[pos] >> (video_id & 7) & 1)
+    i = bisect_left(posting, video_id)
+    return i < len(posting) and posting[i] == video_id
+
+
+def _to_int(posting):
+    """Bitmap int of a posting
+    """
+    if isinstance(posting, bytearray):
+        return int.from_bytes(posting, "little")
+    return _bitmap_from_ids(posting)
+
+
+def _tag_id(tag):
+    return tag if isinstance(tag, int) else tag.id
+
+
+class TagQueryResult:
+    """Result of a TagIndex query, held either as a bitmap or as a sorted list of video ids
+    """
+
+    def __init__(self, bitmap=0, ids=None):
+        """
+        @args
+            bitmap (int): Bitmap of the matching video ids
+            ids (list): Sorted matching video ids, used instead of bitmap when given
+        """
+        self._bitmap = bitmap if ids is None else None
+        self._ids = ids
+        self._count = None
+
+    @property
+    def bitmap(self):
+        """Bitmap (int) of the matching video ids
+        """
+        if self._bitmap is None:
+            self._bitmap = _bitmap_from_ids(self._ids)
+        return self._bitmap
+
+    @property
+    def count(self):
+        if self._count is None:
+            self._count = len(self._ids) if self._ids is not None else _popcount(self._bitmap)
+        return self._count
+
+    def ids(self, offset=0, limit=None):
+        """Matching video ids in ascending order
+        @args
+            offset (int): Number of ids to skip
+            limit (int): Maximum number of ids to return, None for all of them
+        @returns
+            list of video ids
+        """
+        if self._ids is not None:
+            return self._ids[offset:None if limit is None else offset + limit]
+        res = []
+        for num, video_id in enumerate(_iter_bits(self._bitmap)):
+            if num < offset:
+                continue
+            if limit is not None and len(res) >= limit:
+                break
+            res.append(video_id)
+        return res
+
+    def page(self, number, size=50):
+        """Gets page number (starting at 0) of the results
+        """
+        return self.ids(offset=number * size, limit=size)
+
+    def __iter__(self):
+        return iter(self._ids) if self._ids is not None else _iter_bits(self._bitmap)
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, video_id):
+        if self._ids is not None:
+            i = bisect_left(self._ids, video_id)
+            return i < len(self._ids) and self._ids[i] == video_id
+        return bool(self._bitmap >> video_id & 1)
+
+    def __repr__(self):
+        return f"<TagQueryResult:count={self.count}>"
+
+
+class TagIndex:
+    """Inverted index mapping tag ids to the videos carrying them
+    @attrs
+        postings (dict): Posting of each tag id, a sorted array of video ids or a bytearray bitmap
+        tag_types (dict): Tag type keyed by tag id, None for tags without data in the index language
+    """
+
+    def __init__(self, engine=None, language="en"):
+        """
+        @args
+            engine: SQLAlchemy engine the types of tags first seen by set_tags are looked up in
+            language (str): Language whose tag_data types are used for type restricted queries
+        """
+        self.engine = engine
+        self.language = language
+        self.postings = {}
+        self.tag_types = {}
+        self._counts = {}
+        # Tag ids of each video, needed to update postings incrementally
+        self._video_tags = {}
+        self._videos = bytearray()
+        # Bitmap of the videos carrying a tag of each type
+        self._type_videos = {}
+        self._id_range = 1
+
+    @classmethod
+    def from_engine(cls, engine, language="en"):
+        """Loads the index from the video_tag and tag_data tables
+        @args
+            engine: SQLAlchemy engine, for instance SQLTagManager.engine
+            language (str): Language whose tag_data types are used for type restricted queries
+        """
+        index = cls(engine, language)
+        video_tag = T.video_tag
+        tag_data = T.TagData.__table__
+        by_tag = {}
+        with engine.connect() as conn:
+            rows = conn.execution_options(stream_results=True).execute(
+                select(video_tag.c.video_id, video_tag.c.tag_id).order_by(video_tag.c.video_id))
+            for video_id, tag_id in rows:
+                by_tag.setdefault(tag_id, array("l")).append(video_id)
+                index._video_tags.setdefault(video_id, set()).add(tag_id)
+            for tag_id, tag_type in conn.execute(select(tag_data.c.tag_id, tag_data.c.type)
+                                                 .where(tag_data.c.language == language)):
+                index.tag_types[tag_id] = tag_type
+        index._id_range = max(index._video_tags, default=0) + 1
+        for video_id, tag_ids in index._video_tags.items():
+            _set_bit(index._videos, video_id)
+            for tag_type in {index.tag_types.get(tag_id) for tag_id in tag_ids}:
+                _set_bit(index._type_videos.setdefault(tag_type, bytearray()), video_id)
+        for tag_id, ids in by_tag.items():
+            index.postings[tag_id] = ids
+            index._counts[tag_id] = len(ids)
+            index._rebalance(tag_id)
+        logging.info(f"Loaded tag index with {len(index.postings)} tags over {len(index._video_tags)} videos")
+        return index
+
+    def _rebalance(self, tag_id):
+        """Switches the posting of a tag between array and bitmap according to its density
+        """
+        posting = self.postings[tag_id]
+        count = self._counts[tag_id]
+        if not count:
+            del self.postings[tag_id]
+            del self._counts[tag_id]
+        elif isinstance(posting, bytearray):
+            if count * SPARSE_RATIO < self._id_range:
+                self.postings[tag_id] = array("l", _iter_bits(posting))
+        elif count * DENSE_RATIO > self._id_range:
+            bitmap = bytearray((posting[-1] >> 3) + 1)
+            for video_id in posting:
+                bitmap[video_id >> 3] |= 1 << (video_id & 7)
+            self.postings[tag_id] = bitmap
+
+    def _resolve_types(self, tag_ids):
+        """Looks the types of tags the index hasn't seen yet up in tag_data
+        """
+        unknown = [tag_id for tag_id in tag_ids if tag_id not in self.tag_types]
+        if not unknown:
+            return
+        if self.engine is not None:
+            tag_data = T.TagData.__table__
+            with self.engine.connect() as conn:
+                self.tag_types.update(conn.execute(select(tag_data.c.tag_id, tag_data.c.type)
+                                                   .where(tag_data.c.language == self.language,
+                                                          tag_data.c.tag_id.in_(unknown))).fetchall())
+        for tag_id in unknown:
+            self.tag_types.setdefault(tag_id, None)
+
+    def set_tags(self, video_id, tags, tag_types=None):
+        """Sets the tags of a video, replacing any it had
+        @args
+            video_id (int)
+            tags (iterable): Tag objects or tag ids
+            tag_types (dict): Types of tags the index doesn't know yet, keyed by tag id. Types of other
+                new tags are looked up in the engine of the index, if it has one
+        """
+        self.remove(video_id)
+        tag_ids = {_tag_id(tag) for tag in tags}
+        if tag_types:
+            self.tag_types.update(tag_types)
+        self._resolve_types(tag_ids)
+        self._id_range = max(self._id_range, video_id + 1)
+        for tag_id in tag_ids:
+            posting = self.postings.get(tag_id)
+            if posting is None:
+                posting = self.postings[tag_id] = array("l")
+                self._counts[tag_id] = 0
+            if isinstance(posting, bytearray):
+                _set_bit(posting, video_id)
+            else:
+                posting.insert(bisect_left(posting, video_id), video_id)
+            self._counts[tag_id] += 1
+            self._rebalance(tag_id)
+        for tag_type in {self.tag_types[tag_id] for tag_id in tag_ids}:
+            _set_bit(self._type_videos.setdefault(tag_type, bytearray()), video_id)
+        self._video_tags[video_id] = tag_ids
+        _set_bit(self._videos, video_id)
+
+    def remove(self, video_id):
+        """Removes a video from the index
+        """
+        tag_ids = self._video_tags.pop(video_id, None)
+        if tag_ids is None:
+            return
+        for tag_id in tag_ids:
+            posting = self.postings[tag_id]
+            if isinstance(posting, bytearray):
+                _clear_bit(posting, video_id)
+            else:
+                del posting[bisect_left(posting, video_id)]
+            self._counts[tag_id] -= 1
+            self._rebalance(tag_id)
+        for tag_type in {self.tag_types.get(tag_id) for tag_id in tag_ids}:
+            _clear_bit(self._type_videos[tag_type], video_id)
+        _clear_bit(self._videos, video_id)
+
+    def type_bitmap(self, tag_type):
+        """Bitmap of the videos carrying at least one tag of tag_type
+        """
+        return int.from_bytes(self._type_videos.get(tag_type, b""), "little")
+
+    def query(self, all_of=(), any_of=(), none_of=(), tag_type=None):
+        """Finds the videos with every tag of all_of, at least one tag of any_of and no tag of none_of
+        @args
+            all_of (iterable): Tag objects or ids the videos must all carry
+            any_of (iterable): Tag objects or ids of which the videos must carry at least one
+            none_of (iterable): Tag objects or ids the videos must not carry
+            tag_type (str): Only match videos carrying at least one tag of this type, eg "star"
+        @returns
+            TagQueryResult object
+        """
+        postings = self.postings
+        required = [_tag_id(tag) for tag in all_of]
+        if any(tag_id not in postings for tag_id in required):
+            return TagQueryResult(ids=[])
+        # Smallest postings first, so the candidates shrink quickly
+        required = [postings[tag_id] for tag_id in sorted(required, key=self._counts.get)]
+        any_of = list(any_of)
+        optional = [postings[tag_id] for tag_id in map(_tag_id, any_of) if tag_id in postings]
+        if any_of and not optional:
+            return TagQueryResult(ids=[])
+        excluded = [postings[tag_id] for tag_id in map(_tag_id, none_of) if tag_id in postings]
+
+        if required and not isinstance(required[0], bytearray):
+            # Led by a sparse posting, check its few ids against everything else
+            ids = list(required[0])
+            for posting in required[1:]:
+                ids = [video_id for video_id in ids if _contains(posting, video_id)]
+            if optional:
+                ids = [video_id for video_id in ids if any(_contains(posting, video_id) for posting in optional)]
+            if excluded:
+                ids = [video_id for video_id in ids
+                       if not any(_contains(posting, video_id) for posting in excluded)]
+            if tag_type is not None:
+                type_videos = self._type_videos.get(tag_type, bytearray())
+                ids = [video_id for video_id in ids if _contains(type_videos, video_id)]
+            return TagQueryResult(ids=ids)
+
+        res = _to_int(required[0]) if required else int.from_bytes(self._videos, "little")
+        for posting in required[1:]:
+            res &= _to_int(posting)
+            if not res:
+                return TagQueryResult(0)
+        if optional:
+            union = 0
+            for posting in optional:
+                union |= _to_int(posting)
+            res &= union
+        for posting in excluded:
+            res &= ~_to_int(posting)
+        if tag_type is not None:
+            res &= self.type_bitmap(tag_type)
+        return TagQueryResult(res)
+
+    def __len__(self):
+        return len(self._video_tags)
@@ -1,43 +1,200 @@
 from henpy.models import QuerySet
 from henpy.persist import tables as T
+from henpy.persist.storage import create_storage_engine, session_factory, session_scope
+from henpy.metrics import NULL_METRICS
+from henpy.utilities.normalize_tags import Vocabulary
 
+import time
 import logging
+import threading
+from collections import OrderedDict
 # import sqlalchemy
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.orm.exc import NoResultFound, MultipleResultsFound
+from sqlalchemy import select, func, bindparam
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import MultipleResultsFound
+
+
+class TagCache:
+    """Bounded LRU cache of Tag objects keyed by (language, name)
+    @attrs
+        maxsize (int): Maximum number of entries held
+        complete (bool): True if the cache holds every tag in the database,
+                         in which case a miss means the tag doesn't exist
+        hits (int)
+        misses (int)
+    """
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self.complete = False
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Gets the tag stored under key, None if missing
+        """
+        with self._lock:
+            try:
+                tag = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return tag
+
+    def put(self, key, tag):
+        with self._lock:
+            self._data[key] = tag
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                # Evicted entries may still exist in the database
+                self.complete = False
+
+    def discard(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.complete = False
+
+    def stats(self):
+        """Hit/miss statistics of the cache
+        @returns
+            dict with the hits, misses, hit_rate and size of the cache
+        """
+        total = self.hits + self.misses
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "size": len(self._data)}
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
 
 
 class SQLTagManager:
     """Basic class handling Tag creation and video tagging
     """
 
-    def __init__(self, db_path):
-        self.engine = create_engine(db_path)
+    def __init__(self, db_path, cache_size=100000, pool_size=8, metrics=None, vocabulary=None):
+        """
+        @args
+            db_path (str): SQLAlchemy database url
+            cache_size (int): Maximum number of tag names held in the in-process cache
+            pool_size (int): Number of pooled database connections
+            metrics (Metrics): Optional henpy.metrics.Metrics to record query and commit timings into
+            vocabulary (Vocabulary or str): Compiled tag vocabulary, or the path of one. When set, tag names
+                                            are resolved through it so variant forms map to a single tag.
+                                            See henpy.utilities.normalize_tags
+        """
+        self.metrics = NULL_METRICS if metrics is None else metrics
+        if isinstance(vocabulary, str):
+            vocabulary = Vocabulary.load(vocabulary)
+        self.vocabulary = vocabulary
+        self.engine = create_storage_engine(db_path, pool_size=pool_size)
         # Create the tables if they don't exist
-        T.Base.metadata.create_all(self.engine)
-        Session = sessionmaker(bind=self.engine)
-        self.session = Session()
+        T.create_all(self.engine)
+        # Each thread gets its own session. Objects stay loaded after commits,
+        # so cached tags don't trigger refreshes
+        self.Session = session_factory(self.engine)
+        self.cache = TagCache(cache_size)
+        self._cache_loaded = False
+        self._cache_lock = threading.Lock()
+        # Serializes tag creation, so concurrent callers don't create the same tag twice
+        self._write_lock = threading.RLock()
+
+    @property
+    def session(self):
+        """Session of the calling thread
+        """
+        return self.Session()
 
-    def get_tag(self, tag_name):
-        """Gets a tag with name == tag_name
+    def _load_cache(self):
+        """Fills the tag cache from the database
+        """
+        with self._cache_lock:
+            if self._cache_loaded:
+                return
+            # Reads run in short transactions too, so they don't pin the database snapshot.
+            # Nothing is expired since the sessions don't expire on commit
+            with session_scope(self.Session) as session:
+                rows = (session.query(T.TagData.language, T.TagData.name, T.Tag)
+                        .join(T.Tag, T.TagData.tag_id == T.Tag.id)
+                        .limit(self.cache.maxsize + 1)
+                        .all())
+            for language, name, tag in rows[:self.cache.maxsize]:
+                self.cache.put((language, name), tag)
+            self.cache.complete = len(rows) <= self.cache.maxsize
+            self._cache_loaded = True
+        logging.debug(f"Loaded {len(self.cache)} tag names into the cache, complete={self.cache.complete}")
+
+    def get_tag(self, tag_name, language="en"):
+        """Gets a tag with a name of tag_name in the given language
         @args
             tag_name
+            language (str): Language of the name
         @returns
             Tag object or None
         """
-        logging.info(f"Querying database for tag with tag_name={tag_name}")
+        if not self._cache_loaded:
+            self._load_cache()
+        if self.vocabulary is not None:
+            tag_name = self.vocabulary.canonical(tag_name, language)
+        key = (language, tag_name)
+        tag = self.cache.get(key)
+        if tag is not None or self.cache.complete:
+            return tag
+        logging.debug(f"Querying database for tag with tag_name={tag_name}, language={language}")
         try:
-            # This bit will probably have to be modified for multiple languages.
-            # Also, what happens if identical tag_names exist?
-            return self.session.query(T.Tag).filter(T.Tag.name == tag_name).one()
-        except NoResultFound:
-            logging.info(f"Unable to find tag with name '{tag_name}'")
-            return None
+            with self.metrics.timer("tag_query"), session_scope(self.Session) as session:
+                tag = (session.query(T.Tag)
+                       .join(T.TagData, T.TagData.tag_id == T.Tag.id)
+                       .filter(T.TagData.language == language, T.TagData.name == tag_name)
+                       .one_or_none())
         # Check for multiple match
         except MultipleResultsFound:
-            logging.info(self.session.query(T.Tag).filter(T.Tag.name == tag_name).all())
+            logging.info(self.session.query(T.TagData).filter(T.TagData.language == language,
+                                                              T.TagData.name == tag_name).all())
             raise
+        if tag is None:
+            logging.debug(f"Unable to find tag with name '{tag_name}'")
+            return None
+        self.cache.put(key, tag)
+        return tag
+
+    def _query_tags(self, names, language):
+        """Looks tags up in the database by name, with a single IN query per 500 names.
+        Found tags are put in the cache
+        @args
+            names (iterable of str): Tag names
+            language (str): Language of the names
+        @returns
+            dict of the found Tag objects keyed by name
+        """
+        names = list(names)
+        found = {}
+        with session_scope(self.Session) as session:
+            # Chunked to stay under the bound parameter limit of sqlite
+            for i in range(0, len(names), 500):
+                with self.metrics.timer("tag_query"):
+                    rows = (session.query(T.TagData.name, T.Tag)
+                            .join(T.Tag, T.TagData.tag_id == T.Tag.id)
+                            .filter(T.TagData.language == language, T.TagData.name.in_(names[i:i + 500]))
+                            .all())
+                for tag_name, tag in rows:
+                    if tag_name not in found:
+                        found[tag_name] = tag
+                        self.cache.put((language, tag_name), tag)
+        return found
 
     def _create_tag(self, tag_name, tag_data):
         """Creates a tag without committing
@@ -54,38 +211,278 @@ class SQLTagManager:
         self.session.add(tag)
         return tag
 
+    def _cache_created(self, tags):
+        """Writes committed tags through to the cache so their names resolve without a query.
+        Only done after the commit, other threads must not see tags without an id
+        """
+        for tag in tags:
+            for tag_data in tag.data:
+                self.cache.put((tag_data.language, tag_data.name), tag)
+
     def create_tag(self, tag_name, tag_data):
         # Maybe put a warning for duplicate tags
         logging.debug(f"Creating tag with tag_name={tag_name}, tag_data={tag_data}")
-        tag = self._create_tag(tag_name, tag_data)
-        # self.session.add(tag)
-        self.session.commit()
+        with self._write_lock:
+            with self.metrics.timer("tag_commit"), session_scope(self.Session):
+                tag = self._create_tag(tag_name, tag_data)
+            self._cache_created([tag])
+        return tag
 
     def get_or_create_tag(self, tag_name, tag_type=None, language="en", tag_data=None):
         """Quick and dirty tag creation from just a name and type
+        @args
+            tag_name (str)
+            tag_type (str): Type given to the tag if it needs to be created
+            language (str): Language of tag_name
+            tag_data (iterable): (language, tag_type, name, display_name) tuples to create the tag with.
+                                 Defaults to tag_name in the given language
+        @returns
+            Tag object
         """
-        tag = self.get_tag(tag_name)
+        display_name = tag_name
+        if self.vocabulary is not None:
+            # Stored under the canonical name like get_or_create_tags, the scraped form is kept for display
+            canonical = self.vocabulary.canonical
+            tag_name = canonical(tag_name, language)
+            if tag_data is not None:
+                tag_data = [(data_language, data_type, canonical(name, data_language), data_display_name)
+                            for data_language, data_type, name, data_display_name in tag_data]
+        tag = self.get_tag(tag_name, language)
         if tag:
             return tag
-        return self.create_tag(tag_name, tag_data)
+        if tag_data is None:
+            tag_data = [(language, tag_type, tag_name, display_name)]
+        with self._write_lock:
+            # Another thread, manager or process may have created it in the meantime
+            tag = (self.cache.get((language, tag_name))
+                   or self._query_tags([tag_name], language).get(tag_name))
+            if tag is not None:
+                return tag
+            try:
+                return self.create_tag(tag_name, tag_data)
+            except IntegrityError:
+                # Another process created it since the query above
+                tag = self._query_tags([tag_name], language).get(tag_name)
+                if tag is None:
+                    raise
+                return tag
 
-    @classmethod
-    def from_file(cls, db_path, tag_tsv):
-        tm = cls(db_path)
+    def get_or_create_tags(self, tags, language="en"):
+        """Resolves many tags at once. Names not held by the cache are looked up with a single
+        IN query and the ones still missing are created in a single transaction.
+        @args
+            tags (iterable): (tag_name, tag_type) tuples. tag_type is used if the tag needs to be created
+            language (str): Language of the tag names
+        @returns
+            list of Tag objects in the order of tags
+        """
+        tags = list(tags)
+        if not self._cache_loaded:
+            self._load_cache()
+        # Names of the tags to create, keyed by the name they are stored under
+        display_names = {}
+        if self.vocabulary is not None:
+            canonical = self.vocabulary.canonical
+            resolved = []
+            for tag_name, tag_type in tags:
+                name = canonical(tag_name, language)
+                display_names.setdefault(name, tag_name)
+                resolved.append((name, tag_type))
+            tags = resolved
+        found = {}
+        missing = {}
+        for tag_name, tag_type in tags:
+            if tag_name in found or tag_name in missing:
+                continue
+            tag = self.cache.get((language, tag_name))
+            if tag is None:
+                missing[tag_name] = tag_type
+            else:
+                found[tag_name] = tag
+        metrics = self.metrics
+        if metrics.enabled:
+            metrics.incr("tag_cache_hits", len(found))
+            metrics.incr("tag_cache_misses", len(missing))
+
+        if missing and not self.cache.complete:
+            for tag_name, tag in self._query_tags(missing, language).items():
+                del missing[tag_name]
+                found[tag_name] = tag
+
+        if missing:
+            with self._write_lock:
+                # Another thread may have created some of them in the meantime
+                for tag_name in list(missing):
+                    tag = self.cache.get((language, tag_name))
+                    if tag is not None:
+                        found[tag_name] = tag
+                        del missing[tag_name]
+                # A complete cache only knows the tags of this manager, other managers and processes
+                # sharing the database may have created them too
+                if missing:
+                    for tag_name, tag in self._query_tags(missing, language).items():
+                        del missing[tag_name]
+                        found[tag_name] = tag
+                while missing:
+                    logging.debug(f"Creating {len(missing)} tags: {list(missing)}")
+                    try:
+                        with metrics.timer("tag_commit"), session_scope(self.Session):
+                            created = [self._create_tag(tag_name, [(language, tag_type, tag_name,
+                                                                    display_names.get(tag_name, tag_name))])
+                                       for tag_name, tag_type in missing.items()]
+                    except IntegrityError:
+                        # Another process created some of them since the query above, the rest is retried
+                        raced = self._query_tags(missing, language)
+                        if not raced:
+                            raise
+                        for tag_name, tag in raced.items():
+                            del missing[tag_name]
+                            found[tag_name] = tag
+                        continue
+                    self._cache_created(created)
+                    found.update(zip(missing, created))
+                    metrics.incr("tags_created", len(created))
+                    break
+        return [found[tag_name] for tag_name, tag_type in tags]
+
+    def cache_stats(self):
+        """Hit/miss statistics of the tag cache, see TagCache.stats
+        """
+        return self.cache.stats()
+
+    @staticmethod
+    def _parse_tag_file(tag_tsv):
+        """Streams the tag vocabulary from a tsv file
+        @args
+            tag_tsv (str): Path of a tsv with e_type, j_type, e_tag, j_tag columns
+        @returns
+            generator of (e_type, j_type, e_name, j_name) tuples, lowercased for standardization
+        """
         with open(tag_tsv, encoding="utf-8") as f:
             for line in f:
                 # strip out comments
                 line = line.split("#")[0].strip()
-                if not line:
+                if not line or line.startswith("e_type\t"):
                     continue
-                logging.debug(f"processing line: {line}")
                 # Force lowercase for standardization
                 line = line.lower()
                 e_type, j_type, e_name, j_name = line.split("\t")
-                tm._create_tag(e_name, [("en", e_type, e_name, e_name),
-                                        ("jp", j_type, j_name, j_name)])
-                # # Should we batch commits instead in some create_tags with batchsize = N
-                tm.session.commit()
+                yield e_type, j_type, e_name, j_name
+
+    def import_tags(self, tag_tsv, batch_size=1000):
+        """Bulk imports a tag vocabulary file. Rows are written with batched multi-row inserts,
+        one transaction per batch. Tags already present (by english type and name) are only updated
+        where their data changed, so re-importing a file is cheap.
+        @args
+            tag_tsv (str): Path of the tsv to import, see _parse_tag_file
+            batch_size (int): Number of tags written per transaction
+        @returns
+            dict with the counts of rows read, inserted, updated, unchanged and skipped, and the import rate.
+            Rows are skipped when their name is already used by another tag in the same language
+        """
+        start = time.perf_counter()
+        tag_table = T.Tag.__table__
+        data_table = T.TagData.__table__
+        update_data = (data_table.update()
+                       .where(data_table.c.id == bindparam("_id"))
+                       .values(type=bindparam("_type"), name=bindparam("_name"),
+                               display_name=bindparam("_display_name")))
+
+        with self.engine.connect() as conn:
+            # Tags are identified by their english (type, name).
+            # existing maps those to the tag_id, by_tag maps tag_id -> {language: (id, type, name)}.
+            # owners maps (language, name) -> tag_id, as names are unique per language
+            existing = {}
+            by_tag = {}
+            owners = {}
+            for data_id, tag_id, language, tag_type, name in conn.execute(
+                    select(data_table.c.id, data_table.c.tag_id, data_table.c.language,
+                           data_table.c.type, data_table.c.name)):
+                if language == "en":
+                    existing[(tag_type, name)] = tag_id
+                by_tag.setdefault(tag_id, {})[language] = (data_id, tag_type, name)
+                owners[(language, name)] = tag_id
+            next_id = (conn.execute(select(func.max(tag_table.c.id))).scalar() or 0) + 1
+
+        stats = {"read": 0, "inserted": 0, "updated": 0, "unchanged": 0, "skipped": 0}
+        tags, inserts, updates = [], [], []
+
+        def flush():
+            if not (tags or inserts or updates):
+                return
+            with self.metrics.timer("tag_import_flush"), self.engine.begin() as conn:
+                if tags:
+                    conn.execute(tag_table.insert(), tags)
+                if inserts:
+                    conn.execute(data_table.insert(), inserts)
+                if updates:
+                    conn.execute(update_data, updates)
+            tags.clear()
+            inserts.clear()
+            updates.clear()
+
+        for e_type, j_type, e_name, j_name in self._parse_tag_file(tag_tsv):
+            stats["read"] += 1
+            tag_id = existing.get((e_type, e_name))
+            created = tag_id is None
+            if created and ("en", e_name) in owners:
+                logging.warning(f"Skipping tag {e_type}/{e_name}, the name is already used by another tag")
+                stats["skipped"] += 1
+                continue
+            if created:
+                tag_id = next_id
+                next_id += 1
+                existing[(e_type, e_name)] = tag_id
+                by_tag[tag_id] = {}
+                tags.append({"id": tag_id, "name": e_name})
+            changed = False
+            for language, tag_type, name in (("en", e_type, e_name), ("jp", j_type, j_name)):
+                current = by_tag[tag_id].get(language)
+                if owners.get((language, name), tag_id) != tag_id:
+                    logging.warning(f"Skipping the {language} name {name} of tag {e_type}/{e_name}, "
+                                    f"the name is already used by another tag")
+                    continue
+                if current is None:
+                    inserts.append({"tag_id": tag_id, "language": language, "type": tag_type,
+                                    "name": name, "display_name": name})
+                elif current[1:] != (tag_type, name):
+                    updates.append({"_id": current[0], "_type": tag_type, "_name": name,
+                                    "_display_name": name})
+                    changed = True
+                else:
+                    continue
+                if current is not None:
+                    owners.pop((language, current[2]), None)
+                owners[(language, name)] = tag_id
+                by_tag[tag_id][language] = (current[0] if current else None, tag_type, name)
+            if created:
+                stats["inserted"] += 1
+            elif changed:
+                stats["updated"] += 1
+            else:
+                stats["unchanged"] += 1
+            if len(tags) + len(updates) >= batch_size:
+                flush()
+        flush()
+
+        # Rows were written around the session, so drop anything it or the cache holds
+        self.session.expire_all()
+        self.cache.clear()
+        self._cache_loaded = False
+
+        elapsed = time.perf_counter() - start
+        stats["seconds"] = elapsed
+        stats["rows_per_sec"] = stats["read"] / elapsed if elapsed else 0.0
+        logging.info(f"Imported tags from {tag_tsv}: {stats['read']} rows read, {stats['inserted']} inserted, "
+                     f"{stats['updated']} updated, {stats['skipped']} skipped in {elapsed:.2f}s ({stats['rows_per_sec']:.0f} rows/sec)")
+        return stats
+
+    @classmethod
+    def from_file(cls, db_path, tag_tsv, batch_size=1000):
+        """Creates a tag manager and imports the tag vocabulary of tag_tsv into it, see import_tags
+        """
+        tm = cls(db_path)
+        tm.import_tags(tag_tsv, batch_size=batch_size)
         return tm
 
 
@@ -9,4 +9,7 @@ setup(
     description='Description of my package',
     packages=find_packages(),
     install_requires=[],
+    entry_points={
+        "console_scripts": ["henpy=henpy.cli:main"],
+    },
 )
\ No newline at end of file
@@ -1,6 +1,8 @@
 from henpy.searchers import searchers
+from henpy.utilities.tagtools import SQLTagManager
 
-s = searchers.JavlibrarySearcher()
+tm = SQLTagManager("sqlite://")
+s = searchers.JavlibrarySearcher(tm)
 
 a = s.search("LOVE-049")
 for i in a:
@@ -8,4 +10,4 @@ for i in a:
 
 a = s.search("LOVE-001")
 for i in a:
-    print(i)
\ No newline at end of file
+    print(i)
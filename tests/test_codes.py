@@ -0,0 +1,30 @@
+from henpy.preprocessing.codes import extract_codes, canonicalize, canonicalize_many
+
+
+def _codes(name):
+    return [str(key) for key in extract_codes(name)]
+
+
+def test_separated_letters_are_not_suffixes():
+    assert _codes("SSIS-001-C.mp4") == ["SSIS-001"]
+    assert _codes("ABC-123-A.mp4") == _codes("ABC-123-B.mp4") == ["ABC-123"]
+    assert _codes("IPZ-101A.avi") == ["IPZ-101A"]
+
+
+def test_part_markers():
+    assert _codes("abp123cd2.mkv") == ["ABP-123"]
+    assert _codes("ABC-123_part1.mp4") == ["ABC-123"]
+    assert _codes("ABC-123-1.mp4") == ["ABC-123"]
+
+
+def test_words_years_resolutions_and_domains_are_not_codes():
+    assert _codes("[FHD] SSIS-123 Title 2021.mkv") == ["SSIS-123"]
+    assert _codes("Movie 1080p.mp4") == []
+    assert _codes("hhd800.com@SSIS-001.mp4") == ["SSIS-001"]
+    assert _codes("[hd]love_049.mp4") == ["LOVE-049"]
+
+
+def test_batches_strip_whitespace_like_single_codes():
+    raws = ["ABC-123\r", " abc123\t", "ABC-123\x0b", "　ABC 123", "not a code"]
+    assert canonicalize_many(raws) == [canonicalize(raw) for raw in raws]
+    assert canonicalize_many(raws)[:4] == [canonicalize("ABC-123")] * 4
@@ -0,0 +1,59 @@
+import os
+import sys
+import pytest
+import requests
+from henpy.metrics import Metrics
+from henpy.searchers.searchers import CompositeSearcher, JavlibrarySearcher
+from henpy.utilities.tagtools import SQLTagManager
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmarks"))
+from standin import StandinServer  # noqa: E402
+
+
+class _LocalSearcher(JavlibrarySearcher):
+    """JavlibrarySearcher with plain sessions, the stand-in has no cloudflare challenge"""
+
+    def _create_session(self):
+        return requests.Session()
+
+
+@pytest.fixture
+def servers():
+    slow, fast = StandinServer(latency=0.5).start(), StandinServer().start()
+    yield slow, fast
+    slow.stop()
+    fast.stop()
+
+
+def _composite(servers, **kwargs):
+    tm = SQLTagManager("sqlite://")
+    return CompositeSearcher([_LocalSearcher(tm, base_url=server.url) for server in servers], metrics=Metrics(),
+                             **kwargs)
+
+
+def test_slow_backend_is_hedged(servers):
+    composite = _composite(servers, hedge_delay=0.05)
+    [video] = composite.search("ABC-001")
+    assert video.code == "ABC-001"
+    counters = composite.metrics.counters
+    assert counters["hedges"] == 1 and counters["wins.1.javlibrary"] == 1
+    # The slow backend hasn't completed a query yet, so the backend that did comes first
+    assert composite._ranked() == [1, 0]
+    composite.close()
+
+
+def test_first_complete_result_wins(servers):
+    composite = _composite(servers[::-1], hedge_delay=0.2)
+    [video] = composite.search("ABC-002")
+    assert video.code == "ABC-002"
+    assert composite.metrics.counters == {"wins.0.javlibrary": 1}
+    composite.close()
+
+
+def test_merge_combines_backends(servers):
+    composite = _composite(servers, merge=True)
+    [video] = composite.search("ABC-003")
+    assert video.code == "ABC-003" and set(video.title) == {"en", "ja"}
+    assert servers[0].requests and servers[1].requests
+    assert not any(name.startswith("wins.") for name in composite.metrics.counters)
+    composite.close()
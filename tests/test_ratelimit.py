@@ -0,0 +1,50 @@
+import time
+import pytest
+from henpy.searchers.ratelimit import AdaptiveRateLimiter, CircuitOpen
+from henpy.searchers.searchers import SiteSearcher
+
+
+class _Searcher(SiteSearcher):
+
+    def search(self, code):
+        return []
+
+
+def test_failed_probe_reopens_breaker():
+    limiter = AdaptiveRateLimiter(rate=100.0, burst=10, breaker_threshold=1, breaker_cooldown=0.05)
+    searcher = _Searcher(None, rate_limiter=limiter)
+    host = "example.com"
+    limiter.failure(host)
+    with pytest.raises(CircuitOpen):
+        limiter.acquire(host)
+
+    def unsolvable(url, stage):
+        raise ValueError("Unable to solve the challenge")
+
+    time.sleep(0.06)
+    searcher._request = unsolvable
+    with pytest.raises(ValueError):
+        searcher._get(f"http://{host}/en/")
+    # The probe failed, so the breaker is open again rather than stuck half open
+    with pytest.raises(CircuitOpen):
+        limiter.acquire(host)
+    time.sleep(0.06)
+    limiter.acquire(host)
+    limiter.success(host)
+    limiter.acquire(host)
+
+
+def test_probe_waiting_for_retry_after_goes_out():
+    limiter = AdaptiveRateLimiter(rate=100.0, burst=10, breaker_threshold=1, breaker_cooldown=0.05)
+    host = "example.com"
+    limiter.failure(host, throttled=True, retry_after=0.2)
+    time.sleep(0.06)
+    # Half open, but the site asked to wait longer than the cooldown, so the probe waits for it
+    # rather than being shut out by its own claim
+    start = time.monotonic()
+    limiter.acquire(host)
+    assert time.monotonic() - start >= 0.1
+    with pytest.raises(CircuitOpen):
+        limiter.acquire(host)
+    limiter.success(host)
+    limiter.acquire(host)
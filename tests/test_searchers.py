@@ -0,0 +1,150 @@
+import gc
+import os
+import time
+import weakref
+import threading
+import pytest
+import requests
+from henpy.searchers.searchers import SiteSearcher, JavlibrarySearcher
+from henpy.utilities.tagtools import SQLTagManager
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmarks", "fixtures")
+
+
+class _Response:
+    status_code = 200
+    content = b""
+
+
+class _Session:
+
+    def __init__(self, searcher):
+        self.searcher = searcher
+
+    def get(self, url):
+        searcher = self.searcher
+        with searcher.lock:
+            searcher.in_flight += 1
+            searcher.peak = max(searcher.peak, searcher.in_flight)
+        time.sleep(0.005)
+        with searcher.lock:
+            searcher.in_flight -= 1
+        return _Response()
+
+
+class _Result:
+    pass
+
+
+class _Searcher(SiteSearcher):
+
+    def __init__(self, **kwargs):
+        super().__init__(None, **kwargs)
+        self.lock = threading.Lock()
+        self.in_flight = self.peak = self.searched = 0
+
+    def _create_session(self):
+        return _Session(self)
+
+    def search(self, code):
+        with self.lock:
+            self.searched += 1
+        self._fetch_all([f"http://example.com/{code}/{i}" for i in range(4)])
+        yield _Result()
+
+
+class _Javlibrary(JavlibrarySearcher):
+
+    def __init__(self, **kwargs):
+        super().__init__(None, **kwargs)
+        self.lock = threading.Lock()
+        self.in_flight = self.peak = 0
+
+    def _create_session(self):
+        return _Session(self)
+
+    def _build_metadata(self, responses):
+        return len(responses)
+
+
+def test_per_host_limit_is_scoped_to_the_call():
+    searcher = _Searcher(per_host_limit=4)
+    list(searcher.search_many([f"ABC-{i:03d}" for i in range(1, 9)], max_concurrency=4, per_host_limit=1))
+    assert searcher.peak == 1
+    assert searcher.per_host_limit == 4 and not searcher._host_limits
+    searcher.peak = 0
+    list(searcher.search_many([f"ABC-{i:03d}" for i in range(1, 9)], max_concurrency=4))
+    assert 1 < searcher.peak <= 4
+
+
+def test_candidate_pages_respect_the_limit_of_the_call():
+    searcher = _Javlibrary(per_host_limit=4)
+    candidates = [(searcher.access_path.replace("{suffix}", f"/?v={i}"), f"ABC-{i:03d}", None)
+                  for i in range(6)]
+    searcher._local.host_limits = (1, {})
+    try:
+        assert list(searcher._iter_pages(candidates, lookahead=3)) == [2] * 6
+    finally:
+        searcher._local.host_limits = None
+    assert searcher.peak == 1 and not searcher._host_limits
+
+
+def test_search_many_doesnt_hold_consumed_results():
+    for ordered in (True, False):
+        searcher = _Searcher()
+        results = searcher.search_many([f"ABC-{i:03d}" for i in range(1, 41)], max_concurrency=2,
+                                       ordered=ordered)
+        refs = []
+        for code, queryset in results:
+            refs.extend(weakref.ref(result) for result in queryset)
+            del queryset
+            if len(refs) == 30:
+                break
+        gc.collect()
+        # Only the last result is still referenced, by the loop, and only a window of the codes
+        # is searched ahead of the consumer
+        assert sum(ref() is not None for ref in refs[:-1]) == 0
+        assert searcher.searched <= 30 + 2 * 2
+        results.close()
+
+
+class _PageSession:
+    """Serves the fixture page of the english video page, and fails every other url"""
+
+    def get(self, url):
+        resp = requests.models.Response()
+        resp.url = url
+        if "/en/" in url:
+            resp.status_code = 200
+            with open(os.path.join(FIXTURE_DIR, "video_en.html"), "rb") as f:
+                resp._content = f.read()
+        else:
+            resp.status_code = 503
+            resp._content = b"Service unavailable"
+        resp.encoding = "utf-8"
+        return resp
+
+
+def test_failed_language_page_raises():
+    searcher = JavlibrarySearcher(SQLTagManager("sqlite://"))
+    searcher._create_session = _PageSession
+    with pytest.raises(requests.HTTPError):
+        list(searcher.fetch(searcher.access_path.format(lang="en", suffix="/?v=javlio354u")))
+
+
+class _Page:
+
+    def __init__(self, text):
+        self.text = text
+
+
+def test_fields_out_of_page_order_are_extracted():
+    searcher = JavlibrarySearcher(None)
+    with open(os.path.join(FIXTURE_DIR, "video_en.html"), encoding="utf-8") as f:
+        page = f.read()
+    expected = searcher._extract_metadata(_Page(page))
+    # The title moved below every other field
+    head, rest = page.split("<meta property=\"og:title\"", 1)
+    title, rest = rest.split(">", 1)
+    moved = searcher._extract_metadata(_Page(head + rest + "<meta property=\"og:title\"" + title + ">"))
+    assert expected["code"] == "LOVE-049" and moved == expected
@@ -0,0 +1,64 @@
+import random
+from henpy.models import VideoMetadata
+from henpy.persist.managers import VideoManager
+from henpy.utilities.tagindex import TagIndex, TagQueryResult, DENSE_RATIO
+from henpy.utilities.tagtools import SQLTagManager
+
+
+def _brute(videos, all_of=(), any_of=(), none_of=(), types=None, tag_type=None):
+    return sorted(video_id for video_id, tags in videos.items()
+                  if set(all_of) <= tags and (not any_of or tags & set(any_of)) and not tags & set(none_of)
+                  and (tag_type is None or any(types.get(tag) == tag_type for tag in tags)))
+
+
+def test_queries_match_brute_force_through_updates():
+    rand = random.Random(0)
+    types = {tag_id: ("star" if tag_id % 3 else "genre") for tag_id in range(40)}
+    index = TagIndex()
+    videos = {}
+    for step in range(3000):
+        video_id = rand.randrange(1, 2000)
+        if rand.random() < 0.1:
+            index.remove(video_id)
+            videos.pop(video_id, None)
+            continue
+        # Tag 0 is on most videos so its posting goes dense, higher tags get rarer and stay sparse
+        tags = {tag for tag in range(1, 40) if rand.random() < 0.2 / tag} | ({0} if rand.random() < 0.7 else set())
+        index.set_tags(video_id, tags, tag_types={tag: types[tag] for tag in tags})
+        videos[video_id] = tags
+    assert isinstance(index.postings[0], bytearray)
+    assert not isinstance(index.postings[39], bytearray)
+    for _ in range(200):
+        all_of = rand.sample(range(40), rand.randrange(0, 3))
+        any_of = rand.sample(range(40), rand.randrange(0, 3))
+        none_of = rand.sample(range(40), rand.randrange(0, 2))
+        tag_type = rand.choice([None, "star", "genre"])
+        res = index.query(all_of, any_of, none_of, tag_type)
+        expected = _brute(videos, all_of, any_of, none_of, types, tag_type)
+        assert res.ids() == expected
+        assert res.count == len(expected)
+        assert list(TagQueryResult(res.bitmap)) == expected
+
+
+def test_postings_switch_with_density():
+    index = TagIndex()
+    for video_id in range(1, 10 * DENSE_RATIO):
+        index.set_tags(video_id, [1, 2] if video_id % 2 else [1])
+    assert isinstance(index.postings[1], bytearray)
+    for video_id in range(1, 10 * DENSE_RATIO):
+        index.set_tags(video_id, [2] if video_id in (1, 3) else [])
+    assert list(index.postings[2]) == [1, 3]
+    assert 1 not in index.postings
+    assert index.query([2]).ids() == [1, 3]
+
+
+def test_new_tags_get_their_type_from_the_database():
+    tm = SQLTagManager("sqlite://")
+    index = TagIndex.from_engine(tm.engine)
+    vm = VideoManager(tm.engine, index=index)
+    star = tm.get_or_create_tag("Some Star", "star")
+    video = VideoMetadata("ABC-001", "2020-01-01", [star], "", "", "", None)
+    video.title = {"en": "Title"}
+    vm.upsert([video])
+    assert index.query(tag_type="star").count == 1
+    assert index.query([star], tag_type="genre").count == 0
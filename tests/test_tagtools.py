@@ -0,0 +1,60 @@
+import pytest
+from sqlalchemy.exc import IntegrityError
+from henpy.utilities.normalize_tags import Vocabulary
+from henpy.utilities.tagtools import SQLTagManager
+
+
+def test_variant_names_resolve_to_one_tag():
+    tm = SQLTagManager("sqlite://", vocabulary=Vocabulary.build([]))
+    tag = tm.get_or_create_tag("Foo-Bar", "genre")
+    assert [(data.name, data.display_name) for data in tag.data] == [("foo bar", "Foo-Bar")]
+    assert tm.get_tag("Foo-Bar") is tag
+    assert tm.get_or_create_tags([("foo bar", "genre"), ("FOO_BAR", "genre")]) == [tag, tag]
+    assert tm.get_or_create_tag("foo  bar") is tag
+
+
+def test_managers_sharing_a_database_dont_duplicate_tags(tmp_path):
+    db = "sqlite:///" + str(tmp_path / "henpy.db")
+    a, b = SQLTagManager(db), SQLTagManager(db)
+    a.get_or_create_tag("x", "genre")
+    b.get_or_create_tag("y", "genre")
+    # The cache of a is complete, but doesn't know about the tag b created
+    assert a.cache.complete
+    [tag] = a.get_or_create_tags([("y", "genre")])
+    assert a.get_or_create_tag("y", "genre").id == tag.id == b.get_tag("y").id
+    with a.engine.connect() as conn:
+        assert conn.exec_driver_sql("SELECT count(*) FROM tag_data WHERE name = 'y'").scalar() == 1
+
+
+def test_tag_names_are_unique_per_language(tmp_path):
+    tsv = tmp_path / "tags.tsv"
+    tsv.write_text("e_type\tj_type\te_tag\tj_tag\n"
+                   "Theme\t主題\tFoo\tフー\n"
+                   "Play\tプレイ\tFoo\tフー2\n"
+                   "Play\tプレイ\tBar\tフー\n", encoding="utf-8")
+    tm = SQLTagManager("sqlite:///" + str(tmp_path / "henpy.db"))
+    stats = tm.import_tags(str(tsv))
+    assert (stats["inserted"], stats["skipped"]) == (2, 1)
+    assert [data.name for data in tm.get_tag("bar").data] == ["bar"]
+    assert tm.import_tags(str(tsv))["inserted"] == 0
+    with pytest.raises(IntegrityError):
+        tm.create_tag("foo", [("en", "genre", "foo", "foo")])
+
+
+def test_tag_created_by_another_process_is_reused(tmp_path):
+    db = "sqlite:///" + str(tmp_path / "henpy.db")
+    a, b = SQLTagManager(db), SQLTagManager(db)
+    a.get_or_create_tag("x", "genre")
+    b.get_or_create_tags([("y", "genre"), ("z", "genre")])
+    # As if b had created them between the database check of a and its insert
+    query_tags, calls = a._query_tags, []
+
+    def stale_once(names, language):
+        calls.append(names)
+        return {} if len(calls) == 1 else query_tags(names, language)
+
+    a._query_tags = stale_once
+    tags = a.get_or_create_tags([("y", "genre"), ("w", "genre")])
+    assert len(calls) == 2
+    assert tags[0].id == b.get_tag("y").id
+    assert a.get_or_create_tag("y", "genre").id == tags[0].id